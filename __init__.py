@@ -1,63 +1,24 @@
 # -*- coding: utf-8 -*-
+import concurrent.futures
+import functools
+import importlib.util
 import os.path
+import platform
 import re
 import tempfile
+import threading
+import time
 from collections import OrderedDict
 from naomi import paths
 from naomi import plugin
 from naomi import profile
 from naomi import run_command
+from . import g2p
+from . import metrics
+from . import models
+from . import recovery
 from . import sphinxvocab
-try:
-    from . import sphinxvocab
-    from .g2p import PhonetisaurusG2P
-except ModuleNotFoundError as e:
-    # Try to install phonetisaurus from pypi
-    cmd = [
-        'pip', 'install', 'phonetisaurus'
-    ]
-    completedprocess = run_command(cmd)
-    if completedprocess.returncode != 0:
-        # check what architecture we are on
-        architecture = platform.machine()
-        phonetisaurus_url = ""
-        if architecture == "x86_64":
-            wheel = "phonetisaurus-0.3.0-py3-none-manylinux1_x86_64.whl"
-        elif architecture == "arm6l":
-            wheel = "phonetisaurus-0.3.0-py3-none-linux_armv6l.whl"
-        elif architecture == "arm7l":
-            wheel = "phonetisaurus-0.3.0-py3-none-linux_armv7l.whl"
-        elif architecture == "aarch64":
-            wheel = "phonetisaurus-0.3.0-py3-none-linux_aarch64.whl"
-        else:
-            # Here we should probably build the package from source
-            raise(f"Architecture {architecture} is not supported at this time")
-        phonetisaurus_url = f"https://github.com/rhasspy/phonetisaurus-pypi/releases/download/v0.3.0/{wheel}"
-        phonetisaurus_path = paths.sub('sources', wheel)
-        cmd = [
-            'curl', '-L', '-o', phonetisaurus_path, phonetisaurus_url
-        ]
-        completedprocess = run_command(cmd)
-        if completedprocess.returncode != 0:
-            raise Exception("Unable to download file from {phonetisaurus_url}")
-        else:
-            # use pip to install the file
-            cmd = [
-                'pip',
-                'install',
-                phonetisaurus_path
-            ]
-            completedprocess = run_command(cmd)
-            if completedprocess.returncode == 0:
-                # Check if phonetisaurus is intalled
-                if importlib.util.find_spec("phonetisaurus"):
-                    from . import sphinxvocab
-                    from .g2p import PhonetisaurusG2P
-                else:
-                    raise Exception("Phonetisaurus install failed")
-            else:
-                raise Exception("Phonetisaurus install failed")
-from pocketsphinx import pocketsphinx
+from .stream import ContinuousListener, KeywordEvent, KeywordStream
 
 
 # AaronC - This searches some standard places (/bin, /usr/bin, /usr/local/bin)
@@ -74,6 +35,54 @@ def check_program_exists(program):
     return response
 
 
+def install_phonetisaurus():
+    """
+    Installs phonetisaurus from pypi, or from a prebuilt wheel for this
+    architecture if pip cannot build it. This is part of the setup step
+    (settings()) so that importing the plugin never runs an installer.
+    """
+    # Try to install phonetisaurus from pypi
+    cmd = [
+        'pip', 'install', 'phonetisaurus'
+    ]
+    completedprocess = run_command.run_command(cmd)
+    if completedprocess.returncode == 0:
+        return
+    # check what architecture we are on
+    architecture = platform.machine()
+    if architecture == "x86_64":
+        wheel = "phonetisaurus-0.3.0-py3-none-manylinux1_x86_64.whl"
+    elif architecture == "armv6l":
+        wheel = "phonetisaurus-0.3.0-py3-none-linux_armv6l.whl"
+    elif architecture == "armv7l":
+        wheel = "phonetisaurus-0.3.0-py3-none-linux_armv7l.whl"
+    elif architecture == "aarch64":
+        wheel = "phonetisaurus-0.3.0-py3-none-linux_aarch64.whl"
+    else:
+        # Here we should probably build the package from source
+        raise Exception(
+            f"Architecture {architecture} is not supported at this time"
+        )
+    phonetisaurus_url = f"https://github.com/rhasspy/phonetisaurus-pypi/releases/download/v0.3.0/{wheel}"
+    phonetisaurus_path = paths.sub('sources', wheel)
+    cmd = [
+        'curl', '-L', '-o', phonetisaurus_path, phonetisaurus_url
+    ]
+    completedprocess = run_command.run_command(cmd)
+    if completedprocess.returncode != 0:
+        raise Exception(f"Unable to download file from {phonetisaurus_url}")
+    # use pip to install the file
+    cmd = [
+        'pip',
+        'install',
+        phonetisaurus_path
+    ]
+    completedprocess = run_command.run_command(cmd)
+    # Check if phonetisaurus is intalled
+    if completedprocess.returncode != 0 or not importlib.util.find_spec("phonetisaurus"):
+        raise Exception("Phonetisaurus install failed")
+
+
 def check_pocketsphinx_model(directory):
     # Start by assuming the files exist. If any file is found to not
     # exist, then set this to False
@@ -128,24 +137,85 @@ class PocketsphinxKWSPlugin(plugin.STTPlugin):
             )
         )
 
+        # Timings and counters, see metrics_snapshot()
+        metrics.configure(
+            profile.get(['Pocketsphinx_KWS', 'metrics'], {}) or {}
+        )
+
+        # The keywords this instance was configured with. Once the model
+        # is loaded these are replaced by the keywords shared with every
+        # instance using the same decoders, see models.ModelEntry.
+        self._thresholds = OrderedDict(
+            (
+                keyword,
+                profile.get(['Pocketsphinx_KWS', 'thresholds', keyword], -30)
+            ) for keyword in keywords
+        )
+        self._keyword_set = set(keywords)
+        self._model = None
+        self._released = False
+
+        # Optional voice activity filter that keeps silence away from
+        # the decoder
+        vad_settings = profile.get(['Pocketsphinx_KWS', 'vad'], {}) or {}
+        self._vad = None
+        if vad_settings.get('enabled', False):
+            from .vad import EnergyVAD
+            self._vad = EnergyVAD.from_profile(vad_settings)
+
+        # Stop decoding at the first keyword, checking every
+        # early_exit_frames frames of audio
+        self._early_exit = profile.get(['Pocketsphinx_KWS', 'early_exit'], False)
+
+        # Compiling the vocabulary and loading the model take a while.
+        # With async_init they run in a background thread and
+        # construction returns at once; ready is resolved when they are
+        # done. transcribe() calls made before then follow
+        # not_ready_policy: 'wait' up to ready_timeout seconds, or
+        # 'empty' to return no keywords straight away.
+        self._ready = concurrent.futures.Future()
+        self._not_ready_policy = profile.get(
+            ['Pocketsphinx_KWS', 'not_ready_policy'],
+            'wait'
+        )
+        self._ready_timeout = float(
+            profile.get(['Pocketsphinx_KWS', 'ready_timeout'], 10)
+        )
+        self._warm_up_enabled = profile.get(
+            ['Pocketsphinx_KWS', 'warm_up'],
+            True
+        )
+        if profile.get(['Pocketsphinx_KWS', 'async_init'], False):
+            threading.Thread(
+                target=self._initialize_in_background,
+                name='kws-init',
+                daemon=True
+            ).start()
+        else:
+            try:
+                self._initialize()
+            except BaseException as e:
+                self._ready.set_exception(e)
+                raise
+            self._ready.set_result(True)
+            if self._warm_up_enabled:
+                threading.Thread(
+                    target=self._warm_up_quietly,
+                    name='kws-warm-up',
+                    daemon=True
+                ).start()
+
+    def _initialize(self):
+        # The slow part of construction: compiles the vocabulary, checks
+        # the model and sets up the decoder pool
         vocabulary_path = self.compile_vocabulary(
             sphinxvocab.compile_vocabulary
         )
 
         dict_path = sphinxvocab.get_dictionary_path(vocabulary_path)
         thresholds_path = sphinxvocab.get_thresholds_path(vocabulary_path)
-        msg = " ".join([
-            "Creating thresholds file '{}'",
-            "See README.md for more information."
-        ]).format(thresholds_path)
-        print(msg)
-        with open(thresholds_path, 'w') as f:
-            for keyword in keywords:
-                threshold = profile.get(['Pocketsphinx_KWS', 'thresholds', keyword], -30)
-                if(threshold < 0):
-                    f.write("{}\t/1e{}/\n".format(keyword, threshold))
-                else:
-                    f.write("{}\t/1e+{}/\n".format(keyword, threshold))
+        self._dict_path = dict_path
+        self._thresholds_path = thresholds_path
         hmm_dir = profile.get(['pocketsphinx', 'hmm_dir'])
         # Perform some checks on the hmm_dir so that we can display more
         # meaningful error messages if neccessary
@@ -156,23 +226,13 @@ class PocketsphinxKWSPlugin(plugin.STTPlugin):
             ]).format(hmm_dir)
             self._logger.error(msg)
             raise RuntimeError(msg)
-        # Lets check if all required files are there. Refer to:
-        # http://cmusphinx.sourceforge.net/wiki/acousticmodelformat
-        # for details
-        missing_hmm_files = []
-        for fname in ('mdef', 'feat.params', 'means', 'noisedict',
-                      'transition_matrices', 'variances'):
-            if not os.path.exists(os.path.join(hmm_dir, fname)):
-                missing_hmm_files.append(fname)
-        mixweights = os.path.exists(os.path.join(hmm_dir, 'mixture_weights'))
-        sendump = os.path.exists(os.path.join(hmm_dir, 'sendump'))
-        if not mixweights and not sendump:
-            # We only need mixture_weights OR sendump
-            missing_hmm_files.append('mixture_weights or sendump')
+        # Lets check if all required files are there. The result is
+        # cached, so later instances do not check again.
+        missing_hmm_files = models.registry.missing_files(hmm_dir)
         if missing_hmm_files:
             self._logger.warning(
                 " ".join([
-                    "hmm_dir '%s' is missing files: %s.",
+                    "hmm_dir '{}' is missing files: {}.",
                     "Please make sure that you have set the correct",
                     "hmm_dir in your profile."
                 ]).format(hmm_dir, ', '.join(missing_hmm_files))
@@ -185,16 +245,130 @@ class PocketsphinxKWSPlugin(plugin.STTPlugin):
             self._logfile = f.name
             self._logger.info('Pocketsphinx log file: {}'.format(self._logfile))
 
-        # Pocketsphinx v5
-        self._config = pocketsphinx.Config(
-            hmm=hmm_dir,
-            kws=thresholds_path,
-            dict=dict_path
+        # Each concurrent transcribe() call or streaming session gets
+        # its own decoder from the pool. Decoders are created on first
+        # use, or by a background warm-up thread. Plugin instances in
+        # this process using the same model, dictionary and keyword file
+        # share one pool and one set of keywords, see models.py. The
+        # thresholds file is only rewritten if the thresholds changed.
+        model, written = models.registry.acquire(
+            hmm_dir,
+            dict_path,
+            thresholds_path,
+            self._thresholds,
+            profile.get(['Pocketsphinx_KWS', 'decoder_pool_size'], 1)
+        )
+        if written:
+            msg = " ".join([
+                "Creating thresholds file '{}'",
+                "See README.md for more information."
+            ]).format(thresholds_path)
+            print(msg)
+        self._model = model
+        self._config = model.config
+        self._pool = model.pool
+        self._thresholds = model.thresholds
+        self._keyword_set = model.keyword_set
+        # Retries, decoder rebuilds and a circuit breaker for decoder
+        # faults in transcribe()
+        self._recovery = recovery.DecoderRecovery.from_profile(
+            profile.get(['Pocketsphinx_KWS', 'recovery'], {}) or {},
+            self.reinit,
+            self._pool.replace,
+            self._probe_decoder
+        )
+        self._recovery.add_listener(self._on_recovery_event)
+        self._early_exit_frames = int(
+            profile.get(['Pocketsphinx_KWS', 'early_exit_frames'], 10)
         )
-        self._ps = pocketsphinx.Decoder(self._config)
+
+    def _initialize_in_background(self):
+        try:
+            self._initialize()
+        except BaseException as e:
+            self._logger.error(
+                "Unable to initialize Pocketsphinx_KWS: {}".format(e)
+            )
+            self._ready.set_exception(e)
+            return
+        self._ready.set_result(True)
+        self._logger.info("Pocketsphinx_KWS is ready")
+        if self._warm_up_enabled:
+            self._warm_up_quietly()
+
+    @property
+    def ready(self):
+        """
+        Returns:
+            A concurrent.futures.Future resolved once the plugin is ready
+            to decode, or failed with the initialization error
+        """
+        return self._ready
+
+    def wait_ready(self, timeout=None):
+        """
+        Waits for initialization to finish.
+
+        Arguments:
+            timeout -- the maximum number of seconds to wait, or None to
+                       wait forever
+
+        Returns:
+            True if the plugin is ready, False if the timeout ran out
+
+        Raises:
+            The initialization error if initialization failed
+        """
+        try:
+            return self._ready.result(timeout)
+        except concurrent.futures.TimeoutError:
+            return False
+
+    def _ready_for_decoding(self):
+        # Applies not_ready_policy, returns True if transcribe() can go
+        # ahead
+        if self._ready.done():
+            return self._ready.result()
+        if self._not_ready_policy == 'empty':
+            self._logger.debug('Not ready yet, ignoring audio')
+            return False
+        if not self.wait_ready(self._ready_timeout):
+            self._logger.warning(
+                'Not ready after {} seconds, ignoring audio'.format(
+                    self._ready_timeout
+                )
+            )
+            return False
+        return True
+
+    def warm_up(self):
+        """
+        Decodes a short silence, so that a decoder exists and the pages
+        of the acoustic model have been read before the first real
+        utterance arrives.
+        """
+        self.wait_ready()
+        samplerate = int(self._config['samprate'])
+        with self._pool.decoder() as ps:
+            ps.start_utt()
+            ps.process_raw(bytes(samplerate // 2 * 2), False, True)
+            ps.end_utt()
+
+    def _warm_up_quietly(self):
+        try:
+            self.warm_up()
+        except Exception as e:
+            # transcribe() will try again and report the error
+            self._logger.error(
+                "Unable to create PocketSphinx decoder: {}".format(e)
+            )
 
     # Your plugin will probably rely on some profile settings:
     def settings(self):
+        # Dependencies are installed here, as part of setup, rather than
+        # when the plugin is imported
+        if importlib.util.find_spec('phonetisaurus') is None:
+            install_phonetisaurus()
         language = profile.get(['language'])
         # Get the defaults for settings
         # hmm_dir
@@ -283,11 +457,14 @@ class PocketsphinxKWSPlugin(plugin.STTPlugin):
                 "cmudict.dict"
             )
             if (not os.path.isfile(fst_model)):
-                # Use phonetisaurus to prepare an fst model
-                print("Training an FST model")
-                PhonetisaurusG2P.train_fst(
+                # Use phonetisaurus to prepare an fst model. This runs in
+                # the background, vocabulary compilation waits for it.
+                print("Training an FST model in the background")
+                g2p.start_training(
                     cmudict_path,
-                    fst_model
+                    fst_model,
+                    index_file=sphinxvocab.get_lexicon_index_path(hmm_dir),
+                    cache_dir=sphinxvocab.get_fst_cache_path()
                 )
 
         _ = self.gettext
@@ -305,41 +482,330 @@ class PocketsphinxKWSPlugin(plugin.STTPlugin):
             ]
         )
 
-    def reinit(self):
+    def close(self):
+        """
+        Gives up this instance's share of the decoders. The decoders
+        are freed once every instance sharing them has been closed.
+        Streams opened from this instance keep working until they are
+        closed themselves.
+        """
+        try:
+            self.wait_ready()
+        except Exception:
+            # Initialization failed, so nothing was acquired
+            return
+        if self._model is not None and not self._released:
+            self._released = True
+            models.registry.release(self._model)
+
+    def reinit(self, decoder):
         self._logger.debug(
-            "Re-initializing PocketSphinx Decoder {self._vocabulary_name}"
+            "Re-initializing PocketSphinx Decoder {}".format(
+                self._vocabulary_name
+            )
         )
+        metrics.registry.inc('reinit_total')
         # Pocketsphinx v5
-        self._ps.reinit(self._config)
+        decoder.reinit(self._config)
+
+    def _probe_decoder(self):
+        # Replaces an idle decoder with a new one and makes sure that it
+        # can decode a short silence. If every decoder stays busy for a
+        # whole probe interval the TimeoutError counts as a failed probe,
+        # so the recovery thread never blocks on a saturated pool.
+        decoder = self._pool.checkout(self._recovery.probe_interval)
+        try:
+            decoder = self._pool.replace(decoder)
+            decoder.start_utt()
+            decoder.process_raw(bytes(3200), False, True)
+            decoder.end_utt()
+        finally:
+            self._pool.checkin(decoder)
+
+    def _on_recovery_event(self, event):
+        self._logger.warning(
+            "Decoder recovery: {} (attempt {}, {})".format(
+                event.event,
+                event.attempt,
+                event.error
+            )
+        )
+        metrics.registry.inc('recovery_events_total', event=event.event)
+
+    def recovery_state(self):
+        """
+        Returns:
+            'closed' while decoding normally, 'open' while transcribe()
+            fails fast after repeated decoder faults
+        """
+        self.wait_ready()
+        return self._recovery.state
+
+    def metrics_snapshot(self):
+        """
+        Returns:
+            The current values of all metrics, see metrics.Metrics.snapshot()
+        """
+        return metrics.registry.snapshot()
+
+    def decoder_pool_stats(self):
+        """
+        Returns:
+            A dict with the decoder pool size and wait time metrics
+        """
+        self.wait_ready()
+        return self._pool.stats()
+
+    def reserve_decoders(self, count):
+        """
+        Lets the decoder pool grow to at least count decoders, for
+        example one for each stream a server expects. Decoders are still
+        only created when they are needed.
+        """
+        self.wait_ready()
+        self._pool.grow(count)
+
+    def start_stream(self, timeout=None):
+        """
+        Opens a streaming keyword spotting session. Push PCM chunks to
+        the returned session with process() as they arrive and a
+        KeywordEvent is returned as soon as the spotter fires.
+
+        The session holds one decoder from the pool until it is closed.
+
+        Arguments:
+            timeout -- the maximum number of seconds to wait for a free
+                       decoder, or None to wait forever
+
+        Returns:
+            A stream.KeywordStream
+        """
+        self.wait_ready()
+        decoder = self._pool.checkout(timeout)
+        try:
+            return KeywordStream(
+                decoder,
+                self._keyword_set,
+                on_close=self._pool.checkin,
+                on_restart=self._pool.refresh,
+                is_current=self._pool.is_current
+            )
+        except BaseException:
+            self._pool.checkin(decoder)
+            raise
+
+    def start_listening(self, timeout=None):
+        """
+        Starts continuous listening on a decoder from the pool, see
+        stream.ContinuousListener. The reset interval and overlap come
+        from the Pocketsphinx_KWS.continuous profile section.
+
+        Arguments:
+            timeout -- the maximum number of seconds to wait for a free
+                       decoder, or None to wait forever
+
+        Returns:
+            A ContinuousListener. Close it (or use it as a context
+            manager) to return the decoder to the pool.
+        """
+        settings = profile.get(['Pocketsphinx_KWS', 'continuous'], {}) or {}
+        self.wait_ready()
+        decoder = self._pool.checkout(timeout)
+        try:
+            return ContinuousListener(
+                decoder,
+                self._keyword_set,
+                reset_interval=float(settings.get('reset_interval', 30.0)),
+                overlap=float(settings.get('overlap', 1.5)),
+                on_close=self._pool.checkin,
+                on_restart=self._pool.refresh,
+                is_current=self._pool.is_current
+            )
+        except BaseException:
+            self._pool.checkin(decoder)
+            raise
+
+    def add_keyword(self, keyword, threshold=-30):
+        """
+        Adds a keyword (or changes the threshold of an existing one)
+        without rebuilding the decoder. Pronunciations are looked up
+        only for words that are not in the dictionary yet, and each
+        decoder switches to the new keyword search at its next
+        utterance boundary, so listening never stops. Other instances
+        sharing this instance's decoders (see models.py) listen for the
+        keyword too.
+
+        Arguments:
+            keyword -- the keyword or key phrase to listen for
+            threshold -- the detection threshold, see README.md
+
+        Raises:
+            ValueError if no pronunciation can be found for a word of
+            the keyword. The keywords are left unchanged.
+        """
+        keyword = keyword.lower()
+        self.wait_ready()
+        self._model.add_keyword(keyword, threshold)
+        self._vocabulary_phrases[:] = list(self._thresholds)
+        self._logger.info(
+            "Keyword '{}' set with threshold {}".format(keyword, threshold)
+        )
+
+    def set_threshold(self, keyword, threshold):
+        """
+        Changes the threshold of an existing keyword at runtime.
+        """
+        keyword = keyword.lower()
+        if keyword not in self._thresholds:
+            raise KeyError(keyword)
+        self.add_keyword(keyword, threshold)
+
+    def remove_keyword(self, keyword):
+        """
+        Stops listening for a keyword at runtime. Its dictionary entries
+        are kept, so adding it back later is cheap.
+        """
+        keyword = keyword.lower()
+        self.wait_ready()
+        self._model.remove_keyword(keyword)
+        self._vocabulary_phrases[:] = list(self._thresholds)
+        self._logger.info("Keyword '{}' removed".format(keyword))
 
     # The only method you really have to override to instantiate a
     # STT plugin is the transcribe() method, which recieves a pointer
     # to the file containing the audio to be transcribed:
+    @staticmethod
+    def _decode(audio_data, ps):
+        from . import offline
+        return offline.decode(audio_data, ps)
+
+    def _decode_early_exit(self, audio_data, ps):
+        # Stops at the first keyword, see offline.decode_early_exit()
+        from . import offline
+        detections, _ = offline.decode_early_exit(
+            audio_data,
+            self._early_exit_frames,
+            ps,
+            self._keyword_set
+        )
+        return detections
+
+    def _prepare_audio(self, fp):
+        # Loads and filters the audio for transcribe() and spot().
+        # Returns the PCM bytes, the length of the clip in seconds and
+        # the regions the voice activity filter kept, or None without
+        # the filter.
+        from . import audio
+        samplerate = int(self._config['samprate'])
+        samples = audio.load_audio(fp, samplerate)
+        audio_seconds = len(samples) / samplerate
+        metrics.registry.inc('transcribe_total')
+        metrics.registry.inc('audio_seconds_total', audio_seconds)
+        regions = None
+        if self._vad is not None:
+            samples, regions = self._vad.filter_regions(samples, samplerate)
+        return audio.as_bytes(samples), audio_seconds, regions
+
+    def _input_frame(self, regions, frame):
+        # Maps a frame of VAD filtered audio back to the input clip
+        from .vad import map_sample
+        samplerate = int(self._config['samprate'])
+        frate = int(self._config['frate'])
+        return (
+            map_sample(regions, frame * samplerate // frate)
+            * frate // samplerate
+        )
+
+    def _run_decode(self, decode, audio_data, audio_seconds):
+        # Runs decode on a decoder from the pool with fault recovery
+        # and records the decoding metrics
+        if not audio_data or self._recovery.state == recovery.OPEN:
+            # Nothing to decode, or failing fast while the decoder is
+            # being rebuilt
+            return []
+        start = time.perf_counter()
+        ps = self._pool.checkout()
+        try:
+            detections, ps = self._recovery.run(
+                ps,
+                functools.partial(decode, audio_data)
+            )
+        except recovery.DecoderUnavailable as e:
+            ps = e.decoder
+            self._logger.debug(str(e))
+            return []
+        finally:
+            self._pool.checkin(ps)
+        decode_time = time.perf_counter() - start
+        metrics.registry.observe('decode_seconds', decode_time)
+        if audio_seconds:
+            metrics.registry.observe(
+                'real_time_factor',
+                decode_time / audio_seconds
+            )
+        segments = []
+        for word, start_frame, end_frame, score in detections:
+            if word in self._keyword_set:
+                metrics.registry.inc('detections_total', keyword=word)
+                segments.append(
+                    KeywordEvent(word, start_frame, end_frame, score)
+                )
+        return segments
+
+    def spot(self, fp):
+        """
+        Looks for the first keyword in an audio clip. Decoding stops as
+        soon as the spotter fires, so the rest of the clip is skipped.
+
+        Arguments:
+            fp -- the audio, anything accepted by transcribe()
+
+        Returns:
+            A stream.KeywordEvent with the keyword, its frame offset in
+            the clip and its score, or None if no keyword was found.
+            With the voice activity filter enabled, the frames still
+            count from the start of the unfiltered clip.
+        """
+        if not self._ready_for_decoding():
+            return None
+        audio_data, audio_seconds, regions = self._prepare_audio(fp)
+        events = self._run_decode(
+            self._decode_early_exit,
+            audio_data,
+            audio_seconds
+        )
+        if not events:
+            return None
+        event = events[0]
+        if regions is not None:
+            event = event._replace(
+                start_frame=self._input_frame(regions, event.start_frame),
+                end_frame=self._input_frame(regions, event.end_frame)
+            )
+        return event
+
     def transcribe(self, fp):
         """
         Performs STT, transcribing an audio file and returning the result.
 
+        With the Pocketsphinx_KWS.early_exit profile setting, decoding
+        stops at the first keyword, see spot().
+
         Arguments:
-            fp -- a file object containing audio data
+            fp -- a file object containing audio data. A path, raw bytes
+                  or a NumPy array are accepted as well, see
+                  audio.load_audio()
         """
-        transcribed = []
-        fp.seek(44)
-        audio_data = fp.read()
-        while True:
-            try:
-                self._ps.start_utt()
-                self._ps.process_raw(audio_data, False, True)
-                self._ps.end_utt()
-                segs = self._ps.seg()
-                if segs:
-                    for s in self._ps.seg():
-                        # For some reason, the word comes back from the keyword spotter
-                        # with whitespace at the end. I guess from the kws.thresholds
-                        # file? So strip the word before comparing
-                        word = s.word.strip()
-                        if(word in self._vocabulary_phrases):
-                            transcribed.append(word)
-                break
-            except RuntimeError as e:
-                self.reinit()
-        return transcribed
+        if self._early_exit:
+            event = self.spot(fp)
+            return [event.keyword] if event is not None else []
+        if not self._ready_for_decoding():
+            return []
+        audio_data, audio_seconds, _ = self._prepare_audio(fp)
+        return [
+            event.keyword for event in self._run_decode(
+                self._decode,
+                audio_data,
+                audio_seconds
+            )
+        ]
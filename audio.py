@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+Audio ingestion for the keyword spotter.
+
+load_audio() accepts a WAV file (path or file object), raw bytes or a
+NumPy array and returns 16 bit mono samples at the sample rate of the
+acoustic model. Files are memory mapped and the data chunk is viewed in
+place, so a canonical 16 bit mono WAV at the right rate is never copied.
+"""
+import io
+import mmap
+import os
+import struct
+import numpy as np
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+RIFF_HEADER = struct.Struct('<4sI4s')
+CHUNK_HEADER = struct.Struct('<4sI')
+FMT_CHUNK = struct.Struct('<HHIIHH')
+
+
+class WavFormat(object):
+    __slots__ = ('format_tag', 'channels', 'samplerate', 'bits_per_sample')
+
+    def __init__(self, format_tag, channels, samplerate, bits_per_sample):
+        self.format_tag = format_tag
+        self.channels = channels
+        self.samplerate = samplerate
+        self.bits_per_sample = bits_per_sample
+
+    def __repr__(self):
+        return 'WavFormat(format_tag={}, channels={}, samplerate={}, bits_per_sample={})'.format(
+            self.format_tag,
+            self.channels,
+            self.samplerate,
+            self.bits_per_sample
+        )
+
+
+def parse_wav(buffer):
+    """
+    Walks the RIFF chunks of a WAV file held in buffer.
+
+    Arguments:
+        buffer -- any bytes-like object containing a complete WAV file
+
+    Returns:
+        A tuple of a WavFormat and a memoryview of the data chunk (no
+        data is copied)
+
+    Raises:
+        ValueError if the buffer is not a WAV file this module can read
+    """
+    view = memoryview(buffer)
+    if len(view) < RIFF_HEADER.size:
+        raise ValueError('Not a WAV file: too short')
+    riff, _, wave_id = RIFF_HEADER.unpack_from(view, 0)
+    if riff != b'RIFF' or wave_id != b'WAVE':
+        raise ValueError('Not a WAV file: missing RIFF/WAVE header')
+    fmt = None
+    offset = RIFF_HEADER.size
+    while offset + CHUNK_HEADER.size <= len(view):
+        chunk_id, size = CHUNK_HEADER.unpack_from(view, offset)
+        offset += CHUNK_HEADER.size
+        if chunk_id == b'fmt ':
+            format_tag, channels, samplerate, _, _, bits = (
+                FMT_CHUNK.unpack_from(view, offset)
+            )
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and size >= 26:
+                # The real format is the first two bytes of the sub
+                # format GUID
+                format_tag = struct.unpack_from('<H', view, offset + 24)[0]
+            fmt = WavFormat(format_tag, channels, samplerate, bits)
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise ValueError('WAV data chunk found before fmt chunk')
+            # Some writers leave the size of a streamed data chunk at 0
+            # or 0xFFFFFFFF, in which case the data runs to the end
+            end = offset + size
+            if size == 0 or end > len(view):
+                end = len(view)
+            return fmt, view[offset:end]
+        # Chunks are padded to an even number of bytes
+        offset += size + (size & 1)
+    raise ValueError('WAV file has no data chunk')
+
+
+def _decode_samples(fmt, data):
+    """
+    Returns:
+        A 2d array of shape (frames, channels). 16 bit PCM is returned as
+        an int16 view of data, anything else is converted to float32 in
+        the int16 range.
+    """
+    bits = fmt.bits_per_sample
+    if fmt.format_tag == WAVE_FORMAT_PCM:
+        if bits == 16:
+            samples = np.frombuffer(data, dtype='<i2')
+        elif bits == 8:
+            # 8 bit WAV is unsigned
+            samples = (
+                np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128
+            ) * 256
+        elif bits == 24:
+            raw = np.frombuffer(data, dtype=np.uint8)
+            raw = raw[:len(raw) - len(raw) % 3].reshape(-1, 3)
+            samples = (
+                raw[:, 0].astype(np.int32)
+                | (raw[:, 1].astype(np.int32) << 8)
+                | (raw[:, 2].astype(np.int8).astype(np.int32) << 16)
+            ).astype(np.float32) / 256
+        elif bits == 32:
+            samples = np.frombuffer(data, dtype='<i4').astype(np.float32) / 65536
+        else:
+            raise ValueError('Unsupported PCM sample size: {}'.format(bits))
+    elif fmt.format_tag == WAVE_FORMAT_IEEE_FLOAT:
+        if bits == 32:
+            samples = np.frombuffer(data, dtype='<f4') * 32767
+        elif bits == 64:
+            samples = np.frombuffer(data, dtype='<f8') * 32767
+        else:
+            raise ValueError('Unsupported float sample size: {}'.format(bits))
+    else:
+        raise ValueError(
+            'Unsupported WAV format tag: 0x{:04x}'.format(fmt.format_tag)
+        )
+    channels = max(1, fmt.channels)
+    samples = samples[:len(samples) - len(samples) % channels]
+    return samples.reshape(-1, channels)
+
+
+def downmix(samples):
+    """
+    Averages the channels of a (frames, channels) array.
+
+    Returns:
+        A 1d array. Mono int16 input is returned unchanged.
+    """
+    if samples.ndim == 1:
+        return samples
+    if samples.shape[1] == 1:
+        return samples[:, 0]
+    return samples.mean(axis=1, dtype=np.float32)
+
+
+def resample(samples, from_rate, to_rate):
+    """
+    Resamples a 1d array. Integer downsampling ratios (48 kHz to 16 kHz
+    for example) average each group of samples, which also filters out
+    most of the content above the new Nyquist frequency. Other ratios
+    use linear interpolation.
+    """
+    if from_rate == to_rate or len(samples) == 0:
+        return samples
+    if from_rate > to_rate and from_rate % to_rate == 0:
+        factor = from_rate // to_rate
+        usable = len(samples) - len(samples) % factor
+        return samples[:usable].reshape(-1, factor).mean(
+            axis=1,
+            dtype=np.float32
+        )
+    duration = len(samples) / from_rate
+    count = int(round(duration * to_rate))
+    positions = np.arange(count, dtype=np.float64) * (from_rate / to_rate)
+    return np.interp(
+        positions,
+        np.arange(len(samples), dtype=np.float64),
+        samples
+    ).astype(np.float32)
+
+
+def to_int16(samples):
+    """
+    Returns:
+        A C contiguous, native byte order int16 array. Arrays that are
+        already in that form are returned as is.
+    """
+    if samples.dtype == np.int16 and samples.flags['C_CONTIGUOUS']:
+        return samples
+    if samples.dtype.kind == 'i' and samples.dtype.itemsize == 2:
+        # int16 in non-native byte order
+        return np.ascontiguousarray(samples.astype(np.int16))
+    return np.clip(np.rint(samples), -32768, 32767).astype(np.int16)
+
+
+def _map_file(f):
+    size = os.fstat(f.fileno()).st_size
+    if size == 0:
+        return b''
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _read_source(source):
+    """
+    Returns:
+        A bytes-like object holding the whole of source, without
+        copying where possible
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            # The mapping stays valid after the file is closed
+            return _map_file(f)
+    if isinstance(source, io.BytesIO):
+        return source.getbuffer()
+    try:
+        source.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        source.seek(0)
+        return source.read()
+    # Make sure anything written through the file object is visible
+    # to the mapping
+    if source.writable():
+        source.flush()
+    return _map_file(source)
+
+
+def load_audio(source, samplerate=16000):
+    """
+    Loads audio for the decoder.
+
+    Arguments:
+        source -- a path or file object of a WAV file, bytes holding a
+                  WAV file or raw 16 bit mono PCM at samplerate, or a
+                  NumPy array of shape (frames,) or (frames, channels).
+                  Float arrays are expected in the range -1.0 to 1.0,
+                  integer arrays in the int16 range. Arrays are assumed
+                  to be at samplerate already.
+        samplerate -- the sample rate of the acoustic model
+
+    Returns:
+        A 1d int16 NumPy array of mono samples at samplerate
+    """
+    if isinstance(source, np.ndarray):
+        samples = source
+        if samples.dtype.kind == 'f':
+            samples = samples * 32767
+        return to_int16(downmix(samples))
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        buffer = source
+    else:
+        buffer = _read_source(source)
+    if bytes(buffer[:4]) != b'RIFF':
+        # Headerless 16 bit mono PCM
+        view = memoryview(buffer)
+        return np.frombuffer(view[:len(view) - len(view) % 2], dtype=np.int16)
+    fmt, data = parse_wav(buffer)
+    samples = downmix(_decode_samples(fmt, data))
+    samples = resample(samples, fmt.samplerate, samplerate)
+    return to_int16(samples)
+
+
+def as_bytes(samples):
+    """
+    Returns:
+        A byte view of an int16 array, suitable for process_raw(),
+        without copying it
+    """
+    return memoryview(samples).cast('B')
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Runs the keyword spotter over a large set of saved recordings.
+
+The recordings are spread across a pool of worker processes, each with
+its own decoder (see offline.py), and one JSON line per recording is
+written in input order as soon as it and every recording before it are
+done:
+
+    {"file": "a.wav", "duration": 2.5, "keywords": ["naomi"],
+     "detections": [["naomi", 112, 160, -1234]]}
+
+Recordings that cannot be decoded get an "error" instead. If the output
+file already exists, recordings it lists are skipped, so an interrupted
+run can be resumed by running the same command again.
+
+    python -m pocketsphinx_kws.batch recordings/ --hmm ~/model/en-us \\
+        --dict ~/.config/naomi/vocabularies/.../dictionary \\
+        --kws ~/.config/naomi/vocabularies/.../kws.thresholds \\
+        -o results.jsonl
+"""
+import argparse
+import collections
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from . import offline
+
+# Recordings queued per worker ahead of the one being written, so that
+# workers never wait for the writer but memory use stays bounded
+QUEUE_PER_WORKER = 16
+
+
+def find_recordings(paths):
+    """
+    Arguments:
+        paths -- WAV files and directories to search for WAV files
+
+    Returns:
+        A list of WAV files. Directories are searched recursively and
+        their files sorted, files given directly keep their order.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = []
+            for root, _, names in os.walk(path):
+                found.extend(
+                    os.path.join(root, name) for name in names
+                    if name.lower().endswith('.wav')
+                )
+            files.extend(sorted(found))
+        else:
+            files.append(path)
+    return files
+
+
+def read_finished(output_path):
+    """
+    Reads the recordings already listed in a previous run's output. A
+    line cut off by an interrupted run is removed from the file.
+
+    Returns:
+        A set of file names
+    """
+    finished = set()
+    if not os.path.isfile(output_path):
+        return finished
+    with open(output_path, 'r+b') as f:
+        good = 0
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                finished.add(json.loads(line)['file'])
+            except (ValueError, KeyError):
+                break
+            good += len(line)
+        f.truncate(good)
+    return finished
+
+
+def decode_recording(path):
+    """
+    Decodes one recording with this worker's decoder.
+
+    Returns:
+        A result dict for the JSONL output
+    """
+    try:
+        result = offline.decode_file(path)
+    except Exception as e:
+        return {'file': path, 'error': '{}: {}'.format(type(e).__name__, e)}
+    result['keywords'] = [d[0] for d in result['detections']]
+    return result
+
+
+def transcribe_files(files, hmm_dir, dict_path, kws_path, workers=None):
+    """
+    Decodes files across a pool of worker processes.
+
+    Yields:
+        decode_recording() results, in the same order as files
+    """
+    workers = workers or os.cpu_count() or 1
+    args = offline.decoder_args(hmm_dir, dict_path, kws_path)
+    files = iter(files)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=offline.init_worker,
+        initargs=(args,)
+    ) as executor:
+        pending = collections.deque()
+        for path in files:
+            pending.append(executor.submit(decode_recording, path))
+            if len(pending) >= workers * QUEUE_PER_WORKER:
+                break
+        while pending:
+            result = pending.popleft().result()
+            for path in files:
+                pending.append(executor.submit(decode_recording, path))
+                break
+            yield result
+
+
+def run(files, output, hmm_dir, dict_path, kws_path, workers=None,
+        resume=True, progress=None):
+    """
+    Decodes files and writes one JSON line per recording to output.
+
+    Arguments:
+        files -- the WAV files to decode
+        output -- path of the JSONL file, or a file object
+        resume -- skip files already listed in an existing output file
+        progress -- optional callable receiving (done, total) after
+                    every recording
+
+    Returns:
+        A dict with the number of recordings decoded, skipped and
+        failed
+    """
+    logger = logging.getLogger(__name__)
+    skipped = 0
+    if isinstance(output, str):
+        if resume:
+            finished = read_finished(output)
+            remaining = [path for path in files if path not in finished]
+            skipped = len(files) - len(remaining)
+            files = remaining
+        else:
+            open(output, 'w').close()
+        if skipped:
+            logger.info('Skipping %d recordings from a previous run', skipped)
+        f = open(output, 'a')
+    else:
+        f = output
+    decoded = failed = 0
+    try:
+        for result in transcribe_files(
+            files,
+            hmm_dir,
+            dict_path,
+            kws_path,
+            workers
+        ):
+            f.write(json.dumps(result) + '\n')
+            f.flush()
+            decoded += 1
+            if 'error' in result:
+                failed += 1
+                logger.warning('%s: %s', result['file'], result['error'])
+            if progress is not None:
+                progress(decoded, len(files))
+    finally:
+        if f is not output:
+            f.close()
+    return {'decoded': decoded, 'skipped': skipped, 'failed': failed}
+
+
+class ProgressReporter(object):
+    """
+    Prints progress to stderr at most once per interval seconds.
+    """
+
+    def __init__(self, interval=2.0):
+        self.interval = interval
+        self._start = time.monotonic()
+        self._last = 0.0
+
+    def __call__(self, done, total):
+        now = time.monotonic()
+        if now - self._last < self.interval and done < total:
+            return
+        self._last = now
+        elapsed = now - self._start
+        rate = done / elapsed if elapsed else 0.0
+        eta = (total - done) / rate if rate else 0.0
+        sys.stderr.write(
+            '\r{}/{} recordings, {:.1f}/s, {:.0f}s left '.format(
+                done, total, rate, eta
+            )
+        )
+        if done >= total:
+            sys.stderr.write('\n')
+        sys.stderr.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Spot keywords in many recordings at once'
+    )
+    parser.add_argument('paths', nargs='+',
+                        help='WAV files or directories containing them')
+    parser.add_argument('--hmm', required=True,
+                        help='pocketsphinx acoustic model directory')
+    parser.add_argument('--dict', required=True,
+                        help='pronunciation dictionary containing the keywords')
+    parser.add_argument('--kws', required=True,
+                        help='keyword thresholds file')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of decoding processes (default: all CPUs)')
+    parser.add_argument('-o', '--output',
+                        help='JSONL output file (default: stdout)')
+    parser.add_argument('--no-resume', action='store_true',
+                        help='decode everything again, overwriting output')
+    parser.add_argument('--quiet', action='store_true',
+                        help='do not report progress')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    files = find_recordings(args.paths)
+    summary = run(
+        files,
+        args.output or sys.stdout,
+        args.hmm,
+        args.dict,
+        args.kws,
+        workers=args.workers,
+        resume=not args.no_resume,
+        progress=None if args.quiet else ProgressReporter()
+    )
+    logging.getLogger(__name__).info(
+        'Decoded %d recordings (%d failed), skipped %d',
+        summary['decoded'],
+        summary['failed'],
+        summary['skipped']
+    )
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the Pocketsphinx_KWS plugin.
+
+Run from the directory containing the plugin with Naomi installed:
+
+    python -m pocketsphinx_kws.benchmark --corpus ~/kws_corpus -o bench.json
+
+If the corpus directory does not contain any .wav files, a synthetic
+corpus is generated in it first. The time taken to import the plugin is
+measured as well. Results are written as JSON so that runs from
+different releases can be compared.
+"""
+import argparse
+import glob
+import json
+import logging
+import math
+import os
+import platform
+import random
+import resource
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import wave
+
+# Keyword list sizes used by the vocabulary compilation benchmark
+COMPILE_SIZES = (1, 10, 100, 1000)
+# Modules that should not be loaded just by importing the plugin
+HEAVY_MODULES = ('pocketsphinx', 'phonetisaurus', 'numpy')
+
+# Imports the plugin package in a fresh interpreter and reports how long
+# it took and which heavy modules were loaded as a side effect
+IMPORT_SCRIPT = '''
+import importlib.util, json, sys, time
+path = sys.argv[1]
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location(
+    'pocketsphinx_kws',
+    path + '/__init__.py',
+    submodule_search_locations=[path]
+)
+module = importlib.util.module_from_spec(spec)
+sys.modules[spec.name] = module
+spec.loader.exec_module(module)
+seconds = time.perf_counter() - start
+print(json.dumps({
+    'seconds': seconds,
+    'heavy_modules': [m for m in sys.argv[2:] if m in sys.modules]
+}))
+'''
+
+
+def peak_rss():
+    """
+    Returns:
+        The peak resident set size of this process in bytes
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    if sys.platform == 'darwin':
+        return rss
+    return rss * 1024
+
+
+def generate_corpus(directory, count=20, seconds=3.0, samplerate=16000,
+                    seed=0):
+    """
+    Writes a reproducible set of synthetic WAV clips: low level noise
+    with a burst of tones in the middle of each clip, roughly shaped
+    like a short spoken word.
+
+    Returns:
+        A sorted list of the generated file names
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    nsamples = int(seconds * samplerate)
+    for n in range(count):
+        burst_start = rng.randint(nsamples // 4, nsamples // 2)
+        burst_length = rng.randint(samplerate // 4, samplerate // 2)
+        tones = [rng.uniform(150, 900) for _ in range(3)]
+        samples = []
+        for i in range(nsamples):
+            value = rng.gauss(0, 200)
+            if burst_start <= i < burst_start + burst_length:
+                t = i / samplerate
+                value += sum(
+                    3000 * math.sin(2 * math.pi * tone * t) for tone in tones
+                )
+            samples.append(max(-32768, min(32767, int(value))))
+        path = os.path.join(directory, 'clip_{:04d}.wav'.format(n))
+        with wave.open(path, 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(samplerate)
+            w.writeframes(struct.pack('<{}h'.format(nsamples), *samples))
+        files.append(path)
+    return files
+
+
+def load_corpus(directory):
+    """
+    Returns:
+        A sorted list of the .wav files in directory
+    """
+    return sorted(glob.glob(os.path.join(directory, '*.wav')))
+
+
+def _clip_seconds(path):
+    with wave.open(path, 'rb') as w:
+        return w.getnframes() / w.getframerate()
+
+
+def bench_import(repeat=5):
+    """
+    Times importing the plugin package in fresh interpreters. Naomi
+    imports every plugin at boot, so this is part of boot time.
+
+    Returns:
+        A dict with the median and individual import times and the heavy
+        modules that the import pulled in
+    """
+    path = os.path.dirname(os.path.abspath(__file__))
+    runs = []
+    for _ in range(repeat):
+        completed = subprocess.run(
+            [sys.executable, '-c', IMPORT_SCRIPT, path] + list(HEAVY_MODULES),
+            stdout=subprocess.PIPE,
+            check=True
+        )
+        runs.append(json.loads(completed.stdout))
+    return {
+        'median': statistics.median(run['seconds'] for run in runs),
+        'runs': [run['seconds'] for run in runs],
+        'heavy_modules': runs[-1]['heavy_modules']
+    }
+
+
+def bench_transcribe(plugin, files, repeat=1):
+    """
+    Times plugin.transcribe() over every clip.
+
+    Returns:
+        A dict with per-clip latency and real time factor, totals and
+        throughput
+    """
+    clips = []
+    audio_seconds = 0.0
+    wall_start = time.perf_counter()
+    for _ in range(repeat):
+        for path in files:
+            duration = _clip_seconds(path)
+            with open(path, 'rb') as fp:
+                start = time.perf_counter()
+                transcribed = plugin.transcribe(fp)
+                latency = time.perf_counter() - start
+            audio_seconds += duration
+            clips.append({
+                'file': os.path.basename(path),
+                'audio_seconds': duration,
+                'latency': latency,
+                'rtf': latency / duration if duration else None,
+                'transcribed': transcribed
+            })
+    wall_time = time.perf_counter() - wall_start
+    latencies = sorted(clip['latency'] for clip in clips)
+    return {
+        'clips': clips,
+        'count': len(clips),
+        'audio_seconds': audio_seconds,
+        'wall_time': wall_time,
+        'latency_mean': sum(latencies) / len(latencies) if latencies else None,
+        'latency_p50': percentile(latencies, 50),
+        'latency_p95': percentile(latencies, 95),
+        'rtf': wall_time / audio_seconds if audio_seconds else None,
+        'clips_per_second': len(clips) / wall_time if wall_time else None,
+        'peak_rss': peak_rss()
+    }
+
+
+def percentile(values, percent):
+    """
+    Returns:
+        The nearest-rank percentile of values, which need not be
+        sorted, or None if there are no values
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def keyword_lists(hmm_dir, sizes=COMPILE_SIZES, seed=0):
+    """
+    Builds reproducible keyword lists of the given sizes. About one word
+    in ten is made up, so the G2P path is exercised as well as the
+    dictionary lookup.
+
+    Returns:
+        A dict mapping each size to a list of words
+    """
+    from . import sphinxvocab
+    rng = random.Random(seed)
+    with sphinxvocab.open_lexicon_index(hmm_dir) as index:
+        known = [
+            word for word, _ in index.items()
+            if word.isalpha()
+        ]
+    lists = {}
+    for size in sizes:
+        words = rng.sample(known, min(size, len(known)))
+        for i in range(0, len(words), 10):
+            words[i] = ''.join(
+                rng.choice('abcdefghijklmnopqrstuvwxyz')
+                for _ in range(rng.randint(5, 9))
+            )
+        lists[size] = words
+    return lists
+
+
+def bench_compile(sizes=COMPILE_SIZES):
+    """
+    Times sphinxvocab.compile_vocabulary() (as the plugin runs it, with
+    the G2P cache) and compile_dictionary() (without a cache) for
+    keyword lists of each size.
+
+    Returns:
+        A list of dicts, one per size
+    """
+    from naomi import profile
+    from . import sphinxvocab
+    from .g2p import PhonetisaurusG2P
+    hmm_dir = profile.get(['pocketsphinx', 'hmm_dir'])
+    g2pconverter = PhonetisaurusG2P(
+        os.path.join(hmm_dir, 'g2p_model.fst'),
+        fst_model_alphabet=profile.get(
+            ['pocketsphinx', 'fst_model_alphabet'],
+            'arpabet'
+        ),
+        nbest=profile.get(['pocketsphinx', 'nbest'], 3)
+    )
+    results = []
+    for size, words in sorted(keyword_lists(hmm_dir, sizes).items()):
+        with tempfile.TemporaryDirectory() as directory:
+            start = time.perf_counter()
+            sphinxvocab.compile_vocabulary(directory, words)
+            vocabulary_time = time.perf_counter() - start
+            start = time.perf_counter()
+            sphinxvocab.compile_dictionary(
+                g2pconverter,
+                words,
+                os.path.join(directory, 'dictionary.uncached')
+            )
+            dictionary_time = time.perf_counter() - start
+        results.append({
+            'words': size,
+            'compile_vocabulary': vocabulary_time,
+            'compile_dictionary_uncached': dictionary_time,
+            'peak_rss': peak_rss()
+        })
+    return results
+
+
+def _traced(build):
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        result = build()
+        seconds = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, {'seconds': seconds, 'memory': current, 'peak': peak}
+
+
+def bench_lexicon(dict_file=None):
+    """
+    Compares the memory used by the whole pronunciation dictionary held
+    as a dict of lists (lexicon.read_dictionary()) and as a
+    lexicon.CompactLexicon.
+
+    Returns:
+        A dict with the load time, retained memory and peak memory of
+        each, in bytes as measured by tracemalloc
+    """
+    from . import lexicon
+    if dict_file is None:
+        from naomi import profile
+        dict_file = os.path.join(
+            profile.get(['pocketsphinx', 'hmm_dir']),
+            'cmudict.dict'
+        )
+    words, dict_of_lists = _traced(
+        lambda: lexicon.read_dictionary(dict_file)
+    )
+    del words
+    compact, compact_lexicon = _traced(
+        lambda: lexicon.CompactLexicon.from_file(dict_file)
+    )
+    return {
+        'words': len(compact),
+        'dict_of_lists': dict_of_lists,
+        'compact': compact_lexicon,
+        'reduction': (
+            1 - compact_lexicon['memory'] / dict_of_lists['memory']
+            if dict_of_lists['memory'] else None
+        )
+    }
+
+
+def load_plugin():
+    """
+    Loads the Pocketsphinx_KWS plugin through Naomi's plugin store, the
+    same way Naomi does for passive listening.
+    """
+    from naomi import pluginstore
+    store = pluginstore.PluginStore()
+    store.detect_plugins()
+    info = store.get_plugin('Pocketsphinx_KWS', category='stt')
+    return info.plugin_class('keywords', [], info)
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'system': platform.system(),
+        'cpus': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z')
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the Pocketsphinx_KWS plugin'
+    )
+    parser.add_argument(
+        '--corpus',
+        default=os.path.join(tempfile.gettempdir(), 'kws_bench_corpus'),
+        help='directory of WAV clips, generated if it has none'
+    )
+    parser.add_argument('--clips', type=int, default=20,
+                        help='number of clips to generate')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='number of passes over the corpus')
+    parser.add_argument('--skip-import', action='store_true')
+    parser.add_argument('--skip-transcribe', action='store_true')
+    parser.add_argument('--skip-compile', action='store_true')
+    parser.add_argument('--skip-lexicon', action='store_true')
+    parser.add_argument('-o', '--output',
+                        help='write JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    results = {'environment': environment()}
+    if not args.skip_import:
+        results['import'] = bench_import()
+    if not args.skip_transcribe:
+        files = load_corpus(args.corpus)
+        if not files:
+            files = generate_corpus(args.corpus, count=args.clips)
+        start = time.perf_counter()
+        plugin = load_plugin()
+        results['plugin_init'] = time.perf_counter() - start
+        results['transcribe'] = bench_transcribe(plugin, files, args.repeat)
+    if not args.skip_compile:
+        results['compile'] = bench_compile()
+    if not args.skip_lexicon:
+        results['lexicon'] = bench_lexicon()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+
+class DecoderPool(object):
+    """
+    A fixed size pool of pocketsphinx decoders built from the same
+    configuration. A decoder is checked out for the duration of one
+    utterance (or one streaming session) and returned afterwards, so
+    several callers can decode in parallel without sharing decoder
+    state. Decoders are created lazily, up to size, the first time all
+    existing decoders are busy.
+
+    reconfigure() changes every decoder in the pool (for example to swap
+    the keyword search). Decoders are brought up to date by refresh(),
+    which runs when a decoder is checked out, so a decoder is never
+    changed in the middle of an utterance. Streams holding a decoder
+    for a long time check is_current() and refresh at their next chunk.
+    """
+
+    def __init__(self, factory, size=1):
+        """
+        Arguments:
+            factory -- callable returning a new pocketsphinx.Decoder
+            size -- the maximum number of decoders in the pool
+        """
+        if size < 1:
+            raise ValueError('Decoder pool size must be at least 1')
+        self._logger = logging.getLogger(__name__)
+        self._factory = factory
+        self.size = size
+        self._idle = []
+        self._created = 0
+        self._cond = threading.Condition()
+        # Configuration generation of the pool and of each decoder
+        self._generation = 0
+        self._generations = {}
+        self._configure = None
+        # Metrics
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._replaced = 0
+
+    def _create(self):
+        # Decoders are built from the current configuration files, so a
+        # new decoder starts out up to date
+        with self._cond:
+            generation = self._generation
+        decoder = self._factory()
+        with self._cond:
+            self._generations[id(decoder)] = generation
+        self._logger.debug(
+            'Created decoder {} of {}'.format(self._created, self.size)
+        )
+        return decoder
+
+    def reconfigure(self, configure):
+        """
+        Schedules a change for every decoder in the pool.
+
+        Arguments:
+            configure -- callable taking a decoder and bringing it up to
+                         date. Only the most recent callable is kept, so
+                         it has to apply the complete current state.
+        """
+        with self._cond:
+            self._generation += 1
+            self._configure = configure
+            idle = self._idle
+            self._idle = []
+        # Idle decoders are taken out of the pool and updated straight
+        # away, so the next checkout does not pay for it
+        try:
+            for decoder in idle:
+                self.refresh(decoder)
+        finally:
+            for decoder in idle:
+                self.checkin(decoder)
+
+    def refresh(self, decoder):
+        """
+        Applies the latest reconfigure() call to decoder if it has not
+        seen it yet. Call this only between utterances.
+        """
+        with self._cond:
+            generation = self._generation
+            configure = self._configure
+            current = self._generations.get(id(decoder), 0)
+        if current >= generation or configure is None:
+            return
+        configure(decoder)
+        with self._cond:
+            self._generations[id(decoder)] = generation
+
+    def grow(self, size):
+        """
+        Raises the maximum number of decoders to size, if it is lower.
+        """
+        with self._cond:
+            if size > self.size:
+                self.size = size
+                self._cond.notify_all()
+
+    def is_current(self, decoder):
+        """
+        Returns:
+            False if decoder has not seen the latest reconfigure() call,
+            so a caller holding it for a long time knows to refresh() it
+            at its next utterance boundary
+        """
+        with self._cond:
+            if self._configure is None:
+                return True
+            return self._generations.get(id(decoder), 0) >= self._generation
+
+    def prefill(self, count=None):
+        """
+        Creates decoders up front instead of on first use.
+
+        Arguments:
+            count -- how many decoders the pool should hold, defaults to
+                     the pool size
+        """
+        if count is None:
+            count = self.size
+        count = min(count, self.size)
+        while True:
+            with self._cond:
+                if self._created >= count:
+                    return
+                self._created += 1
+            try:
+                decoder = self._create()
+            except BaseException:
+                with self._cond:
+                    self._created -= 1
+                raise
+            self.checkin(decoder)
+
+    def checkout(self, timeout=None):
+        """
+        Takes a decoder out of the pool, waiting for one to be returned
+        if all of them are in use.
+
+        Arguments:
+            timeout -- the maximum number of seconds to wait, or None to
+                       wait forever
+
+        Returns:
+            A pocketsphinx.Decoder
+
+        Raises:
+            TimeoutError if no decoder became available in time
+        """
+        start = time.monotonic()
+        waited = False
+        with self._cond:
+            while not self._idle and self._created >= self.size:
+                waited = True
+                remaining = None
+                if timeout is not None:
+                    remaining = timeout - (time.monotonic() - start)
+                    if remaining <= 0:
+                        raise TimeoutError(
+                            'No pocketsphinx decoder available'
+                        )
+                self._cond.wait(remaining)
+            self._checkouts += 1
+            if waited:
+                wait_time = time.monotonic() - start
+                self._waits += 1
+                self._wait_time_total += wait_time
+                self._wait_time_max = max(self._wait_time_max, wait_time)
+            if self._idle:
+                decoder = self._idle.pop()
+            else:
+                decoder = None
+                self._created += 1
+        if decoder is not None:
+            try:
+                self.refresh(decoder)
+            except BaseException:
+                self.checkin(decoder)
+                raise
+            return decoder
+        # Build the new decoder outside of the lock, loading the model
+        # takes a while
+        try:
+            return self._create()
+        except BaseException:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    def replace(self, decoder):
+        """
+        Builds a new decoder to take the place of a checked out decoder
+        that is broken. The old decoder is dropped and the caller owns
+        the new one, which goes back to the pool with checkin().
+
+        Returns:
+            A new pocketsphinx.Decoder
+        """
+        new_decoder = self._create()
+        with self._cond:
+            self._generations.pop(id(decoder), None)
+            self._replaced += 1
+        return new_decoder
+
+    def checkin(self, decoder):
+        """
+        Returns a decoder to the pool.
+        """
+        with self._cond:
+            self._idle.append(decoder)
+            self._cond.notify()
+
+    @contextmanager
+    def decoder(self, timeout=None):
+        """
+        Context manager that checks a decoder out and returns it to the
+        pool afterwards.
+        """
+        decoder = self.checkout(timeout)
+        try:
+            yield decoder
+        finally:
+            self.checkin(decoder)
+
+    def stats(self):
+        """
+        Returns:
+            A dict with the pool size and wait time metrics
+        """
+        with self._cond:
+            return {
+                'size': self.size,
+                'created': self._created,
+                'idle': len(self._idle),
+                'in_use': self._created - len(self._idle),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_time_total': self._wait_time_total,
+                'wait_time_max': self._wait_time_max,
+                'replaced': self._replaced
+            }
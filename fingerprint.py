@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import threading
+
+# Digests computed in this process, keyed by path and invalidated when
+# the file's size or modification time changes
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def file_digest(path, block_size=1 << 20):
+    """
+    Computes the sha1 digest of a file's contents. The result is
+    remembered for as long as the file's size and modification time
+    stay the same, so repeated calls for a large model are cheap.
+
+    Arguments:
+        path -- the file to hash
+
+    Returns:
+        The hex digest as string
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    signature = (st.st_size, st.st_mtime_ns)
+    with _digests_lock:
+        cached = _digests.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        block = f.read(block_size)
+        while block:
+            sha.update(block)
+            block = f.read(block_size)
+    digest = sha.hexdigest()
+    with _digests_lock:
+        _digests[path] = (signature, digest)
+    return digest
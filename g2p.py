@@ -1,17 +1,136 @@
 # -*- coding: utf-8 -*-
+import hashlib
+import json
+import multiprocessing
 import os
-import phonetisaurus
-import re
 import logging
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from . import fingerprint
+from . import lexicon
+from . import metrics
 from . import phonemeconversion
 
 
+# Word lists shorter than this are always predicted in the calling
+# process, since starting worker processes costs more than it saves
+PARALLEL_MIN_WORDS = 200
+
+
+def _predict_chunk(args):
+    # Runs in a worker process, so it has to be a picklable module level
+    # function
+    import phonetisaurus
+    words, fst_model, nbest = args
+    return list(phonetisaurus.predict(words, fst_model, nbest=nbest))
+
+
+class PronunciationCache(object):
+    """
+    A disk backed cache of G2P predictions. Entries are evicted least
+    recently used first once the cache holds more than max_entries
+    words. hits and misses count lookups since the cache was opened.
+    """
+
+    def __init__(self, cache_file, max_entries=10000):
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(cache_file))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(cache_file, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                " ".join([
+                    "CREATE TABLE IF NOT EXISTS pronunciations (",
+                    "key TEXT PRIMARY KEY,",
+                    "phonemes TEXT NOT NULL,",
+                    "last_used REAL NOT NULL",
+                    ")"
+                ])
+            )
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM pronunciations"
+            ).fetchone()[0]
+
+    def get(self, key):
+        """
+        Returns:
+            The list of cached pronunciations for key, or None on a miss
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT phonemes FROM pronunciations WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self._db:
+                self._db.execute(
+                    "UPDATE pronunciations SET last_used = ? WHERE key = ?",
+                    (time.time(), key)
+                )
+        return json.loads(row[0])
+
+    def put(self, key, pronunciations):
+        with self._lock:
+            with self._db:
+                self._db.execute(
+                    " ".join([
+                        "INSERT OR REPLACE INTO pronunciations",
+                        "(key, phonemes, last_used) VALUES (?, ?, ?)"
+                    ]),
+                    (key, json.dumps(pronunciations), time.time())
+                )
+                count = self._db.execute(
+                    "SELECT COUNT(*) FROM pronunciations"
+                ).fetchone()[0]
+                if count > self.max_entries:
+                    self._db.execute(
+                        " ".join([
+                            "DELETE FROM pronunciations WHERE key IN (",
+                            "SELECT key FROM pronunciations",
+                            "ORDER BY last_used LIMIT ?",
+                            ")"
+                        ]),
+                        (count - self.max_entries,)
+                    )
+
+    def stats(self):
+        """
+        Returns:
+            A dict with the hit and miss counters and the current size
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self)
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
 class PhonetisaurusG2P(object):
     def __init__(
         self,
         fst_model,
         fst_model_alphabet='arpabet',
-        nbest=None
+        nbest=None,
+        cache=None,
+        processes=1
     ):
         self._logger = logging.getLogger(__name__)
 
@@ -27,15 +146,29 @@ class PhonetisaurusG2P(object):
         if (self.nbest is not None):
             self._logger.debug("Will use the %d best results.", self.nbest)
 
+        # Optional PronunciationCache
+        self.cache = cache
+        self._cache_prefix = None
+
+        # Large word lists are split across this many worker processes
+        self.processes = processes
+
     def _convert_phonemes(self, data):
+        """
+        Arguments:
+            data -- a list of (word, phonemes) pairs from the model
+
+        Returns:
+            The same pairs with the phonemes in ARPAbet
+        """
         if (self.fst_model_alphabet == 'xsampa'):
-            for word in data:
-                converted_phonemes = []
-                for phoneme in data[word]:
-                    converted_phonemes.append(
-                        phonemeconversion.xsampa_to_arpabet(phoneme))
-                data[word] = converted_phonemes
-            return data
+            converted = phonemeconversion.convert_pronunciations(
+                phonemes for _, phonemes in data
+            )
+            return [
+                (word, phonemes)
+                for (word, _), phonemes in zip(data, converted)
+            ]
         elif self.fst_model_alphabet == 'arpabet':
             return data
         raise ValueError('Invalid FST model alphabet!')
@@ -43,12 +176,77 @@ class PhonetisaurusG2P(object):
     def _translate_word(self, word):
         return self._translate_words([word])
 
-    def _translate_words(self, words):
-        return phonetisaurus.predict(
-            words,
-            self.fst_model,
-            nbest=self.nbest
+    def _cache_key(self, word):
+        # Predictions depend on the model contents, the alphabet and
+        # nbest as well as on the word itself
+        if self._cache_prefix is None:
+            self._cache_prefix = "\0".join([
+                fingerprint.file_digest(self.fst_model),
+                self.fst_model_alphabet,
+                str(self.nbest)
+            ])
+        return hashlib.sha1(
+            "\0".join([self._cache_prefix, word]).encode('utf-8')
+        ).hexdigest()
+
+    def _predict(self, words):
+        words = list(words)
+        metrics.registry.inc('g2p_words_total', len(words))
+        with metrics.registry.timer('g2p_seconds'):
+            return list(self._predict_words(words))
+
+    def _predict_words(self, words):
+        # phonetisaurus is only imported once G2P is actually needed
+        import phonetisaurus
+        processes = min(self.processes or 1, len(words) // PARALLEL_MIN_WORDS)
+        if processes <= 1:
+            return phonetisaurus.predict(
+                words,
+                self.fst_model,
+                nbest=self.nbest
+            )
+        # Split into contiguous chunks and concatenate the results in
+        # chunk order, so the output order does not depend on which
+        # worker finishes first
+        chunk_size = -(-len(words) // processes)
+        chunks = [
+            (words[i:i + chunk_size], self.fst_model, self.nbest)
+            for i in range(0, len(words), chunk_size)
+        ]
+        self._logger.debug(
+            'Predicting {} words in {} processes'.format(len(words), processes)
         )
+        output = []
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for result in executor.map(_predict_chunk, chunks):
+                output.extend(result)
+        return output
+
+    def _translate_words(self, words):
+        if self.cache is None:
+            return self._predict(words)
+        pronunciations = {}
+        missing = []
+        for word in words:
+            cached = self.cache.get(self._cache_key(word))
+            if cached is None:
+                missing.append(word)
+            else:
+                pronunciations[word] = cached
+        metrics.registry.inc('g2p_cache_hits_total', len(pronunciations))
+        metrics.registry.inc('g2p_cache_misses_total', len(missing))
+        if missing:
+            predicted = {word: [] for word in missing}
+            for word, phonemes in self._predict(missing):
+                predicted.setdefault(word, []).append(list(phonemes))
+            for word in missing:
+                self.cache.put(self._cache_key(word), predicted[word])
+            pronunciations.update(predicted)
+        return [
+            (word, phonemes)
+            for word in words
+            for phonemes in pronunciations.get(word, [])
+        ]
 
     def translate(self, words):
         self._logger.debug(
@@ -74,30 +272,236 @@ class PhonetisaurusG2P(object):
     # works well, but this allows us to use the CMUDict.dict dictionary without
     # reformatting it.
     @staticmethod
-    def train_fst(dict_file, fst_file):
+    def train_fst(dict_file, fst_file, index_file=None, **train_args):
         """
         parameters:
             dict_file - location of the dictionary file to read from
             fst_file - location of the fst file to create
+            index_file - location of the lexicon index for dict_file,
+                         defaults to dict_file with an ".idx" suffix
+            train_args - extra keyword arguments for phonetisaurus.train
         """
-        RE_WORDS = re.compile(
-            r"^(?P<word>[a-zA-Z0-9'\.\-]+)(\(\d\))?\s+(?P<pronunciation>[a-zA-Z]+.*[a-zA-Z0-9])\s*$"
-        )
-        lexicon = {}
-        with open(dict_file, 'r') as f:
-            line = f.readline().strip()
-            while line:
-                for match in RE_WORDS.finditer(line):
-                    try:
-                        lexicon[match.group('word')].append(
-                            match.group('pronunciation').split()
-                        )
-                    except KeyError:
-                        lexicon[match.group('word')] = [
-                            match.group('pronunciation').split()
-                        ]
-                line = f.readline().strip()
+        import phonetisaurus
+        with lexicon.open_index(dict_file, index_file) as index:
+            training_lexicon = lexicon.CompactLexicon.from_items(
+                index.items()
+            )
         phonetisaurus.train(
-            lexicon,
-            model_path=fst_file
+            training_lexicon,
+            model_path=fst_file,
+            **train_args
         )
+
+
+def _train_process(dict_file, fst_file, index_file, train_args):
+    # Target of the training process, has to be a module level function
+    PhonetisaurusG2P.train_fst(dict_file, fst_file, index_file, **train_args)
+
+
+def _copy_atomic(source, destination):
+    directory = os.path.dirname(os.path.abspath(destination))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(fd)
+    try:
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, destination)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class FSTTrainingJob(object):
+    """
+    Trains an FST model in the background.
+
+    Trained models are kept in cache_dir under a key made from the hash
+    of the source dictionary and the training parameters, so the same
+    dictionary is never trained twice, whichever profile or language
+    asks for it. The phonetisaurus trainer is single threaded, so
+    training runs in its own process: it does not compete with the
+    calling process for the GIL and it can be cancelled.
+
+    status is one of PENDING, RUNNING, DONE, FAILED or CANCELLED. stage
+    and progress (0.0 to 1.0) describe how far the job has got.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    def __init__(
+        self,
+        dict_file,
+        fst_file,
+        index_file=None,
+        cache_dir=None,
+        train_args=None,
+        on_progress=None
+    ):
+        """
+        Arguments:
+            dict_file -- the dictionary to train from
+            fst_file -- where the trained model should end up
+            index_file -- the lexicon index for dict_file
+            cache_dir -- directory of previously trained models
+            train_args -- extra keyword arguments for phonetisaurus.train
+            on_progress -- optional callable receiving the job whenever
+                           its stage changes
+        """
+        self._logger = logging.getLogger(__name__)
+        self.dict_file = dict_file
+        self.fst_file = fst_file
+        self.index_file = index_file
+        self.cache_dir = cache_dir
+        self.train_args = dict(train_args or {})
+        self._on_progress = on_progress
+        self.status = self.PENDING
+        self.stage = None
+        self.progress = 0.0
+        self.error = None
+        self._cancelled = threading.Event()
+        self._done = threading.Event()
+        self._process = None
+        self._thread = threading.Thread(
+            target=self._run,
+            name='fst-training',
+            daemon=True
+        )
+
+    def _set_stage(self, stage, progress):
+        self.stage = stage
+        self.progress = progress
+        self._logger.info(
+            "FST training: {} ({:.0%})".format(stage, progress)
+        )
+        if self._on_progress is not None:
+            self._on_progress(self)
+
+    def cache_key(self):
+        """
+        Returns:
+            The cache key for this job's dictionary and parameters
+        """
+        return hashlib.sha1(
+            "\0".join([
+                fingerprint.file_digest(self.dict_file),
+                json.dumps(self.train_args, sort_keys=True)
+            ]).encode('utf-8')
+        ).hexdigest()
+
+    def start(self):
+        self.status = self.RUNNING
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """
+        Stops the job. A training process that is already running is
+        terminated.
+        """
+        self._cancelled.set()
+        process = self._process
+        if process is not None and process.is_alive():
+            process.terminate()
+
+    def wait(self, timeout=None):
+        """
+        Waits for the job to finish.
+
+        Returns:
+            True if the job has finished
+        """
+        return self._done.wait(timeout)
+
+    def _train(self, model_path):
+        self._process = multiprocessing.Process(
+            target=_train_process,
+            args=(self.dict_file, model_path, self.index_file, self.train_args),
+            daemon=True
+        )
+        self._process.start()
+        while self._process.is_alive():
+            self._process.join(0.5)
+            if self._cancelled.is_set():
+                self._process.terminate()
+                self._process.join()
+        if self._cancelled.is_set():
+            return False
+        if self._process.exitcode != 0:
+            raise RuntimeError(
+                "FST training exited with code {}".format(
+                    self._process.exitcode
+                )
+            )
+        return True
+
+    def _run(self):
+        try:
+            self._set_stage('hashing dictionary', 0.05)
+            cached_model = None
+            if self.cache_dir:
+                cached_model = os.path.join(
+                    self.cache_dir,
+                    "{}.fst".format(self.cache_key())
+                )
+            if cached_model and os.path.isfile(cached_model):
+                self._set_stage('using cached model', 0.9)
+            else:
+                self._set_stage('training', 0.1)
+                with tempfile.TemporaryDirectory() as directory:
+                    model_path = os.path.join(directory, 'g2p_model.fst')
+                    if not self._train(model_path):
+                        self.status = self.CANCELLED
+                        self._set_stage('cancelled', self.progress)
+                        return
+                    self._set_stage('saving model', 0.9)
+                    if cached_model:
+                        _copy_atomic(model_path, cached_model)
+                    else:
+                        _copy_atomic(model_path, self.fst_file)
+            if cached_model:
+                _copy_atomic(cached_model, self.fst_file)
+            self.status = self.DONE
+            self._set_stage('done', 1.0)
+        except Exception as e:
+            self.error = e
+            self.status = self.FAILED
+            self._logger.error("FST training failed: {}".format(e))
+            if self._on_progress is not None:
+                self._on_progress(self)
+        finally:
+            self._done.set()
+
+
+# Training jobs started in this process, by destination model path
+_training_jobs = {}
+_training_jobs_lock = threading.Lock()
+
+
+def start_training(dict_file, fst_file, **kwargs):
+    """
+    Starts training fst_file in the background, unless a job for it is
+    already running. Takes the same keyword arguments as FSTTrainingJob.
+
+    Returns:
+        The FSTTrainingJob
+    """
+    key = os.path.abspath(fst_file)
+    with _training_jobs_lock:
+        job = _training_jobs.get(key)
+        if job is None or job.wait(0):
+            job = FSTTrainingJob(dict_file, fst_file, **kwargs).start()
+            _training_jobs[key] = job
+    return job
+
+
+def get_training_job(fst_file):
+    """
+    Returns:
+        The most recent training job for fst_file in this process, or
+        None
+    """
+    with _training_jobs_lock:
+        return _training_jobs.get(os.path.abspath(fst_file))
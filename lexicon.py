@@ -0,0 +1,532 @@
+# -*- coding: utf-8 -*-
+import logging
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+
+# Matches a single line of a CMUdict style dictionary, for example
+#     word W ER D
+#     word(2) W ER D Z
+RE_WORDS = re.compile(
+    r"^(?P<word>[a-zA-Z0-9'\.\-]+)(\(\d\))?\s+(?P<pronunciation>[a-zA-Z]+.*[a-zA-Z0-9])\s*$"
+)
+
+# Index file layout (all integers in native byte order, the index is a
+# local cache and never leaves the machine that built it):
+#     header         - magic, source size, source mtime_ns, entry count
+#     word offsets   - count + 1 unsigned ints into the word blob
+#     pron offsets   - count + 1 unsigned ints into the pronunciation blob
+#     word blob      - sorted utf-8 words, concatenated
+#     pron blob      - per word, pronunciations separated by newlines and
+#                      phones separated by spaces
+INDEX_MAGIC = b'KWSLEX1\0'
+INDEX_HEADER = struct.Struct('=8sQqI')
+
+
+def default_index_path(dict_file):
+    """
+    Returns:
+        The path of the index file kept next to dict_file as string
+    """
+    return dict_file + '.idx'
+
+
+def _source_signature(dict_file):
+    st = os.stat(dict_file)
+    return (st.st_size, st.st_mtime_ns)
+
+
+def read_dictionary(dict_file):
+    """
+    Parses a CMUdict style dictionary file.
+
+    Arguments:
+        dict_file -- location of the dictionary file to read from
+
+    Returns:
+        A dict mapping each word to a list of pronunciations, each
+        pronunciation being a list of phones. Alternate pronunciations
+        ("word(2)") are kept in file order.
+    """
+    lexicon = {}
+    with open(dict_file, 'r') as f:
+        for line in f:
+            match = RE_WORDS.match(line)
+            if match is None:
+                continue
+            lexicon.setdefault(match.group('word'), []).append(
+                match.group('pronunciation').split()
+            )
+    return lexicon
+
+
+def _base_word(line):
+    # The word a dictionary line is for, without any "(2)" alternate
+    # marker, or None for blank and comment lines
+    if line[:1].isspace() or line.startswith((';;;', '#')):
+        return None
+    word = line.split(None, 1)[0] if line else None
+    if word and word.endswith(')'):
+        paren = word.rfind('(')
+        if paren > 0:
+            word = word[:paren]
+    return word
+
+
+def extract_subset(dict_file, words):
+    """
+    Reads the pronunciations of a few words from a dictionary file
+    without loading the rest of it.
+
+    The file is read once, and only lines starting with a wanted word
+    are parsed. Reading stops once every word has been found and the
+    alternates that follow it ("word(2)") have been read, so memory use
+    does not depend on the size of the dictionary. Blank and comment
+    lines are skipped.
+
+    Arguments:
+        dict_file -- location of the dictionary file to read from
+        words -- the words to look up
+
+    Returns:
+        A dict mapping each word found to a list of pronunciations, in
+        the same form as read_dictionary()
+    """
+    wanted = set(words)
+    remaining = set(wanted)
+    subset = {}
+    with open(dict_file, 'r') as f:
+        for line in f:
+            word = _base_word(line)
+            if word not in wanted:
+                if not remaining and word is not None:
+                    # Alternates follow their word, so once a line for
+                    # another word comes up after the last word was
+                    # found there is nothing left to read
+                    break
+                continue
+            match = RE_WORDS.match(line)
+            if match is None:
+                continue
+            subset.setdefault(word, []).append(
+                match.group('pronunciation').split()
+            )
+            remaining.discard(word)
+    return subset
+
+
+class CompactLexicon(object):
+    """
+    An in-memory pronunciation dictionary that stays small even for the
+    whole of CMUdict.
+
+    Phones are interned to small integer ids and every pronunciation is
+    stored as a run of phone ids in a single array('B'). An offset table
+    marks where each pronunciation starts, and a second one where each
+    word's pronunciations start, so the whole dictionary is a handful of
+    arrays plus the word strings instead of a list of lists of strings
+    per word.
+
+    Lookups return the same lists of phone lists as a dict made by
+    read_dictionary(), built on demand.
+    """
+    __slots__ = (
+        '_phones', '_phone_ids', '_words', '_word_ids',
+        '_word_offsets', '_pron_offsets', '_data', '_last_word', '_late'
+    )
+
+    def __init__(self):
+        # id -> phone and phone -> id
+        self._phones = []
+        self._phone_ids = {}
+        # word number -> word and word -> word number
+        self._words = []
+        self._word_ids = {}
+        # Index of each word's first pronunciation, plus one past the end
+        self._word_offsets = array('I', [0])
+        # Offset of each pronunciation in _data, plus one past the end
+        self._pron_offsets = array('I', [0])
+        self._data = array('B')
+        self._last_word = None
+        # Pronunciations of words that were not contiguous in the input,
+        # merged in by _finish()
+        self._late = None
+
+    @classmethod
+    def from_items(cls, items):
+        """
+        Arguments:
+            items -- an iterable of (word, pronunciations) pairs, or a
+                     dict of them
+        """
+        if hasattr(items, 'items'):
+            items = items.items()
+        compact = cls()
+        for word, pronunciations in items:
+            for pronunciation in pronunciations:
+                compact._add(word, pronunciation)
+        compact._finish()
+        return compact
+
+    @classmethod
+    def from_file(cls, dict_file):
+        """
+        Parses a CMUdict style dictionary file, see read_dictionary().
+        """
+        compact = cls()
+        with open(dict_file, 'r') as f:
+            for line in f:
+                match = RE_WORDS.match(line)
+                if match is None:
+                    continue
+                compact._add(
+                    match.group('word'),
+                    match.group('pronunciation').split()
+                )
+        compact._finish()
+        return compact
+
+    def _phone_id(self, phone):
+        phone_id = self._phone_ids.get(phone)
+        if phone_id is None:
+            phone_id = len(self._phones)
+            if phone_id == 256 and self._data.typecode == 'B':
+                # More phones than fit in a byte, unusual but possible
+                # for a dictionary with stress marked vowels and
+                # X-SAMPA variants
+                self._data = array('H', self._data)
+            self._phones.append(sys.intern(phone))
+            self._phone_ids[phone] = phone_id
+        return phone_id
+
+    def _add(self, word, phones):
+        if word != self._last_word:
+            if word in self._word_ids:
+                # The word's earlier pronunciations are not the last
+                # ones added, keep this one aside until the end
+                if self._late is None:
+                    self._late = {}
+                self._late.setdefault(word, []).append(list(phones))
+                return
+            self._word_ids[word] = len(self._words)
+            self._words.append(word)
+            self._word_offsets.append(self._word_offsets[-1])
+            self._last_word = word
+        self._data.extend(self._phone_id(phone) for phone in phones)
+        self._pron_offsets.append(len(self._data))
+        self._word_offsets[-1] += 1
+
+    def _finish(self):
+        self._last_word = None
+        late, self._late = self._late, None
+        if not late:
+            return
+        # Rebuild with every word's pronunciations next to each other
+        merged = CompactLexicon()
+        for word, pronunciations in self.items():
+            for pronunciation in pronunciations + late.get(word, []):
+                merged._add(word, pronunciation)
+        for slot in self.__slots__:
+            setattr(self, slot, getattr(merged, slot))
+
+    def __len__(self):
+        return len(self._words)
+
+    def __contains__(self, word):
+        return word in self._word_ids
+
+    def __iter__(self):
+        return iter(self._words)
+
+    def __getitem__(self, word):
+        pronunciations = self.get(word)
+        if pronunciations is None:
+            raise KeyError(word)
+        return pronunciations
+
+    @property
+    def phones(self):
+        """
+        Returns:
+            The distinct phones used in this lexicon
+        """
+        return list(self._phones)
+
+    def _pronunciations(self, i):
+        phones = self._phones
+        data = self._data
+        offsets = self._pron_offsets
+        return [
+            [phones[phone_id] for phone_id in data[offsets[p]:offsets[p + 1]]]
+            for p in range(self._word_offsets[i], self._word_offsets[i + 1])
+        ]
+
+    def get(self, word, default=None):
+        """
+        Looks up the pronunciations of a word.
+
+        Returns:
+            A list of pronunciations (each a list of phones) or default
+            if the word is not in the dictionary
+        """
+        i = self._word_ids.get(word)
+        if i is None:
+            return default
+        return self._pronunciations(i)
+
+    def keys(self):
+        return list(self._words)
+
+    def items(self):
+        """
+        Iterates over (word, pronunciations) pairs in input order.
+        """
+        for i, word in enumerate(self._words):
+            yield word, self._pronunciations(i)
+
+
+class LexiconIndex(object):
+    """
+    A read only, memory mapped view of a pre-parsed pronunciation
+    dictionary. Words are kept sorted on disk, so a lookup is a binary
+    search over the mapped file and the dictionary itself is never
+    loaded into the Python heap.
+    """
+
+    def __init__(self, index_file):
+        self.index_file = index_file
+        with open(index_file, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.source_size, self.source_mtime_ns, self._count = (
+            INDEX_HEADER.unpack_from(self._mmap, 0)
+        )
+        if magic != INDEX_MAGIC:
+            self._mmap.close()
+            raise ValueError(
+                "'{}' is not a lexicon index".format(index_file)
+            )
+        view = memoryview(self._mmap)
+        table_size = (self._count + 1) * 4
+        start = INDEX_HEADER.size
+        self._word_offsets = view[start:start + table_size].cast('I')
+        start += table_size
+        self._pron_offsets = view[start:start + table_size].cast('I')
+        self._words_start = start + table_size
+        self._prons_start = (
+            self._words_start + self._word_offsets[self._count]
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, word):
+        return self._find(word) is not None
+
+    def __getitem__(self, word):
+        pronunciations = self.get(word)
+        if pronunciations is None:
+            raise KeyError(word)
+        return pronunciations
+
+    def close(self):
+        # The memoryviews have to be released before the mmap can close
+        self._word_offsets.release()
+        self._pron_offsets.release()
+        self._mmap.close()
+
+    def is_fresh(self, dict_file):
+        """
+        Returns:
+            True if this index was built from the current contents of
+            dict_file
+        """
+        return (
+            (self.source_size, self.source_mtime_ns)
+            == _source_signature(dict_file)
+        )
+
+    def _word(self, i):
+        start = self._words_start + self._word_offsets[i]
+        end = self._words_start + self._word_offsets[i + 1]
+        return self._mmap[start:end]
+
+    def _pronunciations(self, i):
+        start = self._prons_start + self._pron_offsets[i]
+        end = self._prons_start + self._pron_offsets[i + 1]
+        return [
+            pronunciation.split()
+            for pronunciation in self._mmap[start:end].decode('ascii').split('\n')
+        ]
+
+    def _find(self, word):
+        key = word.encode('utf-8')
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._word(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._count and self._word(lo) == key:
+            return lo
+        return None
+
+    def get(self, word, default=None):
+        """
+        Looks up the pronunciations of a word.
+
+        Returns:
+            A list of pronunciations (each a list of phones) or default
+            if the word is not in the dictionary
+        """
+        i = self._find(word)
+        if i is None:
+            return default
+        return self._pronunciations(i)
+
+    def items(self):
+        """
+        Iterates over (word, pronunciations) pairs in sorted order.
+        """
+        for i in range(self._count):
+            yield self._word(i).decode('utf-8'), self._pronunciations(i)
+
+    @staticmethod
+    def build(dict_file, index_file):
+        """
+        Parses dict_file and writes a lexicon index to index_file. The
+        index is written to a temporary file first and moved into place,
+        so readers never see a partially written index.
+
+        Arguments:
+            dict_file -- location of the dictionary file to read from
+            index_file -- location of the index file to create
+        """
+        logger = logging.getLogger(__name__)
+        logger.info("Building lexicon index '%s'", index_file)
+        size, mtime_ns = _source_signature(dict_file)
+        lexicon = CompactLexicon.from_file(dict_file)
+        entries = sorted(
+            (word.encode('utf-8'), '\n'.join(
+                ' '.join(pronunciation) for pronunciation in pronunciations
+            ).encode('ascii'))
+            for word, pronunciations in lexicon.items()
+        )
+        del lexicon
+        word_offsets = array('I', [0])
+        pron_offsets = array('I', [0])
+        for word, pronunciations in entries:
+            word_offsets.append(word_offsets[-1] + len(word))
+            pron_offsets.append(pron_offsets[-1] + len(pronunciations))
+        directory = os.path.dirname(os.path.abspath(index_file))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(
+                    INDEX_HEADER.pack(INDEX_MAGIC, size, mtime_ns, len(entries))
+                )
+                word_offsets.tofile(f)
+                pron_offsets.tofile(f)
+                for word, _ in entries:
+                    f.write(word)
+                for _, pronunciations in entries:
+                    f.write(pronunciations)
+            os.replace(tmp_path, index_file)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+
+def open_index(dict_file, index_file=None):
+    """
+    Opens the lexicon index for dict_file, building it first if it does
+    not exist yet or if dict_file has changed since it was built.
+
+    Arguments:
+        dict_file -- location of the dictionary file
+        index_file -- location of the index file, defaults to dict_file
+                      with an ".idx" suffix
+
+    Returns:
+        A LexiconIndex
+    """
+    if index_file is None:
+        index_file = default_index_path(dict_file)
+    if os.path.isfile(index_file):
+        try:
+            index = LexiconIndex(index_file)
+        except (ValueError, struct.error):
+            pass
+        else:
+            if index.is_fresh(dict_file):
+                return index
+            index.close()
+    LexiconIndex.build(dict_file, index_file)
+    return LexiconIndex(index_file)
+
+
+def is_index_fresh(dict_file, index_file=None):
+    """
+    Returns:
+        True if index_file exists and was built from the current
+        contents of dict_file
+    """
+    if index_file is None:
+        index_file = default_index_path(dict_file)
+    if not os.path.isfile(index_file):
+        return False
+    try:
+        with LexiconIndex(index_file) as index:
+            return index.is_fresh(dict_file)
+    except (ValueError, struct.error):
+        return False
+
+
+# Background index builds, by index file
+_index_builds = {}
+_index_builds_lock = threading.Lock()
+
+
+def build_index_in_background(dict_file, index_file=None):
+    """
+    Starts building the lexicon index for dict_file in a background
+    thread, unless a build for it is already running.
+
+    Returns:
+        The threading.Thread doing the build
+    """
+    if index_file is None:
+        index_file = default_index_path(dict_file)
+    with _index_builds_lock:
+        thread = _index_builds.get(index_file)
+        if thread is None or not thread.is_alive():
+            thread = threading.Thread(
+                target=_build_index,
+                args=(dict_file, index_file),
+                name='lexicon-index',
+                daemon=True
+            )
+            _index_builds[index_file] = thread
+            thread.start()
+    return thread
+
+
+def _build_index(dict_file, index_file):
+    try:
+        LexiconIndex.build(dict_file, index_file)
+    except Exception as e:
+        logging.getLogger(__name__).error(
+            "Unable to build lexicon index '{}': {}".format(index_file, e)
+        )
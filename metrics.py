@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight in-process metrics.
+
+Counters and summaries (count, sum and max of observed values) are
+aggregated in a Metrics registry, which can be read at any time with
+snapshot(). Sinks receive every recorded value as it happens and a
+snapshot of all metrics every export_interval seconds, so they can ship
+metrics elsewhere. PrometheusTextfileSink writes the snapshot in the
+Prometheus text format for node_exporter's textfile collector.
+
+Recording a value costs a lock and a dictionary update, and exporting
+happens at most once per interval from whichever thread records next, so
+no background thread is needed.
+"""
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Prefix of every metric name
+PREFIX = 'pocketsphinx_kws_'
+
+COUNTER = 'counter'
+SUMMARY = 'summary'
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class MetricsSink(object):
+    """
+    Base class of metrics sinks. Both methods do nothing by default, so a
+    sink only overrides what it needs.
+    """
+
+    def record(self, kind, name, value, labels):
+        """
+        Called for every recorded value.
+
+        Arguments:
+            kind -- COUNTER or SUMMARY
+            name -- the metric name, without PREFIX
+            value -- the increment or the observed value
+            labels -- a dict of label names and values
+        """
+        pass
+
+    def export(self, snapshot):
+        """
+        Called with Metrics.snapshot() every export interval and on
+        Metrics.flush().
+        """
+        pass
+
+
+class PrometheusTextfileSink(MetricsSink):
+    """
+    Writes all metrics to a file in the Prometheus text exposition
+    format. The file is replaced atomically, so a collector never reads
+    a partial file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        items = list(labels) + list(extra)
+        if not items:
+            return ''
+        return '{' + ','.join(
+            '{}="{}"'.format(
+                name,
+                str(value).replace('\\', '\\\\').replace('"', '\\"')
+            ) for name, value in items
+        ) + '}'
+
+    def format(self, snapshot):
+        lines = []
+        for name, series in sorted(snapshot['counters'].items()):
+            lines.append('# TYPE {}{} counter'.format(PREFIX, name))
+            for labels, value in series:
+                lines.append('{}{}{} {}'.format(
+                    PREFIX, name, self._labels(labels), value
+                ))
+        for name, series in sorted(snapshot['summaries'].items()):
+            lines.append('# TYPE {}{} summary'.format(PREFIX, name))
+            for labels, summary in series:
+                labels = self._labels(labels)
+                lines.append('{}{}_count{} {}'.format(
+                    PREFIX, name, labels, summary['count']
+                ))
+                lines.append('{}{}_sum{} {}'.format(
+                    PREFIX, name, labels, summary['sum']
+                ))
+            lines.append('# TYPE {}{}_max gauge'.format(PREFIX, name))
+            for labels, summary in series:
+                lines.append('{}{}_max{} {}'.format(
+                    PREFIX, name, self._labels(labels), summary['max']
+                ))
+        return '\n'.join(lines) + '\n'
+
+    def export(self, snapshot):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.format(snapshot))
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+
+class Metrics(object):
+    """
+    Registry of counters and summaries.
+    """
+
+    def __init__(self, export_interval=15):
+        """
+        Arguments:
+            export_interval -- seconds between exports to the sinks
+        """
+        self._logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._summaries = {}
+        self._sinks = []
+        self.export_interval = export_interval
+        self._last_export = time.monotonic()
+
+    def add_sink(self, sink):
+        with self._lock:
+            self._sinks.append(sink)
+
+    def remove_sink(self, sink):
+        with self._lock:
+            self._sinks.remove(sink)
+
+    def _record(self, kind, name, value, labels):
+        key = (name, _label_key(labels))
+        now = time.monotonic()
+        with self._lock:
+            if kind == COUNTER:
+                self._counters[key] = self._counters.get(key, 0) + value
+            else:
+                summary = self._summaries.get(key)
+                if summary is None:
+                    summary = self._summaries[key] = [0, 0.0, value]
+                summary[0] += 1
+                summary[1] += value
+                summary[2] = max(summary[2], value)
+            sinks = list(self._sinks)
+            export = (
+                sinks and now - self._last_export >= self.export_interval
+            )
+            if export:
+                self._last_export = now
+        for sink in sinks:
+            try:
+                sink.record(kind, name, value, labels)
+            except Exception as e:
+                self._logger.warning(
+                    'Unable to record metric {} in {}: {}'.format(
+                        name,
+                        sink,
+                        e
+                    )
+                )
+        if export:
+            self.flush()
+
+    def inc(self, name, value=1, **labels):
+        """
+        Adds value to a counter.
+        """
+        self._record(COUNTER, name, value, labels)
+
+    def observe(self, name, value, **labels):
+        """
+        Adds an observation (for example a duration in seconds) to a
+        summary.
+        """
+        self._record(SUMMARY, name, value, labels)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Context manager observing the time spent in its block, in
+        seconds, in the summary name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        """
+        Returns:
+            A dict with 'counters' and 'summaries', each mapping metric
+            names to lists of (labels, value) pairs. labels is a tuple of
+            (name, value) pairs and summary values are dicts with count,
+            sum and max.
+        """
+        counters = {}
+        summaries = {}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                counters.setdefault(name, []).append((labels, value))
+            for (name, labels), (count, total, maximum) in (
+                self._summaries.items()
+            ):
+                summaries.setdefault(name, []).append(
+                    (labels, {'count': count, 'sum': total, 'max': maximum})
+                )
+        for series in counters.values():
+            series.sort()
+        for series in summaries.values():
+            series.sort(key=lambda item: item[0])
+        return {'counters': counters, 'summaries': summaries}
+
+    def flush(self):
+        """
+        Exports a snapshot to every sink now.
+        """
+        with self._lock:
+            sinks = list(self._sinks)
+        if not sinks:
+            return
+        snapshot = self.snapshot()
+        for sink in sinks:
+            try:
+                sink.export(snapshot)
+            except Exception as e:
+                self._logger.warning(
+                    'Unable to export metrics to {}: {}'.format(sink, e)
+                )
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._summaries.clear()
+
+
+# The registry used by the plugin and its helpers
+registry = Metrics()
+
+
+def configure(settings):
+    """
+    Sets up the registry from the Pocketsphinx_KWS.metrics profile
+    section, for example:
+
+        Pocketsphinx_KWS:
+          metrics:
+            textfile: /var/lib/node_exporter/pocketsphinx_kws.prom
+            export_interval: 15
+    """
+    registry.export_interval = float(settings.get('export_interval', 15))
+    textfile = settings.get('textfile')
+    if textfile:
+        path = os.path.abspath(os.path.expanduser(textfile))
+        with registry._lock:
+            exists = any(
+                isinstance(sink, PrometheusTextfileSink) and sink.path == path
+                for sink in registry._sinks
+            )
+        if not exists:
+            registry.add_sink(PrometheusTextfileSink(path))
@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide registry of acoustic models and decoders.
+
+The pocketsphinx Python API gives every Decoder its own copy of the
+acoustic model, and there is no way to hand one loaded model to several
+decoders. The registry therefore shares at the level above: every
+plugin instance in a process that uses the same model, dictionary and
+keyword file gets the same Config, DecoderPool and keywords, so a second
+listener reuses decoders that are already loaded instead of loading the
+model again. Each decoder in a pool still holds its own copy of the
+model, so memory grows with the number of decoders in use at once, not
+with the number of plugin instances.
+
+Across processes, decoders are configured to memory map the model files
+read only, and the files are read ahead into the page cache once, so
+worker processes share one copy of the model in the page cache.
+"""
+import functools
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from .decoderpool import DecoderPool
+from . import metrics
+
+# Files every acoustic model directory needs, see
+# http://cmusphinx.sourceforge.net/wiki/acousticmodelformat
+REQUIRED_MODEL_FILES = (
+    'mdef', 'feat.params', 'means', 'noisedict', 'transition_matrices',
+    'variances'
+)
+# Large model files worth reading ahead into the page cache
+MODEL_DATA_FILES = ('means', 'variances', 'mixture_weights', 'sendump')
+
+
+def _directory_signature(directory):
+    try:
+        return tuple(
+            (entry.name, entry.stat().st_mtime_ns)
+            for entry in sorted(os.scandir(directory), key=lambda e: e.name)
+        )
+    except FileNotFoundError:
+        return None
+
+
+def read_ahead(hmm_dir):
+    """
+    Asks the kernel to load the model's data files into the page cache,
+    so that every process mapping them shares the same pages. Does
+    nothing where posix_fadvise is not available.
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    for name in MODEL_DATA_FILES:
+        path = os.path.join(hmm_dir, name)
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+
+def _file_digest(path):
+    # The vocabulary files are small, so they are hashed in full every
+    # time rather than trusting their size and mtime
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+class ModelEntry(object):
+    """
+    The shared Config, DecoderPool and vocabulary of one model,
+    dictionary and keyword file combination.
+
+    Every plugin instance using the entry sees the same keywords: the
+    thresholds, the keyword set and the words added at runtime live here
+    rather than on the instances. The entry also remembers the contents
+    of the dictionary and keyword files its decoders were built from.
+    When another instance rewrites them, sync() merges the keywords back
+    in and the decoders reload the files at their next utterance
+    boundary.
+    """
+
+    def __init__(self, hmm_dir, dict_path, kws_path, pool_size=1):
+        # pocketsphinx is imported here rather than at module level so
+        # that importing the plugin stays fast
+        from pocketsphinx import pocketsphinx
+        self._logger = logging.getLogger(__name__)
+        self.key = (hmm_dir, dict_path, kws_path)
+        self.dict_path = dict_path
+        self.kws_path = kws_path
+        read_ahead(hmm_dir)
+        # Pocketsphinx v5
+        self.config = pocketsphinx.Config(
+            hmm=hmm_dir,
+            kws=kws_path,
+            dict=dict_path,
+            mmap=True
+        )
+        self.pool = DecoderPool(self._create_decoder, pool_size)
+        self.users = 0
+        self.lock = threading.RLock()
+        # Keyword -> threshold, and the set of keywords reported, which
+        # streaming sessions share and which is updated in place
+        self.thresholds = OrderedDict()
+        self.keyword_set = set()
+        # Dictionary entries added at runtime, (word, phones) pairs
+        self.added_words = []
+        # Every pronunciation the decoders have been given, by word, so
+        # they can be written back if the dictionary file is replaced
+        self.pronunciations = {}
+        self._dict_digest = None
+        self._kws_digest = None
+        self._kws_generation = 0
+        # Bumped whenever the dictionary file changes under the decoders,
+        # and the value each decoder was built or reloaded with
+        self._dict_generation = 0
+        self._decoder_dict_generations = {}
+
+    def _create_decoder(self):
+        from pocketsphinx import pocketsphinx
+        with self.lock:
+            generation = self._dict_generation
+        with metrics.registry.timer('decoder_create_seconds'):
+            decoder = pocketsphinx.Decoder(self.config)
+        with self.lock:
+            self._decoder_dict_generations[id(decoder)] = generation
+        return decoder
+
+    def _restore_dictionary(self):
+        # Appends pronunciations that a rewrite of the dictionary file
+        # dropped. Returns True if the file changed since it was last
+        # seen. Must be called with self.lock held.
+        from . import lexicon
+        from . import sphinxvocab
+        digest = _file_digest(self.dict_path)
+        if digest == self._dict_digest:
+            return False
+        current = lexicon.read_dictionary(self.dict_path)
+        missing = sorted(set(self.pronunciations) - set(current))
+        if missing:
+            with open(self.dict_path, 'a') as f:
+                for word in missing:
+                    f.write(
+                        sphinxvocab.format_dictionary_entry(
+                            word,
+                            self.pronunciations[word]
+                        )
+                    )
+        self.pronunciations.update(current)
+        self._dict_digest = _file_digest(self.dict_path)
+        return True
+
+    def sync(self, thresholds):
+        """
+        Merges a plugin instance's keywords into the entry and brings
+        the files and decoders up to date. Called when an instance
+        starts using the entry, after it has compiled its vocabulary.
+
+        Arguments:
+            thresholds -- the instance's keyword thresholds
+
+        Returns:
+            True if the keyword file had to be written
+        """
+        with self.lock:
+            changed = False
+            for keyword, threshold in thresholds.items():
+                if self.thresholds.get(keyword) != threshold:
+                    self.thresholds[keyword] = threshold
+                    changed = True
+            reload = self._restore_dictionary()
+            if self._kws_digest is None:
+                # First user, the decoders do not exist yet
+                reload = False
+            elif _file_digest(self.kws_path) != self._kws_digest:
+                changed = True
+            if not (changed or reload or self._kws_digest is None):
+                return False
+            return self.update_keywords(reload=reload)
+
+    def update_keywords(self, reload=False):
+        """
+        Writes the keyword file and switches every decoder to the
+        current keywords at its next utterance boundary.
+
+        Arguments:
+            reload -- the dictionary file changed, so decoders have to
+                      reload it
+
+        Returns:
+            True if the keyword file was written
+        """
+        from . import sphinxvocab
+        with self.lock:
+            if reload:
+                self._dict_generation += 1
+            written = sphinxvocab.write_thresholds(
+                self.kws_path,
+                self.thresholds.items()
+            )
+            self._kws_digest = _file_digest(self.kws_path)
+            keywords = list(self.thresholds)
+            self.keyword_set.intersection_update(keywords)
+            self.keyword_set.update(keywords)
+            self._kws_generation += 1
+            configure = functools.partial(
+                self._configure_decoder,
+                self._dict_generation,
+                "kws_{}".format(self._kws_generation),
+                list(self.added_words)
+            )
+        self.pool.reconfigure(configure)
+        return written
+
+    def _configure_decoder(self, dict_generation, search_name, words,
+                           decoder):
+        # Brings a decoder up to date between utterances: reloads the
+        # files if the dictionary was replaced, adds any new dictionary
+        # words and swaps in the current keyword search
+        with self.lock:
+            current = self._decoder_dict_generations.get(id(decoder), 0)
+        if current < dict_generation:
+            decoder.reinit(self.config)
+            with self.lock:
+                self._decoder_dict_generations[id(decoder)] = dict_generation
+        for word, phones in words:
+            if decoder.lookup_word(word) is None:
+                decoder.add_word(word, phones, False)
+        previous = decoder.current_search()
+        decoder.add_kws(search_name, self.kws_path)
+        decoder.activate_search(search_name)
+        if previous != search_name:
+            decoder.remove_search(previous)
+
+    def add_keyword(self, keyword, threshold):
+        """
+        Adds a keyword, or changes its threshold, for every instance
+        using the entry. Pronunciations are looked up only for words
+        that are not in the dictionary yet, and appended to it.
+
+        Raises:
+            ValueError if a word of the keyword has no pronunciation.
+            If the decoders refuse the new keyword search, the previous
+            keywords are restored and the decoder's error is raised.
+        """
+        from . import sphinxvocab
+        with self.lock:
+            # Picks up a dictionary rewritten by a vocabulary compile
+            reload = self._restore_dictionary()
+            new_words = set(keyword.split()) - set(self.pronunciations)
+            if new_words:
+                g2pconverter = sphinxvocab.create_g2p_converter()
+                try:
+                    pronunciations = sphinxvocab.lookup_pronunciations(
+                        g2pconverter,
+                        new_words
+                    )
+                finally:
+                    g2pconverter.cache.close()
+                # The decoders refuse a keyword search with an unknown
+                # word, so nothing is changed unless every word can be
+                # pronounced
+                missing = sorted(
+                    word for word in new_words if not pronunciations.get(word)
+                )
+                if missing:
+                    raise ValueError(
+                        'No pronunciation found for {}'.format(
+                            ', '.join(missing)
+                        )
+                    )
+                self._add_words(
+                    {word: pronunciations[word] for word in new_words}
+                )
+            previous = OrderedDict(self.thresholds)
+            self.thresholds[keyword] = threshold
+            self._update_or_restore(previous, reload)
+
+    def remove_keyword(self, keyword):
+        """
+        Stops listening for a keyword for every instance using the
+        entry. Its dictionary entries are kept.
+        """
+        with self.lock:
+            if len(self.thresholds) == 1 and keyword in self.thresholds:
+                raise ValueError('Cannot remove the last keyword')
+            previous = OrderedDict(self.thresholds)
+            del self.thresholds[keyword]
+            self._update_or_restore(previous)
+
+    def _update_or_restore(self, previous, reload=False):
+        # Applies the current keywords. If a decoder refuses them, the
+        # previous keywords are written back and applied again, so one
+        # bad keyword cannot break the shared decoders. Must be called
+        # with self.lock held.
+        try:
+            self.update_keywords(reload=reload)
+        except Exception:
+            self.thresholds.clear()
+            self.thresholds.update(previous)
+            try:
+                self.update_keywords(reload=reload)
+            except Exception as e:
+                self._logger.error(
+                    'Unable to restore the previous keywords: {}'.format(e)
+                )
+            raise
+
+    def _add_words(self, pronunciations):
+        # Appends runtime additions to the dictionary file and queues
+        # them for the decoders. Must be called with self.lock held.
+        from . import sphinxvocab
+        with open(self.dict_path, 'a') as f:
+            for word in sorted(pronunciations):
+                f.write(
+                    sphinxvocab.format_dictionary_entry(
+                        word,
+                        pronunciations[word]
+                    )
+                )
+                # The decoder only takes one pronunciation per
+                # add_word() call, alternates are named word(2)
+                for index, phones in enumerate(pronunciations[word]):
+                    name = word if index == 0 else "{}({})".format(
+                        word,
+                        index + 1
+                    )
+                    self.added_words.append((name, " ".join(phones)))
+        self.pronunciations.update(pronunciations)
+        # The decoders learn these words through add_word(), so the
+        # file change does not need a reload
+        self._dict_digest = _file_digest(self.dict_path)
+
+
+class ModelRegistry(object):
+    """
+    Hands out shared decoder pools, keyed by the files they are built
+    from.
+    """
+
+    def __init__(self):
+        self._logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._entries = {}
+        # Validation results per model directory, with the directory
+        # signature they were made for
+        self._checked = {}
+
+    def missing_files(self, hmm_dir):
+        """
+        Checks that hmm_dir holds a complete acoustic model. The result
+        is cached until a file in the directory changes.
+
+        Returns:
+            A list of the missing files, empty if the model is complete
+        """
+        signature = _directory_signature(hmm_dir)
+        with self._lock:
+            cached = self._checked.get(hmm_dir)
+            if cached is not None and cached[0] == signature:
+                return list(cached[1])
+        missing = [
+            name for name in REQUIRED_MODEL_FILES
+            if not os.path.exists(os.path.join(hmm_dir, name))
+        ]
+        # Only mixture_weights OR sendump is needed
+        if not (
+            os.path.exists(os.path.join(hmm_dir, 'mixture_weights'))
+            or os.path.exists(os.path.join(hmm_dir, 'sendump'))
+        ):
+            missing.append('mixture_weights or sendump')
+        with self._lock:
+            self._checked[hmm_dir] = (signature, missing)
+        return list(missing)
+
+    def acquire(self, hmm_dir, dict_path, kws_path, thresholds,
+                pool_size=1):
+        """
+        Returns the shared model entry for these files, creating it on
+        first use, and merges the caller's keywords into it (see
+        ModelEntry.sync()). A later caller asking for a larger pool
+        grows it. Call release() when done with the entry.
+
+        Arguments:
+            thresholds -- the caller's keyword thresholds
+
+        Returns:
+            A tuple of the ModelEntry and whether the keyword file was
+            written
+        """
+        key = (
+            os.path.abspath(hmm_dir),
+            os.path.abspath(dict_path),
+            os.path.abspath(kws_path)
+        )
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = ModelEntry(*key, pool_size=pool_size)
+                self._entries[key] = entry
+            else:
+                self._logger.debug('Sharing decoders for {}'.format(key))
+                entry.pool.grow(pool_size)
+            entry.users += 1
+        try:
+            written = entry.sync(thresholds)
+        except BaseException:
+            self.release(entry)
+            raise
+        return entry, written
+
+    def release(self, entry):
+        """
+        Gives up one use of an entry. The entry and its decoders are
+        dropped when nobody uses it any more.
+        """
+        with self._lock:
+            entry.users -= 1
+            if entry.users <= 0 and self._entries.get(entry.key) is entry:
+                del self._entries[entry.key]
+
+    def stats(self):
+        """
+        Returns:
+            A list of dicts describing every shared pool
+        """
+        with self._lock:
+            entries = list(self._entries.items())
+        return [
+            dict(
+                hmm=key[0],
+                dict=key[1],
+                kws=key[2],
+                users=entry.users,
+                **entry.pool.stats()
+            )
+            for key, entry in entries
+        ]
+
+
+# The registry shared by every plugin instance in this process
+registry = ModelRegistry()
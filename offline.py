@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers for decoding saved recordings in worker processes. Each worker
+builds its own pocketsphinx decoder once, in init_worker(), and reuses it
+for every clip it is given.
+"""
+import os
+from . import audio
+
+# Frames decoded between checks for a keyword by decode_early_exit()
+EARLY_EXIT_FRAMES = 10
+
+# The decoder belonging to this worker process
+_decoder = None
+
+
+def decoder_args(hmm_dir, dict_path, kws_path):
+    """
+    Returns:
+        The keyword arguments for pocketsphinx.Config used by workers.
+        The model files are memory mapped, so workers share them through
+        the page cache.
+    """
+    return {
+        'hmm': hmm_dir,
+        'dict': dict_path,
+        'kws': kws_path,
+        'logfn': os.devnull,
+        'mmap': True
+    }
+
+
+def init_worker(args):
+    """
+    Process pool initializer: builds this worker's decoder.
+
+    Arguments:
+        args -- keyword arguments for pocketsphinx.Config, see
+                decoder_args()
+    """
+    global _decoder
+    from pocketsphinx import pocketsphinx
+    from . import models
+    models.read_ahead(args['hmm'])
+    _decoder = pocketsphinx.Decoder(pocketsphinx.Config(**args))
+
+
+def get_decoder():
+    return _decoder
+
+
+def read_wav(path, decoder=None):
+    """
+    Loads a WAV file at the decoder's sample rate.
+
+    Returns:
+        A tuple of the samples and the duration in seconds
+    """
+    if decoder is None:
+        decoder = _decoder
+    samplerate = int(decoder.config['samprate'])
+    samples = audio.load_audio(path, samplerate)
+    return samples, len(samples) / samplerate
+
+
+def decode(audio_data, decoder=None):
+    """
+    Decodes one complete utterance.
+
+    Arguments:
+        audio_data -- int16 samples or raw 16 bit PCM bytes
+
+    Returns:
+        A list of (keyword, start_frame, end_frame, score) tuples
+    """
+    if decoder is None:
+        decoder = _decoder
+    if not isinstance(audio_data, (bytes, bytearray, memoryview)):
+        audio_data = audio.as_bytes(audio_data)
+    decoder.start_utt()
+    decoder.process_raw(audio_data, False, True)
+    decoder.end_utt()
+    return [
+        (s.word.strip(), s.start_frame, s.end_frame, s.prob)
+        for s in decoder.seg()
+    ]
+
+
+def decode_early_exit(audio_data, block_frames=EARLY_EXIT_FRAMES,
+                      decoder=None, keywords=None):
+    """
+    Decodes an utterance in blocks of block_frames frames and stops as
+    soon as the spotter fires, so the rest of the audio is never decoded.
+
+    Arguments:
+        audio_data -- int16 samples or raw 16 bit PCM bytes
+        keywords -- the keywords that may be reported, or None for any
+
+    Returns:
+        A tuple of a list holding the first (keyword, start_frame,
+        end_frame, score) detection, empty if there was none, and the
+        number of samples decoded
+    """
+    if decoder is None:
+        decoder = _decoder
+    if not isinstance(audio_data, (bytes, bytearray, memoryview)):
+        audio_data = audio.as_bytes(audio_data)
+    config = decoder.config
+    block = (
+        block_frames * int(config['samprate']) // int(config['frate']) * 2
+    )
+    decoded = 0
+    decoder.start_utt()
+    for offset in range(0, len(audio_data), block):
+        decoder.process_raw(audio_data[offset:offset + block], False, False)
+        decoded = min(len(audio_data), offset + block)
+        if decoder.hyp() is not None:
+            break
+    decoder.end_utt()
+    for s in decoder.seg():
+        word = s.word.strip()
+        if keywords is None or word in keywords:
+            return [(word, s.start_frame, s.end_frame, s.prob)], decoded // 2
+    return [], decoded // 2
+
+
+def decode_file(path):
+    """
+    Decodes a WAV file with this worker's decoder.
+
+    Returns:
+        A dict with the file name, its duration in seconds and its
+        detections
+    """
+    audio_data, duration = read_wav(path)
+    return {
+        'file': path,
+        'duration': duration,
+        'detections': decode(audio_data)
+    }
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
+import functools
 import logging
+import re
+from collections import Counter
 
 XSAMPA_TO_ARPABET_MAPPING = {
     # stop
@@ -94,29 +97,82 @@ XSAMPA_TO_ARPABET_MAPPING = {
     'q': 'K'
 }
 
-MAX_PHONE_LENGTH = max([len(x) for x in XSAMPA_TO_ARPABET_MAPPING.keys()])
-
-
-def xsampa_to_arpabet(xsampa_string, sep=' '):
-    logger = logging.getLogger(__name__)
-    s = xsampa_string.replace('-', '').replace('\'', '').replace(' ', '')
+# Syllable and stress marks, dropped before conversion
+_IGNORED = str.maketrans('', '', "-' ")
+
+# Matches the longest X-SAMPA phone at the current position (the
+# alternatives are tried longest first), or any single character that
+# is not a known phone
+_RE_XSAMPA = re.compile(
+    '|'.join(
+        re.escape(phone) for phone in sorted(
+            XSAMPA_TO_ARPABET_MAPPING,
+            key=len,
+            reverse=True
+        )
+    ) + '|(.)',
+    re.DOTALL
+)
+
+
+@functools.lru_cache(maxsize=4096)
+def _convert(xsampa_string):
+    # Returns a tuple of ARPAbet phones and a tuple of the characters
+    # that did not match any phone
     result = []
-
-    i = 0
-    while i < len(s):
-        num_remaining_chars = len(s) - i
-        phone_length = (MAX_PHONE_LENGTH
-                        if MAX_PHONE_LENGTH > num_remaining_chars
-                        else num_remaining_chars)
-
-        for j in range(phone_length, 0, -1):
-            phone = s[i:i + j]
-            if phone in XSAMPA_TO_ARPABET_MAPPING:
-                result.append(XSAMPA_TO_ARPABET_MAPPING[phone])
-                i += j
-                break
+    unmapped = []
+    for match in _RE_XSAMPA.finditer(xsampa_string.translate(_IGNORED)):
+        if match.group(1) is None:
+            result.append(XSAMPA_TO_ARPABET_MAPPING[match.group(0)])
         else:
-            logger.warning("Phone not found:  '%s'", s[i])
-            i += 1
+            unmapped.append(match.group(1))
+    return tuple(result), tuple(unmapped)
+
+
+def _report_unmapped(unmapped):
+    if unmapped:
+        logging.getLogger(__name__).warning(
+            "Phones not found: %s",
+            ", ".join(
+                "'{}' ({}x)".format(phone, count)
+                for phone, count in unmapped.most_common()
+            )
+        )
+
+
+def convert_pronunciations(pronunciations):
+    """
+    Converts X-SAMPA pronunciations to ARPAbet. Unknown phones are
+    dropped and reported in a single warning for the whole batch.
+
+    Arguments:
+        pronunciations -- an iterable of pronunciations, each a list of
+                          X-SAMPA phones
+
+    Returns:
+        A list of pronunciations, each a list of ARPAbet phones
+    """
+    unmapped = Counter()
+    converted = []
+    for pronunciation in pronunciations:
+        phones = []
+        for phone in pronunciation:
+            result, missing = _convert(phone)
+            phones.extend(result)
+            unmapped.update(missing)
+        converted.append(phones)
+    _report_unmapped(unmapped)
+    return converted
+
 
+def xsampa_to_arpabet(xsampa_string, sep=' '):
+    """
+    Converts an X-SAMPA string to ARPAbet, matching the longest known
+    phone at each position.
+
+    Returns:
+        The ARPAbet phones joined by sep
+    """
+    result, unmapped = _convert(xsampa_string)
+    _report_unmapped(Counter(unmapped))
     return sep.join(result)
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded recovery from decoder faults.
+
+When decoding raises a RuntimeError, DecoderRecovery retries a limited
+number of times with exponential backoff, first after reinit() of the
+same decoder and then after replacing it with a freshly built one. If
+the decoder still fails, the circuit opens: calls fail fast with
+DecoderUnavailable while a background thread keeps probing, with
+backoff, until a new decoder works again and the circuit closes.
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+
+CLOSED = 'closed'
+OPEN = 'open'
+
+# Emitted on every step of the recovery. event is one of 'reinit',
+# 'rebuild', 'open', 'probe_failed' or 'closed', attempt counts the
+# attempts of the current recovery and error is the exception that
+# caused the step, if any.
+RecoveryEvent = namedtuple(
+    'RecoveryEvent',
+    ['event', 'state', 'attempt', 'error']
+)
+
+
+class DecoderUnavailable(RuntimeError):
+    """
+    Raised instead of decoding while the circuit is open.
+    """
+    pass
+
+
+class DecoderRecovery(object):
+    """
+    Runs decoding operations and recovers from decoder faults.
+    """
+
+    def __init__(
+        self,
+        reinit,
+        rebuild,
+        probe,
+        reinit_attempts=2,
+        rebuild_attempts=1,
+        backoff=0.05,
+        max_backoff=2.0,
+        probe_interval=5.0
+    ):
+        """
+        Arguments:
+            reinit -- callable re-initializing a decoder in place
+            rebuild -- callable taking a broken decoder and returning a
+                       new one to use in its place
+            probe -- callable checking that a new decoder can be built
+                     and used, raising an exception if not
+            reinit_attempts -- retries after reinit() before rebuilding
+            rebuild_attempts -- retries after rebuilding before the
+                                circuit opens
+            backoff -- seconds to wait before the first retry, doubled
+                       for each further retry
+            max_backoff -- the longest wait between retries
+            probe_interval -- the longest wait between background probes
+                              while the circuit is open
+        """
+        self._logger = logging.getLogger(__name__)
+        self._reinit = reinit
+        self._rebuild = rebuild
+        self._probe = probe
+        self.reinit_attempts = reinit_attempts
+        self.rebuild_attempts = rebuild_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.probe_interval = probe_interval
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._listeners = []
+
+    @classmethod
+    def from_profile(cls, settings, reinit, rebuild, probe):
+        """
+        Builds a DecoderRecovery from the Pocketsphinx_KWS.recovery
+        profile section.
+        """
+        return cls(
+            reinit,
+            rebuild,
+            probe,
+            reinit_attempts=int(settings.get('reinit_attempts', 2)),
+            rebuild_attempts=int(settings.get('rebuild_attempts', 1)),
+            backoff=float(settings.get('backoff', 0.05)),
+            max_backoff=float(settings.get('max_backoff', 2.0)),
+            probe_interval=float(settings.get('probe_interval', 5.0))
+        )
+
+    @property
+    def state(self):
+        return self._state
+
+    def add_listener(self, listener):
+        """
+        Arguments:
+            listener -- callable receiving every RecoveryEvent
+        """
+        self._listeners.append(listener)
+
+    def _emit(self, event, attempt=0, error=None):
+        event = RecoveryEvent(event, self._state, attempt, error)
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                self._logger.warning(
+                    'Recovery listener failed: {}'.format(e)
+                )
+
+    def _delay(self, attempt, limit):
+        return min(limit, self.backoff * (2 ** attempt))
+
+    def run(self, decoder, operation):
+        """
+        Runs operation(decoder), recovering from RuntimeErrors.
+
+        Returns:
+            A tuple of the result of operation and the decoder it ran
+            on, which is a new decoder if the original one was rebuilt.
+            The caller owns whichever decoder is returned.
+
+        Raises:
+            DecoderUnavailable if the circuit is open, or opens during
+            this call. The exception's decoder attribute holds the
+            decoder the caller now owns.
+        """
+        if self._state == OPEN:
+            error = DecoderUnavailable('Pocketsphinx decoder is unavailable')
+            error.decoder = decoder
+            raise error
+        steps = (
+            [self._reinit_step] * self.reinit_attempts
+            + [self._rebuild_step] * self.rebuild_attempts
+        )
+        attempt = 0
+        while True:
+            try:
+                return operation(decoder), decoder
+            except RuntimeError as e:
+                if attempt >= len(steps):
+                    self._open(attempt, e)
+                    error = DecoderUnavailable(
+                        'Pocketsphinx decoder failed {} times: {}'.format(
+                            attempt + 1,
+                            e
+                        )
+                    )
+                    error.decoder = decoder
+                    raise error from e
+                time.sleep(self._delay(attempt, self.max_backoff))
+                try:
+                    decoder = steps[attempt](decoder, attempt + 1, e)
+                except RuntimeError as step_error:
+                    self._logger.warning(
+                        'Decoder recovery step failed: {}'.format(step_error)
+                    )
+                attempt += 1
+
+    def _reinit_step(self, decoder, attempt, error):
+        self._emit('reinit', attempt, error)
+        self._reinit(decoder)
+        return decoder
+
+    def _rebuild_step(self, decoder, attempt, error):
+        self._emit('rebuild', attempt, error)
+        return self._rebuild(decoder)
+
+    def _open(self, attempt, error):
+        with self._lock:
+            if self._state == OPEN:
+                return
+            self._state = OPEN
+        self._logger.error(
+            'Pocketsphinx decoder keeps failing, giving up for now: {}'.format(
+                error
+            )
+        )
+        self._emit('open', attempt, error)
+        threading.Thread(
+            target=self._recover,
+            name='kws-recovery',
+            daemon=True
+        ).start()
+
+    def _recover(self):
+        attempt = 0
+        while True:
+            time.sleep(self._delay(attempt, self.probe_interval))
+            attempt += 1
+            try:
+                self._probe()
+            except Exception as e:
+                self._emit('probe_failed', attempt, e)
+                continue
+            with self._lock:
+                self._state = CLOSED
+            self._logger.info('Pocketsphinx decoder recovered')
+            self._emit('closed', attempt)
+            return
@@ -0,0 +1,485 @@
+# -*- coding: utf-8 -*-
+"""
+Accuracy and latency scoreboard for keyword spotting, to be run as a
+gate before new thresholds, dictionaries or decoding settings go out.
+
+First build a reference corpus from keyword recordings and background
+noise. Each keyword recording is mixed into noise at every SNR and
+offset, and noise only clips are added to count false alarms:
+
+    python -m pocketsphinx_kws.scoreboard generate \\
+        --keywords recordings/keywords --noise recordings/noise \\
+        --output corpus/
+
+recordings/keywords holds one directory of WAV files per keyword
+(recordings/keywords/naomi/*.wav). Without --noise, white noise is used.
+
+Then score it, decoding in parallel across all cores:
+
+    python -m pocketsphinx_kws.scoreboard run corpus/ --hmm ~/model/en-us \\
+        --dict .../dictionary --kws candidate.thresholds \\
+        --mode utterance --mode stream --min-hit-rate 0.9 \\
+        --max-false-alarms 1.0 --baseline last_release.json -o report.json
+
+--plugin scores PocketsphinxKWSPlugin.transcribe() and start_stream()
+loaded through Naomi with the current profile instead. The command exits
+with status 1 if any keyword in any mode misses a gate.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from . import audio
+from . import offline
+from .benchmark import percentile
+
+SAMPLERATE = 16000
+MODES = ('utterance', 'early_exit', 'stream')
+# Chunk size used for the streaming mode, in seconds
+STREAM_CHUNK = 0.1
+MANIFEST = 'manifest.jsonl'
+
+# What the worker decodes with: a Naomi plugin instance or, without
+# one, offline.py's decoder
+_plugin = None
+
+
+def _rms(samples):
+    import numpy as np
+    if len(samples) == 0:
+        return 0.0
+    samples = samples.astype(np.float64)
+    return float(np.sqrt(np.mean(samples * samples)))
+
+
+def _write_wav(path, samples):
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLERATE)
+        w.writeframes(audio.as_bytes(samples))
+
+
+def _noise(rng, noise_files, length):
+    import numpy as np
+    if not noise_files:
+        return np.random.default_rng(rng.randrange(2 ** 32)).normal(
+            0, 1000, length
+        )
+    noise = audio.load_audio(rng.choice(noise_files), SAMPLERATE)
+    noise = noise.astype(np.float64)
+    if len(noise) < length:
+        noise = np.tile(noise, -(-length // len(noise)))
+    start = rng.randint(0, len(noise) - length)
+    return noise[start:start + length]
+
+
+def mix(keyword, noise, offset, snr):
+    """
+    Mixes a keyword recording into noise.
+
+    Arguments:
+        keyword -- int16 samples of the keyword
+        noise -- float samples of the background, as long as the clip
+        offset -- sample at which the keyword starts
+        snr -- signal to noise ratio in dB, measured over the keyword
+
+    Returns:
+        The int16 samples of the clip
+    """
+    import numpy as np
+    mixed = noise.copy()
+    noise_rms = _rms(noise[offset:offset + len(keyword)])
+    if noise_rms:
+        mixed *= _rms(keyword) / (noise_rms * 10 ** (snr / 20))
+    mixed[offset:offset + len(keyword)] += keyword
+    return np.clip(mixed, -32768, 32767).astype(np.int16)
+
+
+def _wav_files(directory):
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith('.wav')
+    )
+
+
+def generate(keyword_dir, output_dir, noise_dir=None, snrs=(20, 10, 5, 0),
+             offsets=(0.25, 1.0, 2.0), clip_seconds=4.0, negatives=20,
+             seed=0):
+    """
+    Builds a reference corpus. Every clip is written with a .txt label
+    (as used by tuner.py) and described in manifest.jsonl.
+
+    Arguments:
+        keyword_dir -- directory with one directory of WAV recordings
+                       per keyword
+        output_dir -- where to write the corpus
+        noise_dir -- directory of background noise WAV files, white
+                     noise is used if None
+        snrs -- signal to noise ratios in dB
+        offsets -- keyword start times in seconds
+        clip_seconds -- length of every clip
+        negatives -- number of noise only clips
+
+    Returns:
+        The number of clips written
+    """
+    import numpy as np
+    rng = random.Random(seed)
+    noise_files = _wav_files(noise_dir) if noise_dir else []
+    length = int(clip_seconds * SAMPLERATE)
+    os.makedirs(output_dir, exist_ok=True)
+    entries = []
+
+    def write(name, samples, entry):
+        path = os.path.join(output_dir, name + '.wav')
+        _write_wav(path, samples)
+        with open(os.path.join(output_dir, name + '.txt'), 'w') as f:
+            f.write((entry['keyword'] or '') + '\n')
+        entry['file'] = os.path.basename(path)
+        entries.append(entry)
+
+    for keyword in sorted(os.listdir(keyword_dir)):
+        directory = os.path.join(keyword_dir, keyword)
+        if not os.path.isdir(directory):
+            continue
+        for n, recording in enumerate(_wav_files(directory)):
+            samples = audio.load_audio(recording, SAMPLERATE)
+            for snr in snrs:
+                for offset in offsets:
+                    start = int(offset * SAMPLERATE)
+                    if start + len(samples) > length:
+                        continue
+                    write(
+                        '{}_{:03d}_snr{}_at{}'.format(keyword, n, snr, offset),
+                        mix(samples, _noise(rng, noise_files, length),
+                            start, snr),
+                        {
+                            'keyword': keyword.lower(),
+                            'start': offset,
+                            'end': offset + len(samples) / SAMPLERATE,
+                            'snr': snr
+                        }
+                    )
+    for n in range(negatives):
+        noise = _noise(rng, noise_files, length)
+        write(
+            'negative_{:03d}'.format(n),
+            np.clip(noise, -32768, 32767).astype(np.int16),
+            {'keyword': None, 'start': None, 'end': None, 'snr': None}
+        )
+    with open(os.path.join(output_dir, MANIFEST), 'w') as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + '\n')
+    return len(entries)
+
+
+def read_manifest(corpus_dir):
+    with open(os.path.join(corpus_dir, MANIFEST), 'r') as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    for entry in entries:
+        entry['file'] = os.path.join(corpus_dir, entry['file'])
+    return entries
+
+
+def init_worker(decoder_args):
+    """
+    Process pool initializer: loads the plugin through Naomi if
+    decoder_args is None, or builds an offline decoder.
+    """
+    global _plugin
+    if decoder_args is None:
+        from .benchmark import load_plugin
+        _plugin = load_plugin()
+    else:
+        offline.init_worker(decoder_args)
+
+
+def _stream(samples, stream):
+    # Returns (keyword, audio seconds pushed when it was reported)
+    chunk = int(STREAM_CHUNK * SAMPLERATE)
+    detections = []
+    pushed = 0
+    with stream:
+        for start in range(0, len(samples), chunk):
+            block = samples[start:start + chunk]
+            pushed += len(block)
+            for event in stream.process(audio.as_bytes(block)):
+                detections.append((event.keyword, pushed / SAMPLERATE))
+        for event in stream.close():
+            detections.append((event.keyword, pushed / SAMPLERATE))
+    return detections
+
+
+def score_clip(args):
+    """
+    Decodes one clip in one mode.
+
+    Returns:
+        A dict with the detections as (keyword, seconds) pairs and the
+        wall time spent decoding. For the stream mode seconds is the
+        amount of audio pushed when the keyword was reported. For the
+        offline early_exit mode it is the amount of audio decoded before
+        the spotter fired plus the decoding time. Otherwise the whole
+        clip had to be available, so it is the clip length plus the
+        decoding time.
+    """
+    path, mode = args
+    samples = audio.load_audio(path, SAMPLERATE)
+    duration = len(samples) / SAMPLERATE
+    start = time.perf_counter()
+    if mode == 'stream':
+        if _plugin is not None:
+            stream = _plugin.start_stream()
+        else:
+            from .stream import KeywordStream
+            stream = KeywordStream(offline.get_decoder(), _keywords())
+        detections = _stream(samples, stream)
+        wall = time.perf_counter() - start
+    elif mode == 'early_exit' and _plugin is None:
+        found, decoded = offline.decode_early_exit(
+            samples,
+            keywords=_keywords()
+        )
+        wall = time.perf_counter() - start
+        detections = [
+            (d[0], decoded / SAMPLERATE + wall) for d in found
+        ]
+    else:
+        if _plugin is not None:
+            if mode == 'early_exit':
+                event = _plugin.spot(samples)
+                keywords = [event.keyword] if event is not None else []
+            else:
+                keywords = _plugin.transcribe(samples)
+        else:
+            keywords = [d[0] for d in offline.decode(samples)]
+        wall = time.perf_counter() - start
+        detections = [(keyword, duration + wall) for keyword in keywords]
+    return {
+        'file': path,
+        'mode': mode,
+        'duration': duration,
+        'wall': wall,
+        'detections': detections
+    }
+
+
+def _keywords():
+    # Keywords of the offline decoder's thresholds file
+    decoder = offline.get_decoder()
+    with open(decoder.config['kws'], 'r') as f:
+        return {line.split('\t')[0].strip() for line in f if line.strip()}
+
+
+def score(entries, results):
+    """
+    Scores the results of one mode against the manifest.
+
+    Returns:
+        A dict mapping each keyword to its hits, misses, false alarms,
+        hit rate, false alarms per hour and detection latency (seconds
+        from the end of the spoken keyword to the detection)
+    """
+    keywords = sorted({e['keyword'] for e in entries if e['keyword']})
+    hours = sum(r['duration'] for r in results) / 3600
+    report = {}
+    for keyword in keywords:
+        hits = misses = false_alarms = 0
+        latencies = []
+        for entry, result in zip(entries, results):
+            found = [t for k, t in result['detections'] if k == keyword]
+            if entry['keyword'] == keyword:
+                if found:
+                    hits += 1
+                    latencies.append(max(0.0, found[0] - entry['end']))
+                    false_alarms += len(found) - 1
+                else:
+                    misses += 1
+            else:
+                false_alarms += len(found)
+        spoken = hits + misses
+        report[keyword] = {
+            'hits': hits,
+            'misses': misses,
+            'false_alarms': false_alarms,
+            'hit_rate': hits / spoken if spoken else None,
+            'false_alarms_per_hour': false_alarms / hours if hours else None,
+            'latency_mean': (
+                sum(latencies) / len(latencies) if latencies else None
+            ),
+            'latency_p95': percentile(latencies, 95)
+        }
+    return report
+
+
+def run(corpus_dir, modes=('utterance',), decoder_args=None, workers=None):
+    """
+    Decodes the corpus in every mode across a pool of worker processes.
+
+    Arguments:
+        decoder_args -- offline.decoder_args() for the decoder to score,
+                        or None to score the plugin loaded through Naomi
+
+    Returns:
+        A dict mapping each mode to its score()
+    """
+    entries = read_manifest(corpus_dir)
+    jobs = [(entry['file'], mode) for mode in modes for entry in entries]
+    with ProcessPoolExecutor(
+        max_workers=workers or os.cpu_count(),
+        initializer=init_worker,
+        initargs=(decoder_args,)
+    ) as executor:
+        results = list(executor.map(score_clip, jobs, chunksize=4))
+    report = {}
+    for i, mode in enumerate(modes):
+        mode_results = results[i * len(entries):(i + 1) * len(entries)]
+        report[mode] = {
+            'keywords': score(entries, mode_results),
+            'clips': len(entries),
+            'decode_seconds': sum(r['wall'] for r in mode_results)
+        }
+    return report
+
+
+def check_gates(report, min_hit_rate=None, max_false_alarms=None,
+                max_latency=None, baseline=None, tolerance=0.02):
+    """
+    Returns:
+        A list of messages, one for every gate a keyword missed. Against
+        a baseline report, a hit rate more than tolerance lower or a
+        false alarm rate more than tolerance per hour higher fails.
+    """
+    failures = []
+    for mode, result in report.items():
+        for keyword, s in result['keywords'].items():
+            name = '{} ({})'.format(keyword, mode)
+            hit_rate = s['hit_rate'] or 0.0
+            fa = s['false_alarms_per_hour'] or 0.0
+            if min_hit_rate is not None and hit_rate < min_hit_rate:
+                failures.append('{}: hit rate {:.3f} < {}'.format(
+                    name, hit_rate, min_hit_rate))
+            if max_false_alarms is not None and fa > max_false_alarms:
+                failures.append('{}: {:.2f} false alarms/hour > {}'.format(
+                    name, fa, max_false_alarms))
+            if (
+                max_latency is not None and s['latency_p95'] is not None
+                and s['latency_p95'] > max_latency
+            ):
+                failures.append('{}: p95 latency {:.3f}s > {}s'.format(
+                    name, s['latency_p95'], max_latency))
+            try:
+                base = baseline[mode]['keywords'][keyword]
+            except (KeyError, TypeError):
+                continue
+            if hit_rate < (base['hit_rate'] or 0.0) - tolerance:
+                failures.append('{}: hit rate fell from {:.3f} to {:.3f}'.format(
+                    name, base['hit_rate'], hit_rate))
+            if fa > (base['false_alarms_per_hour'] or 0.0) + tolerance:
+                failures.append(
+                    '{}: false alarms/hour rose from {:.2f} to {:.2f}'.format(
+                        name, base['false_alarms_per_hour'] or 0.0, fa))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Keyword spotting accuracy and latency scoreboard'
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    gen = commands.add_parser('generate', help='build a reference corpus')
+    gen.add_argument('--keywords', required=True,
+                     help='directory with one directory of recordings per keyword')
+    gen.add_argument('--noise', help='directory of background noise recordings')
+    gen.add_argument('--output', required=True, help='corpus directory')
+    gen.add_argument('--snr', type=float, action='append',
+                     help='signal to noise ratio in dB, may be repeated')
+    gen.add_argument('--offset', type=float, action='append',
+                     help='keyword start in seconds, may be repeated')
+    gen.add_argument('--clip-seconds', type=float, default=4.0)
+    gen.add_argument('--negatives', type=int, default=20,
+                     help='number of noise only clips')
+    gen.add_argument('--seed', type=int, default=0)
+
+    score_cmd = commands.add_parser('run', help='score a corpus')
+    score_cmd.add_argument('corpus', help='corpus directory')
+    score_cmd.add_argument('--plugin', action='store_true',
+                           help='score the plugin loaded through Naomi')
+    score_cmd.add_argument('--hmm', help='pocketsphinx acoustic model directory')
+    score_cmd.add_argument('--dict', help='pronunciation dictionary')
+    score_cmd.add_argument('--kws', help='keyword thresholds file to score')
+    score_cmd.add_argument('--mode', action='append', choices=MODES,
+                           help='decoding mode, may be repeated')
+    score_cmd.add_argument('--workers', type=int, default=None,
+                           help='number of decoding processes (default: all CPUs)')
+    score_cmd.add_argument('--min-hit-rate', type=float)
+    score_cmd.add_argument('--max-false-alarms', type=float,
+                           help='false alarms per hour')
+    score_cmd.add_argument('--max-latency', type=float,
+                           help='p95 detection latency in seconds')
+    score_cmd.add_argument('--baseline', help='report of a previous run')
+    score_cmd.add_argument('--tolerance', type=float, default=0.02)
+    score_cmd.add_argument('-o', '--output', help='write the JSON report here')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'generate':
+        count = generate(
+            args.keywords,
+            args.output,
+            noise_dir=args.noise,
+            snrs=args.snr or (20, 10, 5, 0),
+            offsets=args.offset or (0.25, 1.0, 2.0),
+            clip_seconds=args.clip_seconds,
+            negatives=args.negatives,
+            seed=args.seed
+        )
+        print('Wrote {} clips to {}'.format(count, args.output))
+        return 0
+
+    if args.plugin:
+        decoder_args = None
+    elif args.hmm and args.dict and args.kws:
+        decoder_args = offline.decoder_args(args.hmm, args.dict, args.kws)
+    else:
+        parser.error('run needs --plugin or all of --hmm, --dict and --kws')
+    report = run(
+        args.corpus,
+        modes=args.mode or ('utterance',),
+        decoder_args=decoder_args,
+        workers=args.workers
+    )
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    failures = check_gates(
+        report,
+        min_hit_rate=args.min_hit_rate,
+        max_false_alarms=args.max_false_alarms,
+        max_latency=args.max_latency,
+        baseline=baseline,
+        tolerance=args.tolerance
+    )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    for mode, result in report.items():
+        for keyword, s in result['keywords'].items():
+            print('{:12} {:12} hit rate {}  FA/h {}  latency p95 {}'.format(
+                mode, keyword, s['hit_rate'], s['false_alarms_per_hour'],
+                s['latency_p95']))
+    for failure in failures:
+        print('FAIL ' + failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import functools
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Seconds of audio read from a stream per decoder call
+CHUNK_SECONDS = 0.1
+# Detections kept on the events queue when nobody is consuming them
+MAX_QUEUED_EVENTS = 1000
+
+
+class KWSServer(object):
+    """
+    Serves many concurrent PCM streams from one PocketsphinxKWSPlugin.
+
+    Every stream gets its own streaming session, and so its own decoder
+    from the plugin's decoder pool. Only as many streams as the pool has
+    decoders can be open at once; pass max_streams to grow the pool.
+    Decoding runs in a bounded thread pool so the event loop never
+    blocks on pocketsphinx. Waiting for a free decoder, or for a writer
+    to open a named pipe, happens on separate threads, so streams being
+    opened never hold up streams being decoded.
+
+    Streams can arrive over a unix socket: the client sends its stream
+    id followed by a newline, then raw 16 bit mono PCM. Each detection
+    is written back to the client as one line of JSON. If no decoder
+    becomes free within session_timeout seconds, the client gets a line
+    with the keys stream and error instead, and is disconnected. Streams
+    can also be read from named pipes with add_pipe().
+
+    Every detection, whatever its source, is also put on the events
+    queue as a dict with the keys stream, keyword, start_frame,
+    end_frame and score. If nobody consumes the queue, the oldest
+    detections are dropped.
+    """
+
+    def __init__(
+        self,
+        plugin,
+        max_workers=None,
+        session_timeout=5,
+        max_streams=None
+    ):
+        """
+        Arguments:
+            plugin -- a PocketsphinxKWSPlugin
+            max_workers -- the maximum number of decoder calls running at
+                           the same time, defaults to the number of CPUs
+            session_timeout -- seconds to wait for a free decoder when a
+                               stream is opened
+            max_streams -- the number of streams expected at the same
+                           time. The plugin's decoder pool is grown to
+                           hold a decoder for each of them. By default
+                           the pool keeps its decoder_pool_size.
+        """
+        self._logger = logging.getLogger(__name__)
+        self._plugin = plugin
+        if max_streams is not None:
+            plugin.reserve_decoders(max_streams)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or os.cpu_count() or 1,
+            thread_name_prefix='kws'
+        )
+        # For calls that mostly wait: decoder checkouts and opening
+        # named pipes
+        self._open_executor = ThreadPoolExecutor(
+            thread_name_prefix='kws-open'
+        )
+        self._session_timeout = session_timeout
+        self._tasks = set()
+        self.events = asyncio.Queue(MAX_QUEUED_EVENTS)
+
+    async def _run_stream(self, stream_id, reader, send=None):
+        loop = asyncio.get_running_loop()
+        try:
+            session = await loop.run_in_executor(
+                self._open_executor,
+                self._plugin.start_stream,
+                self._session_timeout
+            )
+        except TimeoutError:
+            self._logger.error(
+                "No decoder available for stream '%s'", stream_id
+            )
+            if send is not None:
+                await send({
+                    'stream': stream_id,
+                    'error': 'No decoder available'
+                })
+            return
+        self._logger.info("Stream '%s' opened", stream_id)
+        # Whole 16 bit samples
+        chunk_size = int(session.sample_rate * CHUNK_SECONDS) * 2
+        remainder = b''
+        try:
+            while True:
+                data = await reader.read(chunk_size)
+                if not data:
+                    break
+                data = remainder + data
+                # Keep whole 16 bit samples together
+                cut = len(data) - (len(data) % 2)
+                data, remainder = data[:cut], data[cut:]
+                events = await loop.run_in_executor(
+                    self._executor,
+                    session.process,
+                    data
+                )
+                await self._publish(stream_id, events, send)
+        finally:
+            # Always return the decoder to the pool, even when the
+            # server is shutting down and the executor is gone
+            try:
+                events = await loop.run_in_executor(
+                    self._executor,
+                    session.close
+                )
+            except (RuntimeError, asyncio.CancelledError):
+                events = session.close()
+            else:
+                await self._publish(stream_id, events, send)
+            self._logger.info("Stream '%s' closed", stream_id)
+
+    async def _publish(self, stream_id, events, send):
+        for event in events:
+            message = {
+                'stream': stream_id,
+                'keyword': event.keyword,
+                'start_frame': event.start_frame,
+                'end_frame': event.end_frame,
+                'score': event.score
+            }
+            if self.events.full():
+                self.events.get_nowait()
+            self.events.put_nowait(message)
+            if send is not None:
+                await send(message)
+
+    async def _handle_client(self, reader, writer):
+        async def send(message):
+            writer.write(json.dumps(message).encode('utf-8') + b'\n')
+            await writer.drain()
+
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            header = await reader.readline()
+            stream_id = header.decode('utf-8').strip()
+            if not stream_id:
+                return
+            await self._run_stream(stream_id, reader, send)
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            self._logger.warning('Stream connection lost: %s', e)
+        finally:
+            self._tasks.discard(task)
+            writer.close()
+
+    async def serve_unix(self, path):
+        """
+        Starts accepting streams on a unix socket.
+
+        Returns:
+            The asyncio.Server
+        """
+        if os.path.exists(path):
+            os.remove(path)
+        return await asyncio.start_unix_server(self._handle_client, path)
+
+    async def add_pipe(self, stream_id, path):
+        """
+        Starts decoding a stream read from a named pipe (or any file
+        that produces raw PCM). Detections only go to the events queue.
+        Decoding starts once a writer has opened the pipe.
+
+        Returns:
+            The asyncio.Task decoding the stream
+        """
+        task = asyncio.ensure_future(self._run_pipe(stream_id, path))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run_pipe(self, stream_id, path):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        # Opening a named pipe blocks until a writer opens it too
+        pipe = await loop.run_in_executor(
+            self._open_executor,
+            functools.partial(open, path, 'rb', buffering=0)
+        )
+        await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader),
+            pipe
+        )
+        await self._run_stream(stream_id, reader)
+
+    def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        self._executor.shutdown(wait=False)
+        self._open_executor.shutdown(wait=False)
+
+
+def run(plugin, socket_path, max_workers=None, max_streams=None):
+    """
+    Serves streams on socket_path until interrupted, logging detections.
+    """
+    logger = logging.getLogger(__name__)
+
+    async def main():
+        server = KWSServer(
+            plugin,
+            max_workers=max_workers,
+            max_streams=max_streams
+        )
+        unix_server = await server.serve_unix(socket_path)
+        try:
+            async with unix_server:
+                while True:
+                    event = await server.events.get()
+                    logger.info(
+                        "Stream '%s' detected '%s'",
+                        event['stream'],
+                        event['keyword']
+                    )
+        finally:
+            server.close()
+
+    asyncio.run(main())
@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
+import hashlib
+import json
 import logging
 import os
-import re
 import tempfile
-from .g2p import PhonetisaurusG2P
+import time
+from .g2p import PhonetisaurusG2P, PronunciationCache, get_training_job
+from . import fingerprint
+from . import lexicon
+from . import metrics
+from naomi import paths
 from naomi import profile
 
 
@@ -36,18 +42,67 @@ def get_thresholds_path(path):
     return os.path.join(path, 'kws.thresholds')
 
 
-def compile_vocabulary(directory, phrases):
+def get_manifest_path(path):
     """
-    Compiles the vocabulary to the Pocketsphinx format by creating a
-    languagemodel and a dictionary.
+    Returns:
+        The path of the file recording the inputs the vocabulary was
+        compiled from as string
+    """
+    return os.path.join(path, 'manifest.json')
 
-    Arguments:
-        phrases -- a list of phrases that this vocabulary will contain
+
+def get_lexicon_index_path(hmm_dir):
     """
-    logger = logging.getLogger(__name__)
-    languagemodel_path = get_languagemodel_path(directory)
-    dictionary_path = get_dictionary_path(directory)
+    Returns:
+        The path of the compiled lexicon index for the cmudict.dict in
+        hmm_dir as string. The index is kept in Naomi's own directory
+        since hmm_dir may not be writable.
+    """
+    key = hashlib.sha1(
+        os.path.abspath(hmm_dir).encode('utf-8')
+    ).hexdigest()[:16]
+    return paths.sub('pocketsphinx', 'lexicon', '{}.idx'.format(key))
+
+
+def get_g2p_cache_path():
+    """
+    Returns:
+        The path of the persistent G2P pronunciation cache as string
+    """
+    return paths.sub('pocketsphinx', 'g2p_cache.sqlite')
+
+
+def get_fst_cache_path():
+    """
+    Returns:
+        The directory of trained FST models, shared by all profiles and
+        languages, as string
+    """
+    return paths.sub('pocketsphinx', 'fst_cache')
+
 
+def open_lexicon_index(hmm_dir):
+    """
+    Opens the lexicon index for the cmudict.dict in hmm_dir, building
+    it if it is missing or older than cmudict.dict.
+
+    Returns:
+        A lexicon.LexiconIndex
+    """
+    return lexicon.open_index(
+        os.path.join(hmm_dir, 'cmudict.dict'),
+        get_lexicon_index_path(hmm_dir)
+    )
+
+
+def create_g2p_converter():
+    """
+    Creates the G2P converter for the profile's FST model, backed by the
+    persistent pronunciation cache. Close g2pconverter.cache when done.
+
+    Returns:
+        A PhonetisaurusG2P
+    """
     nbest = profile.get(
         ['pocketsphinx', 'nbest'],
         3
@@ -64,15 +119,160 @@ def compile_vocabulary(directory, phrases):
     if not fst_model:
         raise ValueError('FST model not specified!')
 
+    # The model may still be training in the background
+    job = get_training_job(fst_model)
+    if job is not None and not job.wait(0):
+        logging.getLogger(__name__).info(
+            'Waiting for FST model training to finish'
+        )
+        job.wait()
+
     if not os.path.exists(fst_model):
         raise OSError('FST model {} does not exist!'.format(fst_model))
 
-    g2pconverter = PhonetisaurusG2P(
+    g2p_cache = PronunciationCache(
+        get_g2p_cache_path(),
+        profile.get(['pocketsphinx', 'g2p_cache_size'], 10000)
+    )
+    return PhonetisaurusG2P(
         fst_model,
         fst_model_alphabet=fst_model_alphabet,
-        nbest=nbest
+        nbest=nbest,
+        cache=g2p_cache,
+        processes=profile.get(['pocketsphinx', 'g2p_processes'], 1)
+    )
+
+
+# Results of vocabulary_status()
+VOCABULARY_UP_TO_DATE = 'up-to-date'
+VOCABULARY_PARTIAL = 'partial'
+VOCABULARY_STALE = 'stale'
+MANIFEST_VERSION = 1
+
+
+def read_manifest(directory):
+    """
+    Returns:
+        The manifest of the vocabulary in directory as a dict, or None
+        if there is no usable manifest
+    """
+    try:
+        with open(get_manifest_path(directory), 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def _file_input(path, recorded):
+    # Hashing cmudict.dict on every start would cost more than it
+    # saves, so the recorded digest is reused while the file's size
+    # and modification time are unchanged
+    if not os.path.isfile(path):
+        return {'signature': None, 'sha1': None}
+    st = os.stat(path)
+    signature = [st.st_size, st.st_mtime_ns]
+    if recorded and recorded.get('signature') == signature:
+        return recorded
+    return {'signature': signature, 'sha1': fingerprint.file_digest(path)}
+
+
+def _vocabulary_inputs(previous):
+    hmm_dir = profile.get(['pocketsphinx', 'hmm_dir'])
+    recorded = (previous or {}).get('inputs', {}).get('files', {})
+    return {
+        'files': {
+            'cmudict': _file_input(
+                os.path.join(hmm_dir, 'cmudict.dict'),
+                recorded.get('cmudict')
+            ),
+            'fst_model': _file_input(
+                os.path.join(hmm_dir, 'g2p_model.fst'),
+                recorded.get('fst_model')
+            )
+        },
+        'nbest': profile.get(['pocketsphinx', 'nbest'], 3),
+        'fst_model_alphabet': profile.get(
+            ['pocketsphinx', 'fst_model_alphabet'],
+            'arpabet'
+        )
+    }
+
+
+def _inputs_match(previous, inputs):
+    if previous is None:
+        return False
+    recorded = previous.get('inputs', {})
+    for name, current in inputs['files'].items():
+        if recorded.get('files', {}).get(name, {}).get('sha1') != current['sha1']:
+            return False
+    return (
+        recorded.get('nbest') == inputs['nbest']
+        and recorded.get('fst_model_alphabet') == inputs['fst_model_alphabet']
+    )
+
+
+def _vocabulary_words(phrases):
+    words = set()
+    for phrase in phrases:
+        for word in phrase.split():
+            words.add(word.lower())
+    return words
+
+
+def _status(directory, previous, inputs, words):
+    if not os.path.isfile(get_dictionary_path(directory)):
+        return VOCABULARY_STALE
+    if not _inputs_match(previous, inputs):
+        return VOCABULARY_STALE
+    if set(previous.get('words', [])) == words:
+        return VOCABULARY_UP_TO_DATE
+    return VOCABULARY_PARTIAL
+
+
+def vocabulary_status(directory, phrases):
+    """
+    Decides whether the vocabulary in directory has to be compiled.
+
+    Returns:
+        VOCABULARY_UP_TO_DATE if nothing changed since the last compile,
+        VOCABULARY_PARTIAL if only the phrases changed (only the new
+        words will be looked up) or VOCABULARY_STALE if the dictionary,
+        G2P model or G2P settings changed and everything is recompiled
+    """
+    previous = read_manifest(directory)
+    return _status(
+        directory,
+        previous,
+        _vocabulary_inputs(previous),
+        _vocabulary_words(phrases)
     )
 
+
+def compile_vocabulary(directory, phrases):
+    """
+    Compiles the vocabulary to the Pocketsphinx format by creating a
+    languagemodel and a dictionary.
+
+    A manifest of the inputs (cmudict.dict, the G2P model and settings,
+    and the vocabulary words) is kept next to the dictionary. When none
+    of them changed, nothing is done. When only the phrases changed,
+    entries for unchanged words are kept and only new words are looked
+    up.
+
+    Arguments:
+        phrases -- a list of phrases that this vocabulary will contain
+
+    Returns:
+        The vocabulary_status() decision that was acted on
+    """
+    logger = logging.getLogger(__name__)
+    start = time.perf_counter()
+    languagemodel_path = get_languagemodel_path(directory)
+    dictionary_path = get_dictionary_path(directory)
+
     logger.debug('Languagemodel path: %s' % languagemodel_path)
     logger.debug('Dictionary path:    %s' % dictionary_path)
     text = " ".join(
@@ -84,8 +284,55 @@ def compile_vocabulary(directory, phrases):
     text += ' '
     logger.debug('Compiling languagemodel...')
     vocabulary = compile_lexicon(text)
+    words = _vocabulary_words(vocabulary)
+
+    previous = read_manifest(directory)
+    inputs = _vocabulary_inputs(previous)
+    status = _status(directory, previous, inputs, words)
+    logger.info('Vocabulary in {} is {}'.format(directory, status))
+    if status == VOCABULARY_UP_TO_DATE:
+        metrics.registry.observe(
+            'compile_vocabulary_seconds',
+            time.perf_counter() - start,
+            status=status
+        )
+        return status
+
+    corpus_lexicon = {}
+    if status == VOCABULARY_PARTIAL:
+        existing = lexicon.read_dictionary(dictionary_path)
+        corpus_lexicon = {
+            word: existing[word] for word in words if word in existing
+        }
+    missing = words - set(corpus_lexicon)
     logger.debug('Starting dictionary...')
-    compile_dictionary(g2pconverter, vocabulary, dictionary_path)
+    if missing:
+        g2pconverter = create_g2p_converter()
+        try:
+            corpus_lexicon.update(
+                lookup_pronunciations(g2pconverter, missing)
+            )
+        finally:
+            logger.debug('G2P cache: %s' % g2pconverter.cache.stats())
+            g2pconverter.cache.close()
+    write_dictionary(dictionary_path, corpus_lexicon)
+
+    with open(get_manifest_path(directory), 'w') as f:
+        json.dump(
+            {
+                'version': MANIFEST_VERSION,
+                'inputs': inputs,
+                'words': sorted(words)
+            },
+            f,
+            indent=2
+        )
+    metrics.registry.observe(
+        'compile_vocabulary_seconds',
+        time.perf_counter() - start,
+        status=status
+    )
+    return status
 
 
 def compile_lexicon(text):
@@ -128,45 +375,120 @@ def compile_dictionary(g2pconverter, corpus, output_file):
         output_file -- the path of the file this dictionary will
                        be written to
     """
-    # read the standard dictionary in
-    RE_WORDS = re.compile(
-        r"^(?P<word>[a-zA-Z0-9'\.\-]+)(\(\d\))?\s+(?P<pronunciation>[a-zA-Z]+.*[a-zA-Z0-9])\s*$"
-    )
-    lexicon = {}
-    with open(os.path.join(profile.get(['pocketsphinx', 'hmm_dir']), 'cmudict.dict'), 'r') as f:
-        line = f.readline().strip()
-        while line:
-            for match in RE_WORDS.finditer(line):
-                try:
-                    lexicon[match.group('word')].append(
-                        match.group('pronunciation').split()
-                    )
-                except KeyError:
-                    lexicon[match.group('word')] = [
-                        match.group('pronunciation').split()
-                    ]
-            line = f.readline().strip()
-
     # create a list of words from the corpus
-    corpus_lexicon = {}
     words = set()
     for line in corpus:
         for word in line.split():
             words.add(word.lower())
 
+    corpus_lexicon = lookup_pronunciations(g2pconverter, words)
+    write_dictionary(output_file, corpus_lexicon)
+
+
+def write_dictionary(output_file, corpus_lexicon):
+    """
+    Writes a pocketsphinx dictionary file.
+
+    Arguments:
+        output_file -- the path of the file to write
+        corpus_lexicon -- a dict mapping words to lists of pronunciations
+    """
+    with open(output_file, "w") as f:
+        for word in sorted(corpus_lexicon):
+            f.write(format_dictionary_entry(word, corpus_lexicon[word]))
+
+
+def lookup_pronunciations(g2pconverter, words):
+    """
+    Finds the pronunciations of a set of lower case words, first in
+    cmudict.dict and then with the G2P converter for any words that are
+    not in the dictionary.
+
+    Returns:
+        A dict mapping each word to a list of pronunciations, each a
+        list of phones
+    """
+    corpus_lexicon = {}
     # Fetch pronunciations for every word in corpus
-    for word in words:
-        if word in lexicon:
-            corpus_lexicon[word] = lexicon[word]
+    oov_words = []
+    hmm_dir = profile.get(['pocketsphinx', 'hmm_dir'])
+    dict_file = os.path.join(hmm_dir, 'cmudict.dict')
+    index_file = get_lexicon_index_path(hmm_dir)
+    if lexicon.is_index_fresh(dict_file, index_file):
+        with lexicon.LexiconIndex(index_file) as lexicon_index:
+            found = {
+                word: lexicon_index.get(word) for word in words
+                if word in lexicon_index
+            }
+    else:
+        # Building the index means reading the whole dictionary, so
+        # pick out the few words needed now and leave the index to a
+        # background thread
+        found = lexicon.extract_subset(dict_file, words)
+        lexicon.build_index_in_background(dict_file, index_file)
+    for word in sorted(words):
+        pronunciations = found.get(word)
+        if pronunciations is not None:
+            corpus_lexicon[word] = pronunciations
         else:
+            oov_words.append(word)
+    # Send all the out of vocabulary words to the G2P converter at once
+    if oov_words:
+        for word in oov_words:
             corpus_lexicon[word] = []
-            for w, p in g2pconverter.translate([word]):
-                print(f"{w} - {p}")
-                corpus_lexicon[word].append(p)
-    with open(output_file, "w") as f:
-        for word in sorted(corpus_lexicon):
-            for index, phones in enumerate(corpus_lexicon[word]):
-                if index == 0:
-                    f.write(f"{word} {' '.join(phones)}\n")
-                else:
-                    f.write(f"{word}({index+1}) {' '.join(phones)}\n")
+        for w, p in g2pconverter.translate(oov_words):
+            print(f"{w} - {p}")
+            corpus_lexicon.setdefault(w, []).append(p)
+    return corpus_lexicon
+
+
+def format_dictionary_entry(word, pronunciations):
+    """
+    Returns:
+        The dictionary file lines for a word, with alternate
+        pronunciations numbered "word(2)", "word(3)" and so on
+    """
+    lines = []
+    for index, phones in enumerate(pronunciations):
+        if index == 0:
+            lines.append(f"{word} {' '.join(phones)}\n")
+        else:
+            lines.append(f"{word}({index+1}) {' '.join(phones)}\n")
+    return "".join(lines)
+
+
+def format_threshold(keyword, threshold):
+    """
+    Returns:
+        The kws.thresholds line for a keyword
+    """
+    if(threshold < 0):
+        return "{}\t/1e{}/\n".format(keyword, threshold)
+    return "{}\t/1e+{}/\n".format(keyword, threshold)
+
+
+def write_thresholds(thresholds_path, thresholds):
+    """
+    Writes the keyword thresholds file. The file is left alone if it
+    already has the same contents.
+
+    Arguments:
+        thresholds_path -- the path of the kws.thresholds file
+        thresholds -- a list of (keyword, threshold) pairs
+
+    Returns:
+        True if the file was written
+    """
+    contents = "".join(
+        format_threshold(keyword, threshold)
+        for keyword, threshold in thresholds
+    )
+    try:
+        with open(thresholds_path, 'r') as f:
+            if f.read() == contents:
+                return False
+    except OSError:
+        pass
+    with open(thresholds_path, 'w') as f:
+        f.write(contents)
+    return True
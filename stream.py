@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+import logging
+from collections import namedtuple
+
+
+# A single keyword detection. start_frame and end_frame are counted from
+# the moment the stream was opened (not from the start of the current
+# utterance), so they keep increasing across spotter resets. score is the
+# detection score reported by the keyword spotter in seg().prob.
+KeywordEvent = namedtuple(
+    'KeywordEvent',
+    ['keyword', 'start_frame', 'end_frame', 'score']
+)
+
+# A keyword detection from a ContinuousListener. Frames and times (in
+# seconds) are counted from the moment listening started.
+ListenEvent = namedtuple(
+    'ListenEvent',
+    ['keyword', 'start_frame', 'end_frame', 'score', 'start_time', 'end_time']
+)
+
+
+class KeywordStream(object):
+    """
+    A streaming keyword spotting session.
+
+    Audio is pushed in arbitrarily sized chunks of 16 bit mono PCM with
+    process(). The decoder keeps its partial state between chunks, so a
+    keyword is reported as soon as the spotter fires instead of at the
+    end of a recording. After each detection the utterance is restarted
+    so the same keyword is not reported twice. When the keywords change
+    while the stream is open, the utterance is restarted before the next
+    chunk so the decoder picks up the new keyword search.
+
+    Usage:
+        with plugin.start_stream() as stream:
+            for chunk in microphone:
+                for event in stream.process(chunk):
+                    print(event.keyword)
+    """
+
+    def __init__(
+        self,
+        decoder,
+        keywords,
+        on_close=None,
+        on_restart=None,
+        is_current=None
+    ):
+        """
+        Arguments:
+            decoder -- a pocketsphinx.Decoder configured for keyword search
+            keywords -- the keywords that may be reported. The owner may
+                        update a set in place to change them.
+            on_close -- optional callable receiving the decoder once the
+                        session is closed
+            on_restart -- optional callable receiving the decoder between
+                          utterances, used to apply keyword changes
+            is_current -- optional callable receiving the decoder and
+                          returning False when on_restart has changes to
+                          apply, checked before every chunk
+        """
+        self._logger = logging.getLogger(__name__)
+        self._decoder = decoder
+        self._keywords = keywords
+        self._on_close = on_close
+        self._on_restart = on_restart
+        self._is_current = is_current
+        config = decoder.config
+        self._samprate = int(config['samprate'])
+        self._frate = int(config['frate'])
+        # Frame at which the current utterance started
+        self._utt_start_frame = 0
+        # Number of samples pushed into the current utterance
+        self._utt_samples = 0
+        self._closed = False
+        self._decoder.start_utt()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def frame_rate(self):
+        """
+        Returns:
+            The number of decoder frames per second of audio
+        """
+        return self._frate
+
+    @property
+    def sample_rate(self):
+        """
+        Returns:
+            The number of audio samples per second the decoder expects
+        """
+        return self._samprate
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def _collect(self):
+        events = []
+        for s in self._decoder.seg():
+            # The keyword comes back from the spotter with trailing
+            # whitespace, so strip it before comparing
+            word = s.word.strip()
+            if word in self._keywords:
+                events.append(
+                    KeywordEvent(
+                        word,
+                        self._utt_start_frame + s.start_frame,
+                        self._utt_start_frame + s.end_frame,
+                        s.prob
+                    )
+                )
+        return events
+
+    def _is_stale(self):
+        return (
+            self._is_current is not None
+            and not self._is_current(self._decoder)
+        )
+
+    def _restart(self):
+        self._decoder.end_utt()
+        events = self._collect()
+        self._utt_start_frame += (
+            self._utt_samples * self._frate // self._samprate
+        )
+        self._utt_samples = 0
+        if self._on_restart is not None:
+            self._on_restart(self._decoder)
+        self._decoder.start_utt()
+        return events
+
+    def process(self, chunk):
+        """
+        Feeds a chunk of audio to the decoder.
+
+        Arguments:
+            chunk -- bytes-like object containing 16 bit mono PCM
+
+        Returns:
+            A list of KeywordEvent objects for keywords detected in
+            this chunk (usually empty)
+        """
+        if self._closed:
+            raise ValueError('process() called on a closed stream')
+        events = []
+        if self._is_stale():
+            # Keywords changed since the utterance started
+            events = self._restart()
+        self._decoder.process_raw(chunk, False, False)
+        self._utt_samples += len(chunk) // 2
+        if self._decoder.hyp() is not None:
+            events.extend(self._restart())
+        for event in events:
+            self._logger.debug(
+                "Detected keyword '%s' at frame %d",
+                event.keyword,
+                event.start_frame
+            )
+        return events
+
+    def close(self):
+        """
+        Ends the session and returns any keywords that were detected in
+        the audio still buffered in the decoder.
+        """
+        if self._closed:
+            return []
+        self._closed = True
+        try:
+            self._decoder.end_utt()
+            events = self._collect()
+        finally:
+            if self._on_close is not None:
+                self._on_close(self._decoder)
+        return events
+
+
+class RingBuffer(object):
+    """
+    A fixed size buffer keeping the most recent bytes written to it.
+    """
+
+    def __init__(self, capacity):
+        self._buffer = bytearray(capacity)
+        self._capacity = capacity
+        self._end = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def write(self, data):
+        data = memoryview(data).cast('B')
+        if len(data) >= self._capacity:
+            self._buffer[:] = data[len(data) - self._capacity:]
+            self._end = 0
+            self._size = self._capacity
+            return
+        first = min(len(data), self._capacity - self._end)
+        self._buffer[self._end:self._end + first] = data[:first]
+        self._buffer[:len(data) - first] = data[first:]
+        self._end = (self._end + len(data)) % self._capacity
+        self._size = min(self._capacity, self._size + len(data))
+
+    def last(self, count):
+        """
+        Returns:
+            The last count bytes written (fewer if fewer were written)
+        """
+        count = min(count, self._size)
+        start = (self._end - count) % self._capacity
+        if start + count <= self._capacity:
+            return bytes(self._buffer[start:start + count])
+        return bytes(
+            self._buffer[start:] + self._buffer[:self._end]
+        )
+
+
+class ContinuousListener(object):
+    """
+    Continuous keyword spotting over an endless stream of audio.
+
+    All audio goes into one long utterance, and keywords are reported as
+    soon as the spotter fires without restarting it, so a keyword is
+    never cut in two by a clip boundary. To keep the decoder's memory
+    bounded, the utterance is restarted every reset_interval seconds.
+    The last overlap seconds of audio, kept in a ring buffer, are fed to
+    the new utterance, so a keyword spoken across the restart is still
+    heard; a keyword heard in both utterances is only reported once.
+    Apart from that overlap, every sample is decoded once. When the
+    keywords change, the utterance is restarted the same way before the
+    next chunk.
+
+    Usage:
+        with plugin.start_listening() as listener:
+            for chunk in microphone:
+                for event in listener.process(chunk):
+                    print(event.keyword, event.start_time)
+    """
+
+    def __init__(
+        self,
+        decoder,
+        keywords,
+        reset_interval=30.0,
+        overlap=1.5,
+        on_close=None,
+        on_restart=None,
+        is_current=None
+    ):
+        """
+        Arguments:
+            decoder -- a pocketsphinx.Decoder configured for keyword search
+            keywords -- the keywords that may be reported
+            reset_interval -- seconds of audio after which the utterance
+                              is restarted
+            overlap -- seconds of audio fed again to the new utterance,
+                       should be longer than the longest keyword. Less
+                       than one frame turns the overlap off.
+            on_close -- optional callable receiving the decoder once
+                        listening stops
+            on_restart -- optional callable receiving the decoder between
+                          utterances, used to apply keyword changes
+            is_current -- optional callable receiving the decoder and
+                          returning False when on_restart has changes to
+                          apply, checked before every chunk
+        """
+        if overlap >= reset_interval:
+            raise ValueError('overlap must be shorter than reset_interval')
+        if overlap < 0:
+            raise ValueError('overlap must not be negative')
+        self._logger = logging.getLogger(__name__)
+        self._decoder = decoder
+        self._keywords = keywords
+        self._on_close = on_close
+        self._on_restart = on_restart
+        self._is_current = is_current
+        config = decoder.config
+        self._samprate = int(config['samprate'])
+        self._frate = int(config['frate'])
+        self._reset_samples = int(reset_interval * self._samprate)
+        # Whole frames only, so the overlap starts on a frame boundary
+        overlap_frames = int(overlap * self._frate)
+        self._overlap_samples = overlap_frames * self._samprate // self._frate
+        # An overlap shorter than one frame means no overlap at all
+        self._ring = None
+        if self._overlap_samples:
+            self._ring = RingBuffer(self._overlap_samples * 2)
+        # Samples pushed since listening started
+        self._total_samples = 0
+        # Sample at which the current utterance started
+        self._utt_start_sample = 0
+        # Detections already reported, as (keyword, start, end) frames,
+        # kept until they are older than the overlap
+        self._reported = []
+        self._closed = False
+        self._decoder.start_utt()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def frame_rate(self):
+        return self._frate
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def _frame(self, sample):
+        return sample * self._frate // self._samprate
+
+    def _is_reported(self, keyword, start_frame, end_frame):
+        for reported in self._reported:
+            if (
+                reported[0] == keyword
+                and start_frame <= reported[2]
+                and end_frame >= reported[1]
+            ):
+                return True
+        return False
+
+    def _collect(self):
+        utt_start = self._frame(self._utt_start_sample)
+        events = []
+        for s in self._decoder.seg():
+            word = s.word.strip()
+            if word not in self._keywords:
+                continue
+            start_frame = utt_start + s.start_frame
+            end_frame = utt_start + s.end_frame
+            if self._is_reported(word, start_frame, end_frame):
+                continue
+            self._reported.append((word, start_frame, end_frame))
+            events.append(
+                ListenEvent(
+                    word,
+                    start_frame,
+                    end_frame,
+                    s.prob,
+                    start_frame / self._frate,
+                    end_frame / self._frate
+                )
+            )
+        return events
+
+    def _is_stale(self):
+        return (
+            self._is_current is not None
+            and not self._is_current(self._decoder)
+        )
+
+    def _reset(self):
+        self._decoder.end_utt()
+        events = self._collect()
+        if self._on_restart is not None:
+            self._on_restart(self._decoder)
+        overlap = b''
+        if self._ring is not None:
+            overlap = self._ring.last(self._overlap_samples * 2)
+        self._utt_start_sample = self._total_samples - len(overlap) // 2
+        # Older detections can no longer be seen again
+        oldest = self._frame(self._utt_start_sample)
+        self._reported = [r for r in self._reported if r[2] >= oldest]
+        self._decoder.start_utt()
+        if overlap:
+            self._decoder.process_raw(overlap, False, False)
+        return events
+
+    def process(self, chunk):
+        """
+        Feeds a chunk of audio to the decoder.
+
+        Arguments:
+            chunk -- bytes-like object containing 16 bit mono PCM
+
+        Returns:
+            A list of ListenEvent objects for keywords detected so far
+            that had not been reported yet (usually empty)
+        """
+        if self._closed:
+            raise ValueError('process() called on a closed listener')
+        events = []
+        if self._is_stale():
+            # Keywords changed, the overlap is decoded again with the
+            # new keyword search
+            events = self._reset()
+        self._decoder.process_raw(chunk, False, False)
+        if self._ring is not None:
+            self._ring.write(chunk)
+        self._total_samples += len(chunk) // 2
+        if self._decoder.hyp() is not None:
+            events.extend(self._collect())
+        if self._total_samples - self._utt_start_sample >= self._reset_samples:
+            events.extend(self._reset())
+        for event in events:
+            self._logger.debug(
+                "Detected keyword '%s' at %.2fs",
+                event.keyword,
+                event.start_time
+            )
+        return events
+
+    def close(self):
+        """
+        Stops listening and returns any keywords that were detected in
+        the audio still buffered in the decoder.
+        """
+        if self._closed:
+            return []
+        self._closed = True
+        try:
+            self._decoder.end_utt()
+            events = self._collect()
+        finally:
+            if self._on_close is not None:
+                self._on_close(self._decoder)
+        return events
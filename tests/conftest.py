@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""
+The plugin package's __init__.py imports Naomi, which is only available
+when the plugin runs inside Naomi. The modules under test do not need
+it, so the package is registered as pocketsphinx_kws without running
+__init__.py and the tests import its modules from there.
+"""
+import os
+import sys
+import types
+
+PACKAGE = 'pocketsphinx_kws'
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if PACKAGE not in sys.modules:
+    package = types.ModuleType(PACKAGE)
+    package.__path__ = [ROOT]
+    sys.modules[PACKAGE] = package
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import struct
+import tempfile
+import unittest
+import numpy as np
+from pocketsphinx_kws import audio
+
+
+def chunk(chunk_id, data):
+    # Chunks are padded to an even number of bytes
+    return audio.CHUNK_HEADER.pack(chunk_id, len(data)) + data + (
+        b'\0' * (len(data) & 1)
+    )
+
+
+def fmt_chunk(format_tag=audio.WAVE_FORMAT_PCM, channels=1,
+              samplerate=16000, bits=16):
+    block_align = channels * bits // 8
+    return chunk(b'fmt ', audio.FMT_CHUNK.pack(
+        format_tag,
+        channels,
+        samplerate,
+        samplerate * block_align,
+        block_align,
+        bits
+    ))
+
+
+def wav(*chunks):
+    body = b'WAVE' + b''.join(chunks)
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+
+def pcm16(samples, channels=1, samplerate=16000):
+    data = np.asarray(samples, dtype='<i2').tobytes()
+    return wav(
+        fmt_chunk(channels=channels, samplerate=samplerate),
+        chunk(b'data', data)
+    )
+
+
+class ParseWavTest(unittest.TestCase):
+
+    def test_data_is_viewed_in_place(self):
+        buffer = pcm16([1, 2, 3])
+        fmt, data = audio.parse_wav(buffer)
+        self.assertEqual(fmt.format_tag, audio.WAVE_FORMAT_PCM)
+        self.assertEqual(fmt.channels, 1)
+        self.assertEqual(fmt.samplerate, 16000)
+        self.assertEqual(fmt.bits_per_sample, 16)
+        self.assertIsInstance(data, memoryview)
+        self.assertEqual(data.obj, buffer)
+        self.assertEqual(bytes(data), struct.pack('<3h', 1, 2, 3))
+
+    def test_other_chunks_are_skipped(self):
+        # An odd sized chunk before fmt and one between fmt and data
+        buffer = wav(
+            chunk(b'junk', b'abc'),
+            fmt_chunk(),
+            chunk(b'LIST', b'INFOISFT\x05\0\0\0naomi'),
+            chunk(b'data', struct.pack('<2h', 7, -7))
+        )
+        fmt, data = audio.parse_wav(buffer)
+        self.assertEqual(fmt.samplerate, 16000)
+        self.assertEqual(bytes(data), struct.pack('<2h', 7, -7))
+
+    def test_extensible_format(self):
+        extensible = audio.FMT_CHUNK.pack(
+            audio.WAVE_FORMAT_EXTENSIBLE, 1, 16000, 64000, 4, 32
+        ) + struct.pack(
+            '<HHIH14s', 22, 32, 0, audio.WAVE_FORMAT_IEEE_FLOAT, b''
+        )
+        fmt, _ = audio.parse_wav(
+            wav(chunk(b'fmt ', extensible), chunk(b'data', bytes(4)))
+        )
+        self.assertEqual(fmt.format_tag, audio.WAVE_FORMAT_IEEE_FLOAT)
+
+    def test_streamed_data_size_runs_to_the_end(self):
+        samples = struct.pack('<2h', 1, 2)
+        for size in (0, 0xFFFFFFFF):
+            buffer = wav(fmt_chunk()) + (
+                audio.CHUNK_HEADER.pack(b'data', size) + samples
+            )
+            _, data = audio.parse_wav(buffer)
+            self.assertEqual(bytes(data), samples)
+
+    def test_invalid_files(self):
+        for buffer in (
+            b'RIFF',
+            b'RIFF\0\0\0\0AVI ',
+            wav(fmt_chunk()),
+            wav(chunk(b'data', bytes(4)), fmt_chunk())
+        ):
+            with self.assertRaises(ValueError):
+                audio.parse_wav(buffer)
+
+
+class LoadAudioTest(unittest.TestCase):
+
+    def test_canonical_wav_is_not_copied(self):
+        buffer = bytearray(pcm16([1, -2, 3]))
+        samples = audio.load_audio(buffer)
+        self.assertEqual(samples.dtype, np.int16)
+        self.assertEqual(samples.tolist(), [1, -2, 3])
+        self.assertFalse(samples.flags['OWNDATA'])
+
+    def test_stereo_is_downmixed(self):
+        samples = audio.load_audio(pcm16([100, 300, -100, -300], channels=2))
+        self.assertEqual(samples.tolist(), [200, -200])
+
+    def test_integer_ratio_is_averaged(self):
+        samples = audio.load_audio(
+            pcm16([0, 3, 6, 30, 30, 30, 9], samplerate=48000)
+        )
+        # The last sample does not fill a group of three and is dropped
+        self.assertEqual(samples.tolist(), [3, 30])
+
+    def test_other_ratios_are_interpolated(self):
+        samples = audio.load_audio(
+            pcm16(np.arange(0, 800, 100), samplerate=8000)
+        )
+        self.assertEqual(len(samples), 16)
+        self.assertEqual(samples[:5].tolist(), [0, 50, 100, 150, 200])
+
+    def test_sample_formats(self):
+        expected = [0, 16384, -16384]
+        cases = [
+            (audio.WAVE_FORMAT_PCM, 8, np.array([128, 192, 64], np.uint8)),
+            (
+                audio.WAVE_FORMAT_PCM,
+                24,
+                np.frombuffer(
+                    b''.join(
+                        struct.pack('<i', value * 256)[:3]
+                        for value in expected
+                    ),
+                    np.uint8
+                )
+            ),
+            (
+                audio.WAVE_FORMAT_PCM,
+                32,
+                np.array(expected, '<i4') * 65536
+            ),
+            (
+                audio.WAVE_FORMAT_IEEE_FLOAT,
+                32,
+                np.array(expected, '<f4') / 32767
+            ),
+            (
+                audio.WAVE_FORMAT_IEEE_FLOAT,
+                64,
+                np.array(expected, '<f8') / 32767
+            )
+        ]
+        for format_tag, bits, data in cases:
+            buffer = wav(
+                fmt_chunk(format_tag=format_tag, bits=bits),
+                chunk(b'data', data.tobytes())
+            )
+            samples = audio.load_audio(buffer)
+            self.assertEqual(samples.dtype, np.int16)
+            self.assertEqual(samples.tolist(), expected, (format_tag, bits))
+
+    def test_unsupported_format(self):
+        buffer = wav(fmt_chunk(format_tag=0x0055), chunk(b'data', bytes(4)))
+        with self.assertRaises(ValueError):
+            audio.load_audio(buffer)
+
+    def test_headerless_pcm(self):
+        samples = audio.load_audio(struct.pack('<3h', 1, 2, 3) + b'\0')
+        self.assertEqual(samples.tolist(), [1, 2, 3])
+
+    def test_arrays(self):
+        self.assertEqual(
+            audio.load_audio(np.array([0.5, -0.5, 2.0])).tolist(),
+            [16384, -16384, 32767]
+        )
+        stereo = np.array([[10, 20], [30, 40]], np.int16)
+        self.assertEqual(audio.load_audio(stereo).tolist(), [15, 35])
+        swapped = np.array([1, 2], '>i2')
+        samples = audio.load_audio(swapped)
+        self.assertEqual(samples.dtype, np.int16)
+        self.assertEqual(samples.tolist(), [1, 2])
+
+    def test_paths_and_file_objects(self):
+        buffer = pcm16([5, 6, 7])
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'clip.wav')
+        with open(path, 'wb') as f:
+            f.write(buffer)
+        self.assertEqual(audio.load_audio(path).tolist(), [5, 6, 7])
+        with open(path, 'rb') as f:
+            self.assertEqual(audio.load_audio(f).tolist(), [5, 6, 7])
+        self.assertEqual(
+            audio.load_audio(io.BytesIO(buffer)).tolist(),
+            [5, 6, 7]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import itertools
+import os
+import tempfile
+import unittest
+from unittest import mock
+from pocketsphinx_kws import g2p
+
+HELLO = [['HH', 'AH0', 'L', 'OW1']]
+
+
+class PronunciationCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache_file = os.path.join(directory.name, 'cache', 'g2p.db')
+        # Every read or write happens at a later time than the last one
+        clock = itertools.count(1000)
+        patch = mock.patch.object(
+            g2p.time,
+            'time',
+            side_effect=lambda: next(clock)
+        )
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def open(self, max_entries=3):
+        cache = g2p.PronunciationCache(self.cache_file, max_entries)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_get_and_put(self):
+        cache = self.open()
+        self.assertIsNone(cache.get('hello'))
+        cache.put('hello', HELLO)
+        self.assertEqual(cache.get('hello'), HELLO)
+        cache.put('hello', [['HH', 'EH0', 'L', 'OW1']])
+        self.assertEqual(cache.get('hello'), [['HH', 'EH0', 'L', 'OW1']])
+        self.assertEqual(
+            cache.stats(),
+            {'hits': 2, 'misses': 1, 'entries': 1}
+        )
+
+    def test_least_recently_used_is_evicted(self):
+        cache = self.open()
+        for word in ('one', 'two', 'three'):
+            cache.put(word, [[word.upper()]])
+        # Reading 'one' makes 'two' the least recently used entry
+        self.assertIsNotNone(cache.get('one'))
+        cache.put('four', [['FOUR']])
+        self.assertEqual(len(cache), 3)
+        self.assertIsNone(cache.get('two'))
+        for word in ('one', 'three', 'four'):
+            self.assertEqual(cache.get(word), [[word.upper()]])
+
+    def test_replacing_an_entry_does_not_evict(self):
+        cache = self.open(max_entries=2)
+        cache.put('one', [['ONE']])
+        cache.put('two', [['TWO']])
+        cache.put('one', [['W', 'AH1', 'N']])
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('two'), [['TWO']])
+
+    def test_entries_survive_reopening(self):
+        cache = self.open()
+        cache.put('hello', HELLO)
+        cache.close()
+        cache = self.open()
+        self.assertEqual(cache.get('hello'), HELLO)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import unittest
+from pocketsphinx_kws import lexicon
+
+DICTIONARY = '\n'.join([
+    ";;; a comment",
+    "abbey AE1 B IY0",
+    "hello HH AH0 L OW1",
+    "hello(2) HH EH0 L OW1",
+    "",
+    "naomi N AY0 OW1 M IY0",
+    "o'neil OW0 N IY1 L",
+    "zebra Z IY1 B R AH0",
+    ""
+])
+
+
+class LexiconTestCase(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.dict_file = os.path.join(self.directory, 'cmudict.dict')
+        self.write(DICTIONARY)
+
+    def write(self, contents):
+        with open(self.dict_file, 'w') as f:
+            f.write(contents)
+
+
+class ReadDictionaryTest(LexiconTestCase):
+
+    def test_alternates_are_kept_in_order(self):
+        words = lexicon.read_dictionary(self.dict_file)
+        self.assertEqual(
+            sorted(words),
+            ['abbey', 'hello', 'naomi', "o'neil", 'zebra']
+        )
+        self.assertEqual(
+            words['hello'],
+            [['HH', 'AH0', 'L', 'OW1'], ['HH', 'EH0', 'L', 'OW1']]
+        )
+
+    def test_extract_subset_matches_full_read(self):
+        words = lexicon.read_dictionary(self.dict_file)
+        subset = lexicon.extract_subset(
+            self.dict_file,
+            ['hello', 'zebra', 'missing']
+        )
+        self.assertEqual(
+            subset,
+            {'hello': words['hello'], 'zebra': words['zebra']}
+        )
+
+    def test_compact_lexicon_matches_full_read(self):
+        words = lexicon.read_dictionary(self.dict_file)
+        compact = lexicon.CompactLexicon.from_file(self.dict_file)
+        self.assertEqual(dict(compact.items()), words)
+        self.assertEqual(compact.get('naomi'), words['naomi'])
+        self.assertIsNone(compact.get('missing'))
+
+
+class LexiconIndexTest(LexiconTestCase):
+
+    def open(self):
+        index = lexicon.open_index(self.dict_file)
+        self.addCleanup(index.close)
+        return index
+
+    def test_lookups(self):
+        index = self.open()
+        words = lexicon.read_dictionary(self.dict_file)
+        self.assertEqual(len(index), len(words))
+        for word, pronunciations in words.items():
+            self.assertIn(word, index)
+            self.assertEqual(index[word], pronunciations)
+        self.assertEqual(list(index.items()), sorted(words.items()))
+
+    def test_missing_words(self):
+        index = self.open()
+        # Before the first, between two and after the last word
+        for word in ('aardvark', 'hellos', 'hell', 'zzz', ''):
+            self.assertNotIn(word, index)
+            self.assertIsNone(index.get(word))
+            self.assertEqual(index.get(word, []), [])
+        with self.assertRaises(KeyError):
+            index['missing']
+
+    def test_single_word_and_empty_dictionary(self):
+        self.write('naomi N AY0 OW1 M IY0\n')
+        index = self.open()
+        self.assertEqual(index['naomi'], [['N', 'AY0', 'OW1', 'M', 'IY0']])
+        self.assertNotIn('abbey', index)
+        self.assertNotIn('zebra', index)
+        index.close()
+        self.write('')
+        os.utime(self.dict_file, ns=(0, 0))
+        index = self.open()
+        self.assertEqual(len(index), 0)
+        self.assertNotIn('naomi', index)
+
+    def test_index_is_rebuilt_when_stale(self):
+        self.open().close()
+        self.assertTrue(lexicon.is_index_fresh(self.dict_file))
+        self.write(DICTIONARY + 'kiwi K IY1 W IY0\n')
+        os.utime(self.dict_file, ns=(0, 0))
+        self.assertFalse(lexicon.is_index_fresh(self.dict_file))
+        index = self.open()
+        self.assertEqual(index['kiwi'], [['K', 'IY1', 'W', 'IY0']])
+        self.assertTrue(lexicon.is_index_fresh(self.dict_file))
+
+    def test_corrupt_index_is_rebuilt(self):
+        index_file = lexicon.default_index_path(self.dict_file)
+        with open(index_file, 'wb') as f:
+            f.write(b'not an index at all' * 4)
+        self.assertFalse(lexicon.is_index_fresh(self.dict_file))
+        with self.assertRaises(ValueError):
+            lexicon.LexiconIndex(index_file)
+        self.assertIn('naomi', self.open())
+
+    def test_missing_index_is_not_fresh(self):
+        self.assertFalse(lexicon.is_index_fresh(self.dict_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import unittest
+from pocketsphinx_kws import metrics
+
+
+class RecordingSink(metrics.MetricsSink):
+
+    def __init__(self):
+        self.records = []
+
+    def record(self, kind, name, value, labels):
+        self.records.append((kind, name, value, labels))
+
+
+class BrokenSink(metrics.MetricsSink):
+
+    def record(self, kind, name, value, labels):
+        raise OSError('sink is gone')
+
+    def export(self, snapshot):
+        raise OSError('sink is gone')
+
+
+class SinkErrorTest(unittest.TestCase):
+
+    def test_failing_sink_does_not_break_recording(self):
+        registry = metrics.Metrics(export_interval=0)
+        recording = RecordingSink()
+        registry.add_sink(BrokenSink())
+        registry.add_sink(recording)
+        with self.assertLogs(metrics.__name__, 'WARNING') as logs:
+            registry.inc('transcriptions_total', engine='kws')
+            registry.observe('transcription_seconds', 0.25)
+        self.assertTrue(
+            any('transcriptions_total' in line for line in logs.output)
+        )
+        self.assertEqual(
+            recording.records,
+            [
+                (
+                    metrics.COUNTER,
+                    'transcriptions_total',
+                    1,
+                    {'engine': 'kws'}
+                ),
+                (metrics.SUMMARY, 'transcription_seconds', 0.25, {})
+            ]
+        )
+        snapshot = registry.snapshot()
+        self.assertEqual(
+            snapshot['counters']['transcriptions_total'],
+            [((('engine', 'kws'),), 1)]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
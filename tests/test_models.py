@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import sys
+import tempfile
+import types
+import unittest
+from collections import OrderedDict
+from unittest import mock
+from pocketsphinx_kws import models
+
+NAOMI = 'naomi N AY0 OW1 M IY0\n'
+HELLO = [['HH', 'AH0', 'L', 'OW1']]
+
+
+class FakeDecoder(object):
+    """
+    Stands in for a pocketsphinx.Decoder: knows the words of its
+    dictionary and, like the real one, refuses a keyword search with a
+    word it does not know.
+    """
+
+    def __init__(self, config):
+        self.refuse = False
+        self.reinit(config)
+
+    def reinit(self, config):
+        self.config = config
+        with open(config['dict']) as f:
+            self.words = {
+                re.sub(r'\(\d+\)$', '', line.split()[0])
+                for line in f if line.strip()
+            }
+        self.searches = {}
+        self.add_kws('_default', config['kws'])
+        self.search = '_default'
+
+    def lookup_word(self, word):
+        return 'phones' if word in self.words else None
+
+    def add_word(self, word, phones, update):
+        self.words.add(word)
+
+    def add_kws(self, name, path):
+        if self.refuse:
+            self.refuse = False
+            raise RuntimeError('Failed to set up keyword search')
+        with open(path) as f:
+            keyphrases = [
+                line.split('\t')[0] for line in f if line.strip()
+            ]
+        for keyphrase in keyphrases:
+            for word in keyphrase.split():
+                if word not in self.words:
+                    raise RuntimeError('word {} missing'.format(word))
+        self.searches[name] = keyphrases
+
+    def activate_search(self, name):
+        self.search = name
+
+    def current_search(self):
+        return self.search
+
+    def remove_search(self, name):
+        del self.searches[name]
+
+    def keyphrases(self):
+        return self.searches[self.search]
+
+
+def fake_modules():
+    # pocketsphinx with the fake decoder, and just enough of Naomi for
+    # sphinxvocab to import
+    pocketsphinx = types.ModuleType('pocketsphinx')
+    pocketsphinx.pocketsphinx = types.ModuleType('pocketsphinx.pocketsphinx')
+    pocketsphinx.pocketsphinx.Config = dict
+    pocketsphinx.pocketsphinx.Decoder = FakeDecoder
+    naomi = types.ModuleType('naomi')
+    naomi.paths = types.ModuleType('naomi.paths')
+    naomi.profile = types.ModuleType('naomi.profile')
+    return {
+        'pocketsphinx': pocketsphinx,
+        'pocketsphinx.pocketsphinx': pocketsphinx.pocketsphinx,
+        'naomi': naomi,
+        'naomi.paths': naomi.paths,
+        'naomi.profile': naomi.profile
+    }
+
+
+class AddKeywordTest(unittest.TestCase):
+
+    def setUp(self):
+        modules = mock.patch.dict(sys.modules, fake_modules())
+        modules.start()
+        self.addCleanup(modules.stop)
+        from pocketsphinx_kws import sphinxvocab
+        self.sphinxvocab = sphinxvocab
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dict_path = os.path.join(directory.name, 'dictionary')
+        self.kws_path = os.path.join(directory.name, 'kws.thresholds')
+        with open(self.dict_path, 'w') as f:
+            f.write(NAOMI)
+        self.registry = models.ModelRegistry()
+        self.entry, _ = self.registry.acquire(
+            os.path.join(directory.name, 'hmm'),
+            self.dict_path,
+            self.kws_path,
+            OrderedDict([('naomi', -30)])
+        )
+        self.addCleanup(self.registry.release, self.entry)
+        # Builds the pool's decoder
+        with self.entry.pool.decoder() as decoder:
+            self.decoder = decoder
+
+    def lookup(self, pronunciations):
+        converter = mock.Mock()
+        patches = [
+            mock.patch.object(
+                self.sphinxvocab,
+                'create_g2p_converter',
+                return_value=converter
+            ),
+            mock.patch.object(
+                self.sphinxvocab,
+                'lookup_pronunciations',
+                return_value=pronunciations
+            )
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def assertUnchanged(self):
+        self.assertEqual(list(self.entry.thresholds), ['naomi'])
+        self.assertEqual(self.entry.keyword_set, {'naomi'})
+        self.assertEqual(self.read(self.kws_path), 'naomi\t/1e-30/\n')
+        with self.entry.pool.decoder() as decoder:
+            self.assertEqual(decoder.keyphrases(), ['naomi'])
+
+    def test_adds_keyword(self):
+        self.lookup({'hello': HELLO})
+        self.entry.add_keyword('hello', -20)
+        self.assertEqual(list(self.entry.thresholds), ['naomi', 'hello'])
+        self.assertIn('hello HH AH0 L OW1\n', self.read(self.dict_path))
+        with self.entry.pool.decoder() as decoder:
+            self.assertEqual(decoder.keyphrases(), ['naomi', 'hello'])
+
+    def test_word_without_pronunciation_is_rejected(self):
+        self.lookup({'zz9': []})
+        with self.assertRaises(ValueError):
+            self.entry.add_keyword('zz9', -20)
+        self.assertUnchanged()
+        self.assertEqual(self.read(self.dict_path), NAOMI)
+        # The pool still takes new keywords
+        self.lookup({'hello': HELLO})
+        self.entry.add_keyword('hello', -20)
+        self.assertEqual(list(self.entry.thresholds), ['naomi', 'hello'])
+
+    def test_refused_keyword_search_is_rolled_back(self):
+        self.lookup({'hello': HELLO})
+        self.decoder.refuse = True
+        with self.assertRaises(RuntimeError):
+            self.entry.add_keyword('hello', -20)
+        self.assertUnchanged()
+        self.entry.add_keyword('hello', -20)
+        with self.entry.pool.decoder() as decoder:
+            self.assertEqual(decoder.keyphrases(), ['naomi', 'hello'])
+
+    def test_refused_removal_is_rolled_back(self):
+        self.lookup({'hello': HELLO})
+        self.entry.add_keyword('hello', -20)
+        self.decoder.refuse = True
+        with self.assertRaises(RuntimeError):
+            self.entry.remove_keyword('hello')
+        self.assertEqual(list(self.entry.thresholds), ['naomi', 'hello'])
+        with self.entry.pool.decoder() as decoder:
+            self.assertEqual(decoder.keyphrases(), ['naomi', 'hello'])
+
+
+if __name__ == '__main__':
+    unittest.main()
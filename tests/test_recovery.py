@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+import threading
+import unittest
+from pocketsphinx_kws import recovery
+
+
+class FakeDecoder(object):
+
+    def __init__(self, name, failures=0):
+        self.name = name
+        # How many more times decode() raises
+        self.failures = failures
+        self.reinits = 0
+
+    def decode(self):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError('{} failed'.format(self.name))
+        return self.name
+
+
+class DecoderRecoveryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rebuilt = []
+        self.rebuild_failures = 0
+        self.probe_failures = 0
+        self.events = []
+        self.closed = threading.Event()
+
+    def make(self, **kwargs):
+        kwargs.setdefault('backoff', 0)
+        kwargs.setdefault('probe_interval', 0.01)
+        breaker = recovery.DecoderRecovery(
+            self.reinit,
+            self.rebuild,
+            self.probe,
+            **kwargs
+        )
+        breaker.add_listener(self.on_event)
+        return breaker
+
+    def reinit(self, decoder):
+        decoder.reinits += 1
+
+    def rebuild(self, decoder):
+        decoder = FakeDecoder('rebuilt', self.rebuild_failures)
+        self.rebuilt.append(decoder)
+        return decoder
+
+    def probe(self):
+        if self.probe_failures:
+            self.probe_failures -= 1
+            raise RuntimeError('probe failed')
+
+    def on_event(self, event):
+        self.events.append(event)
+        if event.event == 'closed':
+            self.closed.set()
+
+    def names(self):
+        return [event.event for event in self.events]
+
+    def test_success_needs_no_recovery(self):
+        breaker = self.make()
+        decoder = FakeDecoder('first')
+        self.assertEqual(
+            breaker.run(decoder, FakeDecoder.decode),
+            ('first', decoder)
+        )
+        self.assertEqual(self.events, [])
+        self.assertEqual(breaker.state, recovery.CLOSED)
+
+    def test_reinit_recovers(self):
+        breaker = self.make()
+        decoder = FakeDecoder('first', failures=2)
+        result, owned = breaker.run(decoder, FakeDecoder.decode)
+        self.assertEqual(result, 'first')
+        self.assertIs(owned, decoder)
+        self.assertEqual(decoder.reinits, 2)
+        self.assertEqual(self.names(), ['reinit', 'reinit'])
+        self.assertEqual([event.attempt for event in self.events], [1, 2])
+        self.assertEqual(breaker.state, recovery.CLOSED)
+
+    def test_rebuild_after_reinit_attempts(self):
+        breaker = self.make()
+        decoder = FakeDecoder('first', failures=3)
+        result, owned = breaker.run(decoder, FakeDecoder.decode)
+        self.assertEqual(result, 'rebuilt')
+        self.assertIs(owned, self.rebuilt[0])
+        self.assertEqual(self.names(), ['reinit', 'reinit', 'rebuild'])
+        self.assertEqual(breaker.state, recovery.CLOSED)
+
+    def test_circuit_opens_and_fails_fast(self):
+        self.rebuild_failures = 1
+        # Keep the circuit open until the test lets the probe through
+        self.probe_failures = 10 ** 6
+        breaker = self.make()
+        decoder = FakeDecoder('first', failures=3)
+        with self.assertRaises(recovery.DecoderUnavailable) as raised:
+            breaker.run(decoder, FakeDecoder.decode)
+        # The caller owns the rebuilt decoder, not the original one
+        self.assertIs(raised.exception.decoder, self.rebuilt[0])
+        self.assertEqual(breaker.state, recovery.OPEN)
+        self.assertEqual(
+            self.names()[:4],
+            ['reinit', 'reinit', 'rebuild', 'open']
+        )
+        healthy = FakeDecoder('healthy')
+        with self.assertRaises(recovery.DecoderUnavailable) as raised:
+            breaker.run(healthy, FakeDecoder.decode)
+        self.assertIs(raised.exception.decoder, healthy)
+        self.probe_failures = 0
+        self.assertTrue(self.closed.wait(5))
+        self.assertEqual(breaker.state, recovery.CLOSED)
+        self.assertEqual(
+            breaker.run(healthy, FakeDecoder.decode),
+            ('healthy', healthy)
+        )
+
+    def test_failed_probes_keep_the_circuit_open(self):
+        self.probe_failures = 2
+        breaker = self.make(reinit_attempts=0, rebuild_attempts=0)
+        with self.assertRaises(recovery.DecoderUnavailable):
+            breaker.run(FakeDecoder('first', failures=1), FakeDecoder.decode)
+        self.assertTrue(self.closed.wait(5))
+        self.assertEqual(
+            self.names(),
+            ['open', 'probe_failed', 'probe_failed', 'closed']
+        )
+        self.assertEqual(self.events[-1].attempt, 3)
+
+    def test_failed_recovery_step_is_retried(self):
+        def rebuild(decoder):
+            raise RuntimeError('cannot build a decoder')
+
+        self.rebuild = rebuild
+        breaker = self.make(reinit_attempts=0, rebuild_attempts=2)
+        decoder = FakeDecoder('first', failures=2)
+        result, owned = breaker.run(decoder, FakeDecoder.decode)
+        self.assertEqual(result, 'first')
+        self.assertIs(owned, decoder)
+        self.assertEqual(self.names(), ['rebuild', 'rebuild'])
+
+    def test_only_runtime_errors_are_recovered(self):
+        breaker = self.make()
+
+        def operation(decoder):
+            raise ValueError('bad audio')
+
+        with self.assertRaises(ValueError):
+            breaker.run(FakeDecoder('first'), operation)
+        self.assertEqual(self.events, [])
+
+    def test_from_profile(self):
+        breaker = recovery.DecoderRecovery.from_profile(
+            {'reinit_attempts': '3', 'probe_interval': '1.5'},
+            self.reinit,
+            self.rebuild,
+            self.probe
+        )
+        self.assertEqual(breaker.reinit_attempts, 3)
+        self.assertEqual(breaker.rebuild_attempts, 1)
+        self.assertEqual(breaker.probe_interval, 1.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+import json
+import math
+import os
+import tempfile
+import unittest
+import numpy as np
+from pocketsphinx_kws import audio
+from pocketsphinx_kws import scoreboard
+
+SAMPLERATE = scoreboard.SAMPLERATE
+
+
+def rms(samples):
+    samples = np.asarray(samples, dtype=np.float64)
+    return math.sqrt(np.mean(samples * samples))
+
+
+def tone(seconds, amplitude=8000, frequency=440):
+    t = np.arange(int(seconds * SAMPLERATE)) / SAMPLERATE
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.int16)
+
+
+class MixTest(unittest.TestCase):
+
+    def test_noise_is_scaled_to_the_snr(self):
+        keyword = tone(0.5)
+        noise = np.random.default_rng(1).normal(0, 1000, SAMPLERATE * 2)
+        offset = SAMPLERATE // 2
+        for snr in (20, 10, 0):
+            mixed = scoreboard.mix(keyword, noise, offset, snr)
+            self.assertEqual(mixed.dtype, np.int16)
+            self.assertEqual(len(mixed), len(noise))
+            region = mixed[offset:offset + len(keyword)].astype(np.float64)
+            background = region - keyword
+            measured = 20 * math.log10(rms(keyword) / rms(background))
+            self.assertAlmostEqual(measured, snr, delta=0.1)
+
+    def test_keyword_is_placed_at_the_offset(self):
+        keyword = tone(0.25)
+        noise = np.zeros(SAMPLERATE)
+        mixed = scoreboard.mix(keyword, noise, 1000, 10)
+        self.assertFalse(mixed[:1000].any())
+        np.testing.assert_array_equal(
+            mixed[1000:1000 + len(keyword)],
+            keyword
+        )
+        self.assertFalse(mixed[1000 + len(keyword):].any())
+
+    def test_loud_mix_is_clipped(self):
+        keyword = np.full(100, 30000, dtype=np.int16)
+        noise = np.full(200, 1000.0)
+        mixed = scoreboard.mix(keyword, noise, 0, -10)
+        self.assertEqual(mixed.max(), 32767)
+
+
+class GenerateTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.keywords = os.path.join(self.directory, 'keywords')
+        os.makedirs(os.path.join(self.keywords, 'Naomi'))
+        scoreboard._write_wav(
+            os.path.join(self.keywords, 'Naomi', 'one.wav'),
+            tone(0.5)
+        )
+
+    def generate(self, name, seed=0):
+        output = os.path.join(self.directory, name)
+        count = scoreboard.generate(
+            self.keywords,
+            output,
+            snrs=(10, 0),
+            offsets=(0.25, 1.8),
+            clip_seconds=2.0,
+            negatives=3,
+            seed=seed
+        )
+        return output, count
+
+    def test_corpus_layout(self):
+        output, count = self.generate('corpus')
+        # The keyword does not fit at 1.8 seconds, so only 0.25 is used
+        self.assertEqual(count, 2 + 3)
+        entries = scoreboard.read_manifest(output)
+        self.assertEqual(len(entries), count)
+        positives = [e for e in entries if e['keyword']]
+        self.assertEqual(sorted(e['snr'] for e in positives), [0, 10])
+        for entry in positives:
+            self.assertEqual(entry['keyword'], 'naomi')
+            self.assertEqual(entry['start'], 0.25)
+            self.assertAlmostEqual(entry['end'], 0.75)
+        for entry in entries:
+            samples = audio.load_audio(entry['file'], SAMPLERATE)
+            self.assertEqual(len(samples), 2 * SAMPLERATE)
+            label = os.path.splitext(entry['file'])[0] + '.txt'
+            with open(label) as f:
+                self.assertEqual(f.read().strip(), entry['keyword'] or '')
+
+    def test_same_seed_same_corpus(self):
+        first, _ = self.generate('first', seed=3)
+        second, _ = self.generate('second', seed=3)
+        third, _ = self.generate('third', seed=4)
+        name = 'negative_000.wav'
+        with open(os.path.join(first, name), 'rb') as f:
+            clip = f.read()
+        with open(os.path.join(second, name), 'rb') as f:
+            self.assertEqual(f.read(), clip)
+        with open(os.path.join(third, name), 'rb') as f:
+            self.assertNotEqual(f.read(), clip)
+        with open(os.path.join(first, scoreboard.MANIFEST)) as f:
+            first_manifest = [json.loads(line) for line in f]
+        with open(os.path.join(second, scoreboard.MANIFEST)) as f:
+            second_manifest = [json.loads(line) for line in f]
+        self.assertEqual(first_manifest, second_manifest)
+
+
+def entry(keyword, end=1.0):
+    return {'keyword': keyword, 'start': end - 0.5, 'end': end}
+
+
+def result(detections, duration=1800.0):
+    return {'duration': duration, 'detections': detections}
+
+
+class ScoreTest(unittest.TestCase):
+
+    def test_hits_misses_and_false_alarms(self):
+        entries = [
+            entry('naomi'),
+            entry('naomi'),
+            entry('naomi'),
+            entry(None),
+        ]
+        results = [
+            result([('naomi', 1.25)]),
+            result([('naomi', 1.75), ('naomi', 2.0)]),
+            result([]),
+            result([('naomi', 0.5)]),
+        ]
+        report = scoreboard.score(entries, results)['naomi']
+        self.assertEqual(report['hits'], 2)
+        self.assertEqual(report['misses'], 1)
+        # The repeated detection and the one in the noise clip
+        self.assertEqual(report['false_alarms'], 2)
+        self.assertAlmostEqual(report['hit_rate'], 2 / 3)
+        # Four half hour clips
+        self.assertAlmostEqual(report['false_alarms_per_hour'], 1.0)
+        self.assertAlmostEqual(report['latency_mean'], 0.5)
+        self.assertAlmostEqual(report['latency_p95'], 0.75)
+
+    def test_detection_before_the_end_has_no_latency(self):
+        report = scoreboard.score(
+            [entry('naomi', end=1.0)],
+            [result([('naomi', 0.9)])]
+        )
+        self.assertEqual(report['naomi']['latency_mean'], 0.0)
+
+    def test_other_keywords_are_false_alarms(self):
+        report = scoreboard.score(
+            [entry('naomi'), entry('computer')],
+            [result([('computer', 1.1)]), result([('computer', 1.1)])]
+        )
+        self.assertEqual(report['naomi']['misses'], 1)
+        self.assertEqual(report['computer']['hits'], 1)
+        self.assertEqual(report['computer']['false_alarms'], 1)
+
+
+def report(hit_rate=0.95, false_alarms=0.5, latency=0.3):
+    return {
+        'utterance': {
+            'keywords': {
+                'naomi': {
+                    'hit_rate': hit_rate,
+                    'false_alarms_per_hour': false_alarms,
+                    'latency_p95': latency
+                }
+            }
+        }
+    }
+
+
+class CheckGatesTest(unittest.TestCase):
+
+    def test_passing_report(self):
+        self.assertEqual(
+            scoreboard.check_gates(
+                report(),
+                min_hit_rate=0.9,
+                max_false_alarms=1.0,
+                max_latency=0.5,
+                baseline=report()
+            ),
+            []
+        )
+
+    def test_limits(self):
+        failures = scoreboard.check_gates(
+            report(hit_rate=0.8, false_alarms=2.0, latency=0.7),
+            min_hit_rate=0.9,
+            max_false_alarms=1.0,
+            max_latency=0.5
+        )
+        self.assertEqual(len(failures), 3)
+        self.assertTrue(all('naomi (utterance)' in f for f in failures))
+
+    def test_baseline_regression(self):
+        failures = scoreboard.check_gates(
+            report(hit_rate=0.9, false_alarms=0.6),
+            baseline=report(hit_rate=0.95, false_alarms=0.5)
+        )
+        self.assertEqual(len(failures), 2)
+        self.assertIn('hit rate fell', failures[0])
+        self.assertIn('false alarms/hour rose', failures[1])
+
+    def test_baseline_tolerance(self):
+        self.assertEqual(
+            scoreboard.check_gates(
+                report(hit_rate=0.94, false_alarms=0.51),
+                baseline=report(hit_rate=0.95, false_alarms=0.5)
+            ),
+            []
+        )
+
+    def test_keyword_missing_from_baseline(self):
+        baseline = {'utterance': {'keywords': {}}}
+        self.assertEqual(
+            scoreboard.check_gates(report(), baseline=baseline),
+            []
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
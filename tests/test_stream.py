@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import struct
+import unittest
+from collections import namedtuple
+from pocketsphinx_kws.decoderpool import DecoderPool
+from pocketsphinx_kws.stream import ContinuousListener, KeywordStream
+
+SAMPRATE = 16000
+FRATE = 100
+
+Segment = namedtuple('Segment', ['word', 'start_frame', 'end_frame', 'prob'])
+
+
+class FakeDecoder(object):
+    """
+    Stands in for a pocketsphinx.Decoder: reports the keyword of the
+    active search at the first loud sample of an utterance.
+    """
+
+    def __init__(self, keyword):
+        self.config = {'samprate': SAMPRATE, 'frate': FRATE}
+        self.keyword = keyword
+        self._segments = []
+        self._samples = 0
+
+    def start_utt(self):
+        self._segments = []
+        self._samples = 0
+
+    def end_utt(self):
+        pass
+
+    def process_raw(self, data, no_search, full_utt):
+        samples = struct.unpack('<{}h'.format(len(data) // 2), data)
+        for index, sample in enumerate(samples):
+            if abs(sample) > 10000 and not self._segments:
+                frame = (self._samples + index) * FRATE // SAMPRATE
+                self._segments.append(
+                    Segment(self.keyword + ' ', frame, frame + 50, -1000)
+                )
+        self._samples += len(samples)
+
+    def hyp(self):
+        return self._segments[0].word if self._segments else None
+
+    def seg(self):
+        return list(self._segments)
+
+
+def silence(seconds):
+    return bytes(int(seconds * SAMPRATE) * 2)
+
+
+def speech(seconds):
+    return struct.pack('<h', 20000) * int(seconds * SAMPRATE)
+
+
+class KeywordChangeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = DecoderPool(lambda: FakeDecoder('naomi'))
+        self.keywords = {'naomi'}
+
+    def add_keyword(self, keyword):
+        # What the plugin does in add_keyword(), with a fake search
+        self.keywords.clear()
+        self.keywords.add(keyword)
+
+        def configure(decoder):
+            decoder.keyword = keyword
+
+        self.pool.reconfigure(configure)
+
+    def test_open_stream_picks_up_added_keyword(self):
+        decoder = self.pool.checkout()
+        stream = KeywordStream(
+            decoder,
+            self.keywords,
+            on_close=self.pool.checkin,
+            on_restart=self.pool.refresh,
+            is_current=self.pool.is_current
+        )
+        self.assertEqual(stream.process(silence(0.5)), [])
+        self.add_keyword('hello')
+        events = stream.process(speech(0.1))
+        self.assertEqual([event.keyword for event in events], ['hello'])
+        self.assertEqual(events[0].start_frame, 50)
+        stream.close()
+
+    def test_open_listener_picks_up_added_keyword(self):
+        decoder = self.pool.checkout()
+        listener = ContinuousListener(
+            decoder,
+            self.keywords,
+            on_close=self.pool.checkin,
+            on_restart=self.pool.refresh,
+            is_current=self.pool.is_current
+        )
+        self.assertEqual(listener.process(silence(2)), [])
+        self.add_keyword('hello')
+        events = listener.process(speech(0.1))
+        self.assertEqual([event.keyword for event in events], ['hello'])
+        self.assertEqual(events[0].start_frame, 200)
+        listener.close()
+
+
+class ContinuousListenerOverlapTest(unittest.TestCase):
+
+    def test_overlap_shorter_than_a_frame_is_off(self):
+        for overlap in (0, 0.001):
+            listener = ContinuousListener(
+                FakeDecoder('naomi'),
+                {'naomi'},
+                reset_interval=1,
+                overlap=overlap
+            )
+            self.assertEqual(listener.process(silence(1.5)), [])
+            events = listener.process(speech(0.1))
+            self.assertEqual([event.keyword for event in events], ['naomi'])
+            self.assertEqual(events[0].start_frame, 150)
+            listener.close()
+
+    def test_negative_overlap_is_rejected(self):
+        with self.assertRaises(ValueError):
+            ContinuousListener(FakeDecoder('naomi'), {'naomi'}, overlap=-1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Finds keyword thresholds from a directory of labelled recordings.
+
+Every clip is decoded once, with all keywords at the most permissive
+threshold, and the score of each detection is recorded. Whether a
+detection would have fired at a stricter threshold only depends on its
+score, so the whole threshold grid is then evaluated from the recorded
+scores without decoding again.
+
+Each recording "clip.wav" is labelled by a "clip.txt" next to it holding
+the transcript of what was said. A clip without a transcript is treated
+as containing no keywords.
+
+    python -m pocketsphinx_kws.tuner recordings/ --hmm ~/model/en-us \\
+        --dict ~/.config/naomi/vocabularies/.../dictionary \\
+        --keyword naomi --keyword magicvoice -o tuning.json
+"""
+import argparse
+import glob
+import json
+import logging
+import math
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from . import offline
+
+# The range of thresholds (as powers of ten) that the spotter accepts
+MIN_THRESHOLD = -80
+MAX_THRESHOLD = 80
+# pocketsphinx scales log probabilities down by this many bits before
+# comparing them against a keyword threshold
+SENSCR_SHIFT = 10
+
+
+def threshold_score(threshold, logbase=1.0001):
+    """
+    Converts a threshold as written in kws.thresholds (1e<threshold>) to
+    the score units reported by the decoder in seg().prob.
+    """
+    return int(threshold * math.log(10) / math.log(logbase)) >> SENSCR_SHIFT
+
+
+def read_labels(path):
+    """
+    Returns:
+        A list of the lower case words in the transcript for the WAV
+        file at path, or an empty list if it has none
+    """
+    label_path = os.path.splitext(path)[0] + '.txt'
+    if not os.path.isfile(label_path):
+        return []
+    with open(label_path, 'r') as f:
+        return f.read().lower().split()
+
+
+def write_permissive_thresholds(path, keywords):
+    with open(path, 'w') as f:
+        for keyword in keywords:
+            f.write("{}\t/1e{}/\n".format(keyword, MIN_THRESHOLD))
+
+
+def decode_corpus(files, hmm_dir, dict_path, keywords, workers=None):
+    """
+    Decodes every file once at the most permissive threshold, spread
+    across a pool of worker processes.
+
+    Returns:
+        A list of decode_file() results in the same order as files
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        kws_path = os.path.join(directory, 'kws.thresholds')
+        write_permissive_thresholds(kws_path, keywords)
+        args = offline.decoder_args(hmm_dir, dict_path, kws_path)
+        with ProcessPoolExecutor(
+            max_workers=workers or os.cpu_count(),
+            initializer=offline.init_worker,
+            initargs=(args,)
+        ) as executor:
+            return list(executor.map(offline.decode_file, files, chunksize=4))
+
+
+def count_phrase(words, phrase):
+    """
+    Counts how often phrase, one or more words, is said in a list of
+    words. Overlapping occurrences are counted once.
+    """
+    phrase = phrase.split()
+    if not phrase:
+        return 0
+    count = 0
+    index = 0
+    while index + len(phrase) <= len(words):
+        if words[index:index + len(phrase)] == phrase:
+            count += 1
+            index += len(phrase)
+        else:
+            index += 1
+    return count
+
+
+def evaluate(results, labels, keywords, thresholds, logbase=1.0001):
+    """
+    Evaluates every threshold for every keyword from recorded scores.
+
+    Arguments:
+        results -- decode_corpus() output
+        labels -- list of label word lists, one per result
+        keywords -- the keywords to evaluate
+        thresholds -- the threshold exponents to evaluate
+
+    Returns:
+        A dict mapping each keyword to a list of curve points, one per
+        threshold, with hits, misses, false alarms, hit rate and false
+        alarms per hour
+    """
+    hours = sum(result['duration'] for result in results) / 3600
+    curves = {}
+    for keyword in keywords:
+        # For every clip, the number of times the keyword was said and
+        # the scores of its detections
+        clips = [
+            (
+                count_phrase(label, keyword),
+                [d[3] for d in result['detections'] if d[0] == keyword]
+            )
+            for result, label in zip(results, labels)
+        ]
+        spoken = sum(count for count, _ in clips)
+        points = []
+        for threshold in thresholds:
+            minimum = threshold_score(threshold, logbase)
+            hits = false_alarms = 0
+            for count, scores in clips:
+                detected = sum(1 for score in scores if score >= minimum)
+                hits += min(detected, count)
+                false_alarms += max(0, detected - count)
+            points.append({
+                'threshold': threshold,
+                'hits': hits,
+                'misses': spoken - hits,
+                'false_alarms': false_alarms,
+                'hit_rate': hits / spoken if spoken else None,
+                'false_alarms_per_hour': (
+                    false_alarms / hours if hours else None
+                )
+            })
+        curves[keyword] = points
+    return curves
+
+
+def best_threshold(points, max_false_alarms_per_hour=1.0):
+    """
+    Picks the threshold with the best hit rate among those that stay
+    under max_false_alarms_per_hour. If none do, the threshold with the
+    fewest false alarms is returned. Ties go to the stricter threshold.
+    """
+    def hit_rate(point):
+        return point['hit_rate'] or 0.0
+
+    acceptable = [
+        point for point in points
+        if (point['false_alarms_per_hour'] or 0.0) <= max_false_alarms_per_hour
+    ]
+    if acceptable:
+        return max(acceptable, key=lambda p: (hit_rate(p), p['threshold']))
+    return min(
+        points,
+        key=lambda p: (p['false_alarms'], -hit_rate(p), -p['threshold'])
+    )
+
+
+def tune(directory, hmm_dir, dict_path, keywords, thresholds=None,
+         max_false_alarms_per_hour=1.0, workers=None):
+    """
+    Decodes the labelled recordings in directory once and evaluates the
+    threshold grid for each keyword.
+
+    Returns:
+        A dict with the ROC/DET curve and best threshold per keyword
+    """
+    logger = logging.getLogger(__name__)
+    keywords = [keyword.lower() for keyword in keywords]
+    if thresholds is None:
+        thresholds = list(range(MIN_THRESHOLD, MAX_THRESHOLD + 1))
+    files = sorted(glob.glob(os.path.join(directory, '*.wav')))
+    if not files:
+        raise ValueError("No recordings found in '{}'".format(directory))
+    logger.info('Decoding %d recordings', len(files))
+    results = decode_corpus(files, hmm_dir, dict_path, keywords, workers)
+    labels = [read_labels(path) for path in files]
+    curves = evaluate(results, labels, keywords, thresholds)
+    return {
+        'recordings': len(files),
+        'audio_seconds': sum(result['duration'] for result in results),
+        'keywords': {
+            keyword: {
+                'best': best_threshold(points, max_false_alarms_per_hour),
+                'curve': points
+            }
+            for keyword, points in curves.items()
+        }
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Find keyword thresholds from labelled recordings'
+    )
+    parser.add_argument('directory',
+                        help='directory of .wav files with .txt transcripts')
+    parser.add_argument('--hmm', required=True,
+                        help='pocketsphinx acoustic model directory')
+    parser.add_argument('--dict', required=True,
+                        help='pronunciation dictionary containing the keywords')
+    parser.add_argument('--keyword', action='append', required=True,
+                        help='keyword to tune, may be repeated')
+    parser.add_argument('--max-false-alarms', type=float, default=1.0,
+                        help='false alarms per hour allowed for the best threshold')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of decoding processes (default: all CPUs)')
+    parser.add_argument('-o', '--output',
+                        help='write the full JSON report here')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    report = tune(
+        args.directory,
+        args.hmm,
+        args.dict,
+        args.keyword,
+        max_false_alarms_per_hour=args.max_false_alarms,
+        workers=args.workers
+    )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print("Pocketsphinx_KWS:")
+    print("    thresholds:")
+    for keyword, result in report['keywords'].items():
+        best = result['best']
+        print("        {}: {}  # hit rate {}, {} false alarms per hour".format(
+            keyword,
+            best['threshold'],
+            best['hit_rate'],
+            best['false_alarms_per_hour']
+        ))
+
+
+if __name__ == '__main__':
+    main()
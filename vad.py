@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+A cheap energy and zero crossing rate voice activity filter, used to
+keep silence and background noise away from the decoder.
+"""
+import numpy as np
+
+
+class EnergyVAD(object):
+    """
+    Splits audio into short frames, marks frames as speech by their
+    energy and zero crossing rate, and keeps only the speech regions
+    (padded by the hangover on both sides).
+
+    A frame counts as speech if its energy is at least energy_threshold
+    dBFS, or if it is within zcr_energy_margin dB of the threshold and
+    its zero crossing rate is at least zcr_threshold. The second rule
+    keeps quiet fricatives such as the "s" in "magicvoice".
+    """
+
+    def __init__(
+        self,
+        energy_threshold=-45.0,
+        zcr_threshold=0.25,
+        zcr_energy_margin=10.0,
+        hangover=0.3,
+        frame_length=0.02,
+        gap=0.1
+    ):
+        """
+        Arguments:
+            energy_threshold -- frame energy in dBFS above which a frame
+                                is speech
+            zcr_threshold -- zero crossings per sample above which a
+                             quieter frame is still speech
+            zcr_energy_margin -- how far below energy_threshold (in dB)
+                                 the zero crossing rule applies
+            hangover -- seconds of audio kept before and after speech
+            frame_length -- analysis frame length in seconds
+            gap -- seconds of silence kept between two speech regions so
+                   the decoder still sees a pause between them
+        """
+        self.energy_threshold = energy_threshold
+        self.zcr_threshold = zcr_threshold
+        self.zcr_energy_margin = zcr_energy_margin
+        self.hangover = hangover
+        self.frame_length = frame_length
+        self.gap = gap
+
+    @classmethod
+    def from_profile(cls, settings):
+        """
+        Builds a filter from the Pocketsphinx_KWS.vad profile section.
+        """
+        return cls(
+            energy_threshold=float(settings.get('energy_threshold', -45.0)),
+            zcr_threshold=float(settings.get('zcr_threshold', 0.25)),
+            zcr_energy_margin=float(settings.get('zcr_energy_margin', 10.0)),
+            hangover=float(settings.get('hangover', 0.3)),
+            frame_length=float(settings.get('frame_length', 0.02)),
+            gap=float(settings.get('gap', 0.1))
+        )
+
+    def features(self, samples, samplerate):
+        """
+        Computes per frame energy and zero crossing rate for all frames
+        at once.
+
+        Returns:
+            A tuple of (energy in dBFS, zero crossings per sample)
+            arrays, one entry per frame. A trailing partial frame is
+            ignored.
+        """
+        frame = max(1, int(self.frame_length * samplerate))
+        count = len(samples) // frame
+        frames = samples[:count * frame].reshape(count, frame)
+        frames = frames.astype(np.float32)
+        rms = np.sqrt(np.mean(frames * frames, axis=1))
+        energy = 20 * np.log10(np.maximum(rms, 1e-3) / 32768)
+        signs = np.signbit(frames)
+        zcr = np.count_nonzero(
+            signs[:, 1:] != signs[:, :-1],
+            axis=1
+        ) / frame
+        return energy, zcr
+
+    def speech_mask(self, samples, samplerate):
+        """
+        Returns:
+            A boolean array with one entry per frame, True where the
+            frame is speech or within the hangover of speech
+        """
+        energy, zcr = self.features(samples, samplerate)
+        mask = (energy >= self.energy_threshold) | (
+            (zcr >= self.zcr_threshold)
+            & (energy >= self.energy_threshold - self.zcr_energy_margin)
+        )
+        hangover = int(round(self.hangover / self.frame_length))
+        if hangover and mask.any():
+            # Widen every speech region by the hangover on both sides
+            window = np.ones(2 * hangover + 1, dtype=np.int32)
+            mask = np.convolve(mask.astype(np.int32), window, 'same') > 0
+        return mask
+
+    def filter(self, samples, samplerate):
+        """
+        Drops the non-speech regions of a clip.
+
+        Arguments:
+            samples -- 1d int16 array
+            samplerate -- sample rate of samples
+
+        Returns:
+            An int16 array holding only the speech regions, separated by
+            gap seconds of silence, or an empty array if the clip has no
+            speech at all
+        """
+        return self.filter_regions(samples, samplerate)[0]
+
+    def filter_regions(self, samples, samplerate):
+        """
+        Drops the non-speech regions of a clip, like filter(), and
+        reports where the kept regions came from.
+
+        Returns:
+            A tuple of the filtered samples and a list of (output start,
+            input start, length) tuples in samples, one per kept region,
+            for map_sample()
+        """
+        mask = self.speech_mask(samples, samplerate)
+        if not mask.any():
+            return samples[:0], []
+        if mask.all():
+            return samples, [(0, 0, len(samples))]
+        frame = max(1, int(self.frame_length * samplerate))
+        # Boundaries of runs of speech frames
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], mask, [0]))))
+        starts, ends = edges[0::2] * frame, edges[1::2] * frame
+        # Speech running into the trailing partial frame keeps it
+        if mask[-1]:
+            ends[-1] = len(samples)
+        silence = np.zeros(int(self.gap * samplerate), dtype=samples.dtype)
+        pieces = []
+        regions = []
+        position = 0
+        for start, end in zip(starts, ends):
+            if pieces:
+                pieces.append(silence)
+                position += len(silence)
+            pieces.append(samples[start:end])
+            regions.append((position, int(start), int(end - start)))
+            position += int(end - start)
+        return np.concatenate(pieces), regions
+
+
+def map_sample(regions, sample):
+    """
+    Maps a sample offset in filtered audio back to the original clip.
+    Offsets in the silence inserted between two regions map to the end
+    of the region before it.
+
+    Arguments:
+        regions -- the regions returned by EnergyVAD.filter_regions()
+        sample -- an offset into the filtered audio
+
+    Returns:
+        The offset in the original audio
+    """
+    for output_start, input_start, length in reversed(regions):
+        if sample >= output_start:
+            return input_start + min(sample - output_start, length)
+    return sample